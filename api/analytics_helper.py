@@ -4,13 +4,23 @@ Provides data aggregation functions for analytics dashboards
 """
 
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
 import db
 
 logger = logging.getLogger(__name__)
 
 
+def _date_range(days: int) -> Tuple[datetime, datetime]:
+    """UTC window ending now"""
+    end_date = datetime.now(timezone.utc)
+    return end_date - timedelta(days=days), end_date
+
+
+def _success_rate(successful: int, total: int) -> float:
+    return round(successful / total * 100, 1) if total > 0 else 0
+
+
 def get_execution_stats(company_id: Optional[str] = None, user_id: Optional[str] = None, days: int = 30) -> Dict:
     """
     Get execution statistics for a given scope
@@ -24,57 +34,19 @@ def get_execution_stats(company_id: Optional[str] = None, user_id: Optional[str]
         Dict with execution statistics
     """
     try:
-        # Calculate date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Get all workflow executions in date range
-        executions = db.get_all_workflow_executions(limit=10000)  # Large limit to get all
-        
-        # Filter by date range
-        executions = [
-            e for e in executions
-            if e.get('started_at') and 
-            start_date <= datetime.fromisoformat(e['started_at'].replace('Z', '+00:00')) <= end_date
-        ]
-        
-        # Filter by company_id if provided
-        if company_id:
-            # Get workflow activations for this company
-            company_activations = db.get_company_activations(company_id)
-            activation_ids = {a['id'] for a in company_activations}
-            executions = [
-                e for e in executions
-                if e.get('workflow_activation_id') in activation_ids
-            ]
-        
-        # Filter by user_id if provided
-        elif user_id:
-            # Get user's workflow activations
-            user_activations = db.get_user_workflow_activations(user_id)
-            activation_ids = {a['id'] for a in user_activations}
-            executions = [
-                e for e in executions
-                if e.get('workflow_activation_id') in activation_ids
-            ]
+        start_date, end_date = _date_range(days)
         
-        # Calculate statistics
-        total_executions = len(executions)
-        successful = len([e for e in executions if e.get('status') == 'success'])
-        failed = len([e for e in executions if e.get('status') == 'failed'])
-        
-        success_rate = (successful / total_executions * 100) if total_executions > 0 else 0
-        
-        # Calculate average duration
-        durations = [e.get('duration_ms', 0) for e in executions if e.get('duration_ms')]
-        avg_duration = sum(durations) / len(durations) if durations else 0
+        # Counts and average are computed in the database for the whole range
+        row = db.get_execution_stats(start_date, end_date, company_id=company_id, user_id=user_id) or {}
+        total_executions = row.get('total') or 0
+        successful = row.get('successful') or 0
         
         return {
             'total_executions': total_executions,
             'successful': successful,
-            'failed': failed,
-            'success_rate': round(success_rate, 1),
-            'avg_duration_ms': round(avg_duration, 0),
+            'failed': row.get('failed') or 0,
+            'success_rate': _success_rate(successful, total_executions),
+            'avg_duration_ms': round(float(row.get('avg_duration_ms') or 0), 0),
             'date_range': {
                 'start': start_date.isoformat(),
                 'end': end_date.isoformat(),
@@ -111,33 +83,10 @@ def get_workflow_performance(workflow_id: str, company_id: Optional[str] = None,
         if not workflow:
             return {'error': 'Workflow not found'}
         
-        # Get executions for this workflow
-        executions = db.get_all_workflow_executions(workflow_id=workflow_id, limit=1000)
-        
-        # Filter by date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        executions = [
-            e for e in executions
-            if e.get('started_at') and
-            start_date <= datetime.fromisoformat(e['started_at'].replace('Z', '+00:00')) <= end_date
-        ]
-        
-        # Calculate metrics
-        total_runs = len(executions)
-        successful_runs = len([e for e in executions if e.get('status') == 'success'])
-        failed_runs = len([e for e in executions if e.get('status') == 'failed'])
-        
-        success_rate = (successful_runs / total_runs * 100) if total_runs > 0 else 0
-        
-        # Duration statistics
-        durations = [e.get('duration_ms', 0) for e in executions if e.get('duration_ms')]
-        avg_duration = sum(durations) / len(durations) if durations else 0
-        min_duration = min(durations) if durations else 0
-        max_duration = max(durations) if durations else 0
-        
-        # Get most recent execution
-        most_recent = executions[0] if executions else None
+        start_date, end_date = _date_range(days)
+        row = db.get_execution_stats(start_date, end_date, company_id=company_id, workflow_id=workflow_id) or {}
+        total_runs = row.get('total') or 0
+        successful_runs = row.get('successful') or 0
         
         return {
             'workflow': {
@@ -147,14 +96,14 @@ def get_workflow_performance(workflow_id: str, company_id: Optional[str] = None,
             },
             'total_runs': total_runs,
             'successful_runs': successful_runs,
-            'failed_runs': failed_runs,
-            'success_rate': round(success_rate, 1),
+            'failed_runs': row.get('failed') or 0,
+            'success_rate': _success_rate(successful_runs, total_runs),
             'duration': {
-                'avg_ms': round(avg_duration, 0),
-                'min_ms': min_duration,
-                'max_ms': max_duration
+                'avg_ms': round(float(row.get('avg_duration_ms') or 0), 0),
+                'min_ms': row.get('min_duration_ms') or 0,
+                'max_ms': row.get('max_duration_ms') or 0
             },
-            'most_recent_execution': most_recent.get('started_at') if most_recent else None,
+            'most_recent_execution': row.get('last_started_at'),
             'date_range': {
                 'start': start_date.isoformat(),
                 'end': end_date.isoformat(),
@@ -171,7 +120,7 @@ def get_timeline_data(start_date: datetime, end_date: datetime, company_id: Opti
     Get execution timeline data for charting
     
     Args:
-        start_date: Start date
+        start_date: Start date (naive datetimes are treated as UTC)
         end_date: End date
         company_id: Filter by company (optional)
         user_id: Filter by user (optional)
@@ -180,60 +129,17 @@ def get_timeline_data(start_date: datetime, end_date: datetime, company_id: Opti
         List of daily execution counts
     """
     try:
-        # Get all executions
-        executions = db.get_all_workflow_executions(limit=10000)
-        
-        # Filter by date range
-        executions = [
-            e for e in executions
-            if e.get('started_at') and
-            start_date <= datetime.fromisoformat(e['started_at'].replace('Z', '+00:00')) <= end_date
-        ]
-        
-        # Filter by scope
-        if company_id:
-            company_activations = db.get_company_activations(company_id)
-            activation_ids = {a['id'] for a in company_activations}
-            executions = [e for e in executions if e.get('workflow_activation_id') in activation_ids]
-        elif user_id:
-            user_activations = db.get_user_workflow_activations(user_id)
-            activation_ids = {a['id'] for a in user_activations}
-            executions = [e for e in executions if e.get('workflow_activation_id') in activation_ids]
-        
-        # Group by date
-        daily_counts = {}
-        current_date = start_date.date()
-        end = end_date.date()
-        
-        while current_date <= end:
-            daily_counts[current_date.isoformat()] = {'success': 0, 'failed': 0, 'total': 0}
-            current_date += timedelta(days=1)
-        
-        # Count executions per day
-        for execution in executions:
-            if execution.get('started_at'):
-                exec_date = datetime.fromisoformat(execution['started_at'].replace('Z', '+00:00')).date()
-                date_str = exec_date.isoformat()
-                
-                if date_str in daily_counts:
-                    daily_counts[date_str]['total'] += 1
-                    if execution.get('status') == 'success':
-                        daily_counts[date_str]['success'] += 1
-                    elif execution.get('status') == 'failed':
-                        daily_counts[date_str]['failed'] += 1
-        
-        # Convert to list format
-        timeline = [
+        # The database buckets by day and fills in days without executions
+        rows = db.get_execution_timeline(start_date, end_date, company_id=company_id, user_id=user_id)
+        return [
             {
-                'date': date,
-                'success': counts['success'],
-                'failed': counts['failed'],
-                'total': counts['total']
+                'date': row['day'],
+                'success': row.get('success') or 0,
+                'failed': row.get('failed') or 0,
+                'total': row.get('total') or 0
             }
-            for date, counts in sorted(daily_counts.items())
+            for row in rows
         ]
-        
-        return timeline
     except Exception as e:
         logger.error(f"Error getting timeline data: {e}")
         return []
@@ -253,64 +159,21 @@ def get_top_workflows(company_id: Optional[str] = None, user_id: Optional[str] =
         List of workflows with execution counts
     """
     try:
-        # Get executions
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        executions = db.get_all_workflow_executions(limit=10000)
-        executions = [
-            e for e in executions
-            if e.get('started_at') and
-            start_date <= datetime.fromisoformat(e['started_at'].replace('Z', '+00:00')) <= end_date
+        start_date, end_date = _date_range(days)
+        rows = db.get_top_workflows(start_date, end_date, company_id=company_id, user_id=user_id, limit=limit)
+        return [
+            {
+                'workflow': {
+                    'id': row['workflow_id'],
+                    'name': row['workflow_name']
+                },
+                'executions': row['total'],
+                'success': row['success'],
+                'failed': row['failed'],
+                'success_rate': _success_rate(row['success'], row['total'])
+            }
+            for row in rows
         ]
-        
-        # Filter by scope
-        if company_id:
-            company_activations = db.get_company_activations(company_id)
-            activation_ids = {a['id'] for a in company_activations}
-            executions = [e for e in executions if e.get('workflow_activation_id') in activation_ids]
-        elif user_id:
-            user_activations = db.get_user_workflow_activations(user_id)
-            activation_ids = {a['id'] for a in user_activations}
-            executions = [e for e in executions if e.get('workflow_activation_id') in activation_ids]
-        
-        # Count by workflow
-        workflow_counts = {}
-        for execution in executions:
-            workflow_id = execution.get('workflow_id')
-            if workflow_id:
-                if workflow_id not in workflow_counts:
-                    workflow_counts[workflow_id] = {
-                        'total': 0,
-                        'success': 0,
-                        'failed': 0
-                    }
-                workflow_counts[workflow_id]['total'] += 1
-                if execution.get('status') == 'success':
-                    workflow_counts[workflow_id]['success'] += 1
-                elif execution.get('status') == 'failed':
-                    workflow_counts[workflow_id]['failed'] += 1
-        
-        # Get workflow details and sort
-        top_workflows = []
-        for workflow_id, counts in workflow_counts.items():
-            workflow = db.get_workflow_by_id(workflow_id)
-            if workflow:
-                top_workflows.append({
-                    'workflow': {
-                        'id': workflow['id'],
-                        'name': workflow['name']
-                    },
-                    'executions': counts['total'],
-                    'success': counts['success'],
-                    'failed': counts['failed'],
-                    'success_rate': round((counts['success'] / counts['total'] * 100), 1) if counts['total'] > 0 else 0
-                })
-        
-        # Sort by execution count and return top N
-        top_workflows.sort(key=lambda x: x['executions'], reverse=True)
-        return top_workflows[:limit]
-        
     except Exception as e:
         logger.error(f"Error getting top workflows: {e}")
         return []
@@ -0,0 +1,173 @@
+"""
+Answer Cache - reuse replies to repeated FAQ-style questions per company
+
+Keys are (company_id, normalized question, knowledge-base version, prompt
+version), so editing the knowledge base or the bot instructions naturally
+misses old answers. Only questions that do not depend on the conversation are
+eligible: the first question of a session, or a standalone question without
+references to earlier turns. Replies from turns that ran a tool (booking an
+appointment, opening the date picker) are never cached: replaying them would
+confirm a booking that was never made.
+
+Tenants opt in through widget_settings['answer_cache']:
+    true                              use the default TTL
+    {"enabled": true, "ttl": 86400}   custom TTL in seconds
+
+Environment:
+    ANSWER_CACHE_TTL   default seconds an answer is reused (default 3600)
+    ANSWER_CACHE_SIZE  max cached answers across all tenants (default 2000)
+"""
+
+import os
+import re
+import hashlib
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+from cache import TTLCache
+from bot.knowledge import _fold, get_knowledge_version
+
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))  # seconds
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '2000'))
+
+# Questions longer than this are unlikely to repeat verbatim
+MAX_QUESTION_CHARS = 300
+
+# Words that point back into the conversation ("what does it cost?")
+REFERENCE_WORDS = frozenset("""
+it its that this these those they them there he she him his
+dies diese dieser dieses diesem diesen dort damit dafur davon dazu darauf daruber er ihm ihn
+""".split())
+# German articles double as pronouns, but only at the end ("was kostet das?")
+TRAILING_REFERENCE_WORDS = frozenset("es das den die der dem".split())
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+_answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+_stats_lock = threading.Lock()
+_stats = {
+    'stores': 0,
+    'ineligible': 0,
+    'latency_saved_ms': 0,
+    'tokens_saved': 0
+}
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, fold diacritics and drop punctuation/extra whitespace"""
+    return ' '.join(_WORD_RE.findall(_fold(text or '')))
+
+
+def get_settings(tenant: Optional[Dict]) -> Optional[Dict]:
+    """Answer cache settings for a tenant, or None if it has not opted in"""
+    if not tenant:
+        return None
+    setting = (tenant.get('widget_settings') or {}).get('answer_cache')
+    if isinstance(setting, dict):
+        return setting if setting.get('enabled') else None
+    return {} if setting is True else None
+
+
+def is_eligible(history: List[Dict]) -> bool:
+    """
+    Whether the latest user message can be answered without the conversation.
+
+    Args:
+        history: Session messages, oldest first, ending with the user message
+    """
+    if not history or history[-1].get('role') != 'user':
+        return False
+    question = history[-1].get('content') or ''
+    if not question.strip() or len(question) > MAX_QUESTION_CHARS:
+        return False
+
+    if not any(m.get('role') == 'user' for m in history[:-1]):
+        return True
+    # Follow-up turns only if the question stands on its own
+    words = normalize_question(question).split()
+    return (len(words) >= 3
+            and words[-1] not in TRAILING_REFERENCE_WORDS
+            and not any(word in REFERENCE_WORDS for word in words))
+
+
+def _cache_key(db_module, turn: Dict) -> Optional[Tuple]:
+    tenant = turn['tenant']
+    question = normalize_question(turn['history'][-1]['content'])
+    kb_version = get_knowledge_version(db_module, turn['company_id'])
+    bot_config = tenant.get('bot_config') or {}
+    prompt_source = '\0'.join(str(part) for part in (
+        turn.get('system_prompt') or '', bot_config.get('model'), bot_config.get('temperature')
+    ))
+    prompt_version = hashlib.sha1(prompt_source.encode('utf-8')).hexdigest()[:12]
+    return (turn['company_id'], question, kb_version, prompt_version)
+
+
+def lookup(db_module, turn: Dict) -> Optional[Dict[str, Any]]:
+    """
+    Find a cached answer for a chat turn.
+
+    Args:
+        db_module: Database module
+        turn: Chat turn from app._begin_chat_turn
+
+    Returns:
+        Dict with content and metadata, or None (miss, not eligible or not enabled)
+    """
+    if get_settings(turn.get('tenant')) is None:
+        return None
+    if not is_eligible(turn.get('history')):
+        with _stats_lock:
+            _stats['ineligible'] += 1
+        return None
+
+    try:
+        entry = _answer_cache.get(_cache_key(db_module, turn))
+    except Exception as e:
+        print(f"Answer cache lookup failed: {e}")
+        return None
+    if entry is None:
+        return None
+
+    with _stats_lock:
+        _stats['latency_saved_ms'] += entry['latency_ms']
+        _stats['tokens_saved'] += entry['tokens']
+    return {
+        'content': entry['content'],
+        'metadata': {'model': entry['model'], 'cached': True}
+    }
+
+
+def store(db_module, turn: Dict, content: str, metadata: Dict, latency_ms: int) -> None:
+    """
+    Cache a freshly generated answer if the turn is eligible.
+
+    Args:
+        latency_ms: How long generating the answer took (reported as saved on hits)
+    """
+    settings = get_settings(turn.get('tenant'))
+    metadata = metadata or {}
+    if settings is None or not content or metadata.get('error'):
+        return
+    # Tool turns have side effects (bookings) a replayed answer would skip
+    if metadata.get('action') or metadata.get('tools_used'):
+        return
+    if not is_eligible(turn.get('history')):
+        return
+
+    try:
+        _answer_cache.set(_cache_key(db_module, turn), {
+            'content': content,
+            'model': metadata.get('model'),
+            'tokens': metadata.get('tokens_total') or metadata.get('tokens') or 0,
+            'latency_ms': int(latency_ms)
+        }, ttl=settings.get('ttl'))
+        with _stats_lock:
+            _stats['stores'] += 1
+    except Exception as e:
+        print(f"Answer cache store failed: {e}")
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Get answer cache hit rate and what the hits saved"""
+    with _stats_lock:
+        return {**_answer_cache.stats(), **_stats}
@@ -7,12 +7,24 @@ import json
 import os
 import statistics
 import smtplib
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, abort, send_file, Response
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, abort, send_file, Response, stream_with_context, g
 from dotenv import load_dotenv
 from dateutil import parser as date_parser
 import auth
 import db
+import tenant_cache
+import request_cache
+import background_writer
+import answer_cache
+import chat_analytics
+import rollups
+import timing
+import metrics
+import rate_limit
+import chat_throttle
+from history_cache import get_history_cache
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from appointment_service import AppointmentService
 
 load_dotenv()
@@ -33,6 +45,13 @@ print(f"SUPABASE_SERVICE_KEY set: {bool(os.getenv('SUPABASE_SERVICE_KEY'))}")
 print("=" * 60)
 
 app = Flask(__name__, static_folder='static', static_url_path='/static', template_folder='templates')
+# Client IPs (rate limits, lockouts) come from X-Forwarded-For only for the
+# proxies we sit behind: Vercel's edge sets one hop. Behind nginx or a load
+# balancer set TRUSTED_PROXY_HOPS to the number of proxies; 0 uses the socket
+# address, which a client cannot spoof with a header.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1' if os.getenv('VERCEL') else '0'))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 # Enable CORS for all API and Widget routes to allow external embedding
 CORS(app, resources={r"/api/*": {"origins": "*"}, r"/widget/*": {"origins": "*"}}, supports_credentials=False, allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept"])
 
@@ -49,6 +68,9 @@ if not _secret_key:
     _secret_key = hashlib.sha256(b'SyntraDefaultSecretKey2024').hexdigest()
 app.secret_key = _secret_key
 
+# Periodic analytics rollup refresh (long-running processes only, see rollups.py)
+rollups.init_scheduler()
+
 # Global Error Handlers to ensure JSON response
 @app.errorhandler(500)
 def internal_error(error):
@@ -542,7 +564,7 @@ def dev_reset_rate_limit():
     """DEV ONLY: Reset rate limit store"""
     if os.getenv('VERCEL'):
         abort(404)
-    auth._rate_limit_store.clear()
+    rate_limit.get_limiter().reset()
     return jsonify({'success': True, 'message': 'Rate limit store cleared'})
 
 
@@ -550,6 +572,7 @@ def dev_reset_rate_limit():
 @app.before_request
 def before_request():
     """Ensure session is properly configured before each request"""
+    g._request_started = time.perf_counter()
     # Make session permanent if user is logged in
     if session.get('user_id'):
         session.permanent = True
@@ -557,6 +580,45 @@ def before_request():
     if request.path.startswith('/dashboard') or request.path.startswith('/admin') or request.path.startswith('/company'):
         print(f"DEBUG: Before request to {request.path} - session['user_id'] = {session.get('user_id')}, session keys: {list(session.keys())}")
 
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and its latency per route pattern (streams: until the first byte)"""
+    started = g.get('_request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - started)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics (admin session, or Authorization: Bearer $METRICS_TOKEN)"""
+    if not metrics.token_authorized(request.headers.get('Authorization')):
+        # Scrapers get a status code, not the login redirect of admin_required
+        user = auth.current_user()
+        if not user:
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        if not auth.is_admin(user):
+            return Response('Admin access required\n', status=403, mimetype='text/plain')
+    return Response(metrics.get_registry().render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/api/cron/rollups', methods=['GET', 'POST'])
+def cron_refresh_rollups():
+    """Incremental analytics rollup refresh (Vercel cron with CRON_SECRET, or an admin)"""
+    if not rollups.cron_authorized(request.headers.get('Authorization')):
+        user = auth.current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        if not auth.is_admin(user):
+            return jsonify({'error': 'Admin access required'}), 403
+    result = rollups.refresh_rollups()
+    if result is None:
+        return jsonify({'error': 'Rollup refresh failed', 'status': rollups.get_rollup_status()}), 500
+    return jsonify({'status': 'success', 'result': result})
+
+
 # Legacy marketing routes removed to favor Next.js app
 # @app.route('/')
 # def index():
@@ -704,11 +766,35 @@ def api_admin_system():
         all_users = db.get_all_users()
         return jsonify({
             'companies_count': len(companies),
-            'users_count': len(all_users)
+            'users_count': len(all_users),
+            'caches': {
+                'tenant': tenant_cache.get_cache_stats(),
+                'history': get_history_cache().stats(),
+                'answers': answer_cache.get_cache_stats()
+            },
+            'chat_statistics_buffer': chat_analytics.get_stats_aggregator().get_stats(),
+            'analytics_rollups': rollups.get_rollup_status(),
+            'chat_stage_timings': timing.get_stage_stats().get_stats()
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/chat-stats/companies')
+@auth.admin_required
+def api_admin_chat_stats_companies():
+    """Per-company chat statistics for the admin overview (paginated)"""
+    try:
+        page = chat_analytics.get_companies_summary_page(
+            days=request.args.get('days', 30, type=int),
+            sort=request.args.get('sort', 'messages'),
+            descending=request.args.get('order', 'desc') != 'asc',
+            limit=min(request.args.get('limit', 50, type=int), 500),
+            offset=request.args.get('offset', 0, type=int)
+        )
+        return jsonify(page), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/integrations/status')
 @auth.admin_required
 def api_admin_integrations_status():
@@ -803,6 +889,8 @@ def api_save_widget_settings(company_id):
         if not update_result.data:
             return jsonify({'error': 'Failed to update settings'}), 500
         
+        tenant_cache.invalidate_tenant(company_id)
+        request_cache.invalidate('companies', company_id)
         return jsonify({'success': True, 'message': 'Settings saved successfully'})
     except Exception as e:
         print(f"Save widget settings error: {str(e)}")
@@ -1033,6 +1121,20 @@ def admin_analytics():
         print(f"Admin analytics error: {str(e)}")
         return redirect(url_for('admin_users'))
 
+@app.route('/admin/system')
+@auth.admin_required
+def admin_system():
+    """Admin system page: per-stage chat latency of this instance"""
+    try:
+        user = auth.current_user()
+        return render_template('admin/system.html',
+                             user=user,
+                             stages=timing.get_stage_stats().get_stats(),
+                             window=timing.STAGE_TIMING_WINDOW)
+    except Exception as e:
+        print(f"Admin system error: {str(e)}")
+        return redirect(url_for('admin_users'))
+
 @app.route('/admin/companies')
 @auth.admin_required
 def admin_companies():
@@ -1240,9 +1342,7 @@ def api_setup_password():
         return jsonify({'error': 'Name and password required'}), 400
     
     # Get client IP for rate limiting
-    ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    if ip_address:
-        ip_address = ip_address.split(',')[0].strip()
+    ip_address = request.remote_addr
     
     try:
         user = auth.setup_password(name, password, ip_address)
@@ -1290,9 +1390,7 @@ def api_check_user():
         return jsonify({'error': 'Name is required'}), 400
     
     # Get client IP for rate limiting
-    ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    if ip_address:
-        ip_address = ip_address.split(',')[0].strip()
+    ip_address = request.remote_addr
     
     try:
         result = auth.check_user_status(name, ip_address)
@@ -1414,6 +1512,7 @@ def api_admin_update_user(user_id):
         
         success_count = 0
         db_client = db.get_db()
+        request_cache.invalidate('users', user_id)
         
         # Try updating each field individually to handle missing columns
         # Update name
@@ -2046,51 +2145,68 @@ def api_invite_member():
 from chat_service import get_chat_service
 import uuid as uuid_lib
 
-@app.route('/api/chat/message', methods=['POST', 'OPTIONS'])
-def chat_message():
-    """Handle incoming chat messages from the widget"""
-    # Handle CORS preflight explicitly to prevent 500 error on get_json()
-    if request.method == 'OPTIONS':
-        return Response(status=200)
+# Tools are restricted to WTM Consulting only
+# This prevents other companies from triggering WTM-branded booking flows
+WTM_COMPANY_ID = '5f929157-5f9e-48e3-b7f7-a6dcd0e24142'
+
+
+def _begin_chat_turn(data: dict):
+    """
+    Shared setup for /api/chat/message and /api/chat/stream.
+
+    Throttles the turn, resolves the tenant, gets or creates the session,
+    saves the user message and loads the conversation history.
+
+    Returns:
+        (turn dict, None) on success, or (None, (error message, status code)),
+        with a third element (Retry-After seconds) for 429
+    """
+    message = data.get('message', '').strip()
+    session_key = data.get('session_id') or data.get('session_key')
+    widget_id = data.get('widget_id', 'default')
+    company_id = data.get('company_id')  # Multi-tenant company identifier
+    user_context = data.get('context', {})
     
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        message = data.get('message', '').strip()
-        session_key = data.get('session_id') or data.get('session_key')
-        widget_id = data.get('widget_id', 'default')
-        company_id = data.get('company_id')  # Multi-tenant company identifier
-        user_context = data.get('context', {})
-        
-        if not message:
-            return jsonify({'error': 'Message is required'}), 400
-        
+    if not message:
+        return None, ('Message is required', 400)
+    
+    # Per-IP limit first: rejected floods never reach the database
+    retry_after = chat_throttle.check('ip', chat_throttle.client_ip(request))
+    if retry_after:
+        return None, ('Too many messages, please slow down', 429, retry_after)
+    
+    with timing.stage('tenant'):
         # Infer company_id from widget_id if missing (e.g. script passes widget_id=COMPANY_ID)
         if not company_id and widget_id and widget_id != 'default':
              # Simple heuristic: if widget_id is UUID-like, try to use it as company_id
              if len(widget_id) == 36: # Request ID length
-                  # Verify it exists
+                  # Verify it exists (cached per tenant)
                   try:
-                       comp = db.get_company_by_id(widget_id)
-                       if comp:
+                       if tenant_cache.get_tenant_context(db, widget_id):
                             company_id = widget_id
                   except Exception:
                        pass
         
-        # Generate session key if not provided
-        if not session_key:
-            session_key = f"widget_{uuid_lib.uuid4().hex[:16]}"
-        
-        chat_service = get_chat_service()
-        
         # Get company context for multi-tenant routing
-        company_context = None
-        if company_id:
-            company_context = chat_service.get_company_context(db, company_id)
-        
-        # Get or create session with company_id
+        # (company row, widget config and bot config resolved once per TTL)
+        tenant = tenant_cache.get_tenant_context(db, company_id) if company_id else None
+    
+    # Session and company limits (tenant overrides in widget_settings), before any write
+    known_company = company_id if tenant else None
+    widget_settings = tenant['widget_settings'] if tenant else None
+    for scope, key in (('session', session_key), ('company', known_company)):
+        retry_after = chat_throttle.check(scope, key, widget_settings, known_company)
+        if retry_after:
+            return None, ('Too many messages, please slow down', 429, retry_after)
+    
+    # Generate session key if not provided
+    if not session_key:
+        session_key = f"widget_{uuid_lib.uuid4().hex[:16]}"
+    
+    chat_service = get_chat_service()
+    
+    # Get or create session with company_id
+    with timing.stage('session'):
         session, is_new = chat_service.get_or_create_session(
             db,
             session_key=session_key,
@@ -2098,14 +2214,15 @@ def chat_message():
             company_id=company_id,
             context=user_context
         )
-        
-        if not session:
-            return jsonify({'error': 'Failed to create session'}), 500
-        
-        # Use internal ID if available, otherwise session_key
-        session_id = session.get('id') or session.get('session_key')
-        
-        # Save user message
+    
+    if not session:
+        return None, ('Failed to create session', 500)
+    
+    # Use internal ID if available, otherwise session_key
+    session_id = session.get('id') or session.get('session_key')
+    
+    # Save user message
+    with timing.stage('user_save'):
         chat_service.save_message(
             db, 
             session_id, 
@@ -2114,62 +2231,134 @@ def chat_message():
             metadata={'widget_id': widget_id, 'company_id': company_id},
             company_id=company_id
         )
-        
-        # Generate response
-        # 1. Check for system prompt override in widget config
-        widget_config = chat_service.get_widget_config(db, widget_id, company_id)
-        system_prompt = widget_config.get('system_prompt') if widget_config else None
-        
-        # 2. Get history
+    
+    # Check for system prompt override in widget config
+    with timing.stage('widget_config'):
+        if tenant:
+            widget_config = tenant['widget_config']
+        else:
+            widget_config = chat_service.get_widget_config(db, widget_id, company_id)
+    system_prompt = widget_config.get('system_prompt') if widget_config else None
+    
+    # Get history
+    with timing.stage('history'):
         history = chat_service.get_conversation_history(db, session_id)
-        
-        # 3. Generate
-        # RESTRICT TOOLS TO WTM CONSULTING ONLY
-        # This prevents other companies from triggering WTM-branded booking flows
-        wtm_id = '5f929157-5f9e-48e3-b7f7-a6dcd0e24142'
-        should_enable_tools = (company_id == wtm_id)
-        
-        response_text, metadata = chat_service.generate_response(
-            history, 
-            system_prompt=system_prompt,
-            db_module=db,
-            company_id=company_id, # Use new engine if company_id present
-            session_id=session_id,
-            enable_tools=should_enable_tools
+    
+    return {
+        'chat_service': chat_service,
+        'tenant': tenant,
+        'company_id': company_id,
+        'session_key': session_key,
+        'session_id': session_id,
+        'system_prompt': system_prompt,
+        'history': history,
+        'enable_tools': company_id == WTM_COMPANY_ID
+    }, None
+
+
+def _chat_error_response(error: tuple):
+    """JSON response for a chat turn rejected by _begin_chat_turn"""
+    body = {'error': error[0]}
+    if error[1] == 429:
+        body.update(status='throttled', retry_after=error[2])
+    response = jsonify(body)
+    response.status_code = error[1]
+    if error[1] == 429:
+        response.headers['Retry-After'] = str(error[2])
+    return response
+
+
+def _save_assistant_reply(turn: dict, response_text: str, metadata: dict):
+    """Persist the assistant reply of a chat turn
+    
+    Unless the tenant requires synchronous durability, the write is queued
+    and committed right after the response is sent.
+    """
+    metadata = metadata or {}
+    tenant = turn['tenant']
+    background = background_writer.is_async_write(tenant['widget_settings'] if tenant else None)
+    tokens = metadata.get('tokens_total') or metadata.get('tokens') or 0
+    
+    # Prepare metadata for saving
+    msg_metadata = {'model': metadata.get('model')}
+    if metadata.get('action'):
+        msg_metadata['action'] = metadata.get('action')
+    if metadata.get('context_tokens'):
+        msg_metadata['context_tokens'] = metadata['context_tokens']
+    if metadata.get('cached'):
+        msg_metadata['cached'] = True
+        
+    with timing.stage('assistant_save'):
+        turn['chat_service'].save_message(
+            db, 
+            turn['session_id'], 
+            'assistant', 
+            response_text, 
+            tokens_used=tokens,
+            model=metadata.get('model'),
+            metadata=msg_metadata,
+            company_id=turn['company_id'],
+            background=background,
+            response_time_ms=metadata.get('response_time_ms')
         )
+
+
+@app.route('/api/chat/message', methods=['POST', 'OPTIONS'])
+def chat_message():
+    """Handle incoming chat messages from the widget"""
+    # Handle CORS preflight explicitly to prevent 500 error on get_json()
+    if request.method == 'OPTIONS':
+        return Response(status=200)
+    
+    try:
+        timer = timing.start_request_timer()
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        turn, error = _begin_chat_turn(data)
+        if error:
+            return _chat_error_response(error)
         
-        if not response_text and metadata and metadata.get('error'):
-             return jsonify({'status': 'error', 'error': metadata['error']}), 500
+        tenant = turn['tenant']
+        
+        # Repeated FAQ-style questions are answered from the cache (opt-in per tenant)
+        with timing.stage('answer_cache'):
+            cached = answer_cache.lookup(db, turn)
+        if cached:
+            response_text, metadata = cached['content'], cached['metadata']
+        else:
+            started = time.perf_counter()
+            response_text, metadata = turn['chat_service'].generate_response(
+                turn['history'], 
+                system_prompt=turn['system_prompt'],
+                db_module=db,
+                company_id=turn['company_id'], # Use new engine if company_id present
+                session_id=turn['session_id'],
+                enable_tools=turn['enable_tools'],
+                bot_config=tenant['bot_config'] if tenant else None
+            )
+            
+            if not response_text and metadata and metadata.get('error'):
+                 return jsonify({'status': 'error', 'error': metadata['error']}), 500
+            
+            answer_cache.store(db, turn, response_text, metadata, (time.perf_counter() - started) * 1000)
              
         if not response_text:
             response_text = "I'm sorry, I couldn't generate a response."
             
         # Save assistant response
-        tokens = metadata.get('tokens_total', 0) if metadata else 0
-        
-        # Prepare metadata for saving
-        msg_metadata = {'model': metadata.get('model')} if metadata else {}
-        if metadata and metadata.get('action'):
-            msg_metadata['action'] = metadata.get('action')
-            
-        chat_service.save_message(
-            db, 
-            session_id, 
-            'assistant', 
-            response_text, 
-            tokens_used=tokens,
-            model=metadata.get('model') if metadata else None,
-            metadata=msg_metadata,
-            company_id=company_id
-        )
+        _save_assistant_reply(turn, response_text, metadata)
         
         response = jsonify({
             'status': 'success', 
             'response': response_text,
-            'session_id': session_key, # Return key for client continuity
+            'session_id': turn['session_key'], # Return key for client continuity
             'action': metadata.get('action') if metadata else None
         })
         response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Server-Timing'] = timer.server_timing()
+        timing.finish_request_timer(timer)
         return response
 
     except Exception as e:
@@ -2183,6 +2372,92 @@ def chat_message():
         return response, 500
 
 
+@app.route('/api/chat/stream', methods=['POST', 'OPTIONS'])
+def chat_stream():
+    """Stream the assistant reply as Server-Sent Events
+    
+    Events are `data: {json}` lines with a `type` of delta, action, done or error.
+    The reply is persisted once the stream completes.
+    """
+    if request.method == 'OPTIONS':
+        return Response(status=200)
+    
+    def sse(event: dict) -> str:
+        return f"data: {json.dumps(event)}\n\n"
+    
+    try:
+        timer = timing.start_request_timer()
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        turn, error = _begin_chat_turn(data)
+        if error:
+            return _chat_error_response(error)
+    except Exception as e:
+        print(f"Chat stream error: {e}")
+        import traceback
+        traceback.print_exc()
+        response = jsonify({'error': f"Server Error: {str(e)}", 'status': 'error'})
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response, 500
+    
+    def generate():
+        try:
+            yield from stream_turn()
+        finally:
+            # Stages after the headers were sent only reach the statistics
+            timing.finish_request_timer(timer)
+    
+    def stream_turn():
+        tenant = turn['tenant']
+        with timing.stage('answer_cache'):
+            cached = answer_cache.lookup(db, turn)
+        if cached:
+            yield sse({'type': 'delta', 'content': cached['content']})
+            _save_assistant_reply(turn, cached['content'], cached['metadata'])
+            yield sse({'type': 'done', 'session_id': turn['session_key'], 'action': None})
+            return
+        
+        started = time.perf_counter()
+        try:
+            for event in turn['chat_service'].stream_response(
+                turn['history'],
+                system_prompt=turn['system_prompt'],
+                db_module=db,
+                company_id=turn['company_id'],
+                session_id=turn['session_id'],
+                enable_tools=turn['enable_tools'],
+                bot_config=tenant['bot_config'] if tenant else None
+            ):
+                if event['type'] == 'done':
+                    response_text = event.get('content') or "I'm sorry, I couldn't generate a response."
+                    metadata = dict(event.get('metadata') or {})
+                    if event.get('action'):
+                        metadata['action'] = event['action']
+                    answer_cache.store(db, turn, event.get('content'), metadata,
+                                       (time.perf_counter() - started) * 1000)
+                    _save_assistant_reply(turn, response_text, metadata)
+                    yield sse({
+                        'type': 'done',
+                        'session_id': turn['session_key'],
+                        'action': event.get('action')
+                    })
+                else:
+                    yield sse(event)
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield sse({'type': 'error', 'error': str(e)})
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    # Setup stages only: the reply is generated after the headers are sent
+    response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+
 @app.route('/api/chat/config', methods=['GET'])
 def api_chat_config():
     """Get chat widget configuration"""
@@ -2194,8 +2469,7 @@ def api_chat_config():
          if len(widget_id) == 36:
              try:
                 # We can't import db inside here if not available, but 'db' is global in app.py
-                comp = db.get_company_by_id(widget_id)
-                if comp:
+                if tenant_cache.get_tenant_context(db, widget_id):
                     company_id = widget_id
              except Exception:
                 pass
@@ -2229,8 +2503,8 @@ def chat_history(session_key):
     try:
         chat_service = get_chat_service()
         
-        # Get session
-        session, _ = chat_service.get_or_create_session(db, session_key)
+        # Get session (read-only: unknown keys must not create rows)
+        session = chat_service.resolve_session(db, session_key)
         if not session:
             response = jsonify({'messages': [], 'session_id': session_key})
             response.headers['Access-Control-Allow-Origin'] = '*'
@@ -2241,7 +2515,7 @@ def chat_history(session_key):
         history = chat_service.get_conversation_history(db, session['id'], limit=limit)
         
         # Transform for client
-        # JSONB messages: {role, content, timestamp ...}
+        # chat_messages rows: {role, content, timestamp ...}
         client_history = []
         for msg in history:
             client_history.append({
@@ -2278,8 +2552,8 @@ def chat_reset():
         
         if session_key:
             chat_service = get_chat_service()
-            # Resolve to UUID
-            session, _ = chat_service.get_or_create_session(db, session_key)
+            # Resolve to UUID (read-only: nothing to close for unknown keys)
+            session = chat_service.resolve_session(db, session_key)
             if session:
                 chat_service.close_session(db, session['id'])
         
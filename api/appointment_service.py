@@ -3,7 +3,7 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-import requests
+from http_client import get_http_client
 import json
 import base64
 from datetime import datetime, timedelta
@@ -23,7 +23,7 @@ class AppointmentService:
         auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
 
         try:
-            response = requests.post(url, headers={'Authorization': f'Basic {auth_header}'})
+            response = get_http_client().post(url, headers={'Authorization': f'Basic {auth_header}'})
             if response.status_code == 200:
                 return response.json().get('access_token')
             else:
@@ -59,13 +59,15 @@ class AppointmentService:
         }
 
         try:
-            response = requests.post(
+            # Creating a meeting is not idempotent: only retry when rate limited
+            response = get_http_client().post(
                 url, 
                 headers={
                     'Authorization': f'Bearer {access_token}',
                     'Content-Type': 'application/json'
                 },
-                json=payload
+                json=payload,
+                retry_statuses={429}
             )
             if response.status_code == 201:
                 return response.json()
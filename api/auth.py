@@ -4,20 +4,25 @@ import secrets
 import time
 import os
 from typing import Optional, Tuple, Dict
-from flask import session, redirect, url_for, request, jsonify
+from flask import session, redirect, url_for, request, jsonify, g, has_request_context
 from functools import wraps
 import db
+import supabase_jwt
+import rate_limit
+from cache import TTLCache
 import traceback
 
-# Rate limiting storage (in production, use Redis or database)
-_rate_limit_store: Dict[str, Dict] = {}
-
 
 # Rate limiting configuration
 RATE_LIMIT_ATTEMPTS = 5  # Max attempts per window
 RATE_LIMIT_WINDOW = 300  # 5 minutes in seconds
 LOCKOUT_DURATION = 900  # 15 minutes lockout after max attempts
 
+# Supabase token -> internal user, kept until the token expires (at most TOKEN_USER_TTL,
+# so role changes still show up within the same 5 minutes as the session cache)
+TOKEN_USER_TTL = int(os.getenv('TOKEN_USER_TTL', '300'))  # seconds
+_token_user_cache = TTLCache(maxsize=int(os.getenv('TOKEN_USER_CACHE_SIZE', '2048')), ttl=TOKEN_USER_TTL)
+
 def hash_password(password: str) -> str:
     """Hash password using SHA256"""
     return hashlib.sha256(password.encode()).hexdigest()
@@ -34,57 +39,32 @@ def check_rate_limit(identifier: str, endpoint: str = 'auth') -> Tuple[bool, Opt
     Returns (allowed, error_message)
     """
     key = _get_rate_limit_key(identifier, endpoint)
-    now = time.time()
-    
-    if key not in _rate_limit_store:
-        _rate_limit_store[key] = {
-            'attempts': [],
-            'locked_until': None
-        }
-    
-    record = _rate_limit_store[key]
-    
+    limiter = rate_limit.get_limiter()
+
     # Check if locked
-    if record['locked_until'] and now < record['locked_until']:
-        remaining = int(record['locked_until'] - now)
-        return False, f"Too many attempts. Please try again in {remaining // 60 + 1} minutes."
-    
-    # Clear lock if expired
-    if record['locked_until'] and now >= record['locked_until']:
-        record['locked_until'] = None
-        record['attempts'] = []
-    
-    # Clean old attempts outside the window
-    record['attempts'] = [t for t in record['attempts'] if now - t < RATE_LIMIT_WINDOW]
-    
-    # Check if limit exceeded
-    if len(record['attempts']) >= RATE_LIMIT_ATTEMPTS:
-        record['locked_until'] = now + LOCKOUT_DURATION
+    remaining = limiter.locked_for(key)
+    if remaining:
+        return False, f"Too many attempts. Please try again in {int(remaining) // 60 + 1} minutes."
+
+    # Check if limit exceeded (failed attempts in the sliding window)
+    if limiter.count(key, RATE_LIMIT_WINDOW) >= RATE_LIMIT_ATTEMPTS:
+        # Attempts start over once the lockout ends
+        limiter.reset(key, RATE_LIMIT_WINDOW)
+        limiter.lock(key, LOCKOUT_DURATION)
         return False, f"Too many attempts. Account locked for {LOCKOUT_DURATION // 60} minutes."
-    
+
     return True, None
 
 
 def record_rate_limit_attempt(identifier: str, endpoint: str = 'auth', failed: bool = True):
     """Record a rate limit attempt"""
+    key = _get_rate_limit_key(identifier, endpoint)
     if not failed:
         # Clear attempts on successful login
-        key = _get_rate_limit_key(identifier, endpoint)
-        if key in _rate_limit_store:
-            _rate_limit_store[key]['attempts'] = []
-            _rate_limit_store[key]['locked_until'] = None
+        rate_limit.get_limiter().reset(key, RATE_LIMIT_WINDOW)
         return
-    
-    key = _get_rate_limit_key(identifier, endpoint)
-    now = time.time()
-    
-    if key not in _rate_limit_store:
-        _rate_limit_store[key] = {
-            'attempts': [],
-            'locked_until': None
-        }
-    
-    _rate_limit_store[key]['attempts'].append(now)
+
+    rate_limit.get_limiter().hit(key, RATE_LIMIT_WINDOW)
 
 
 def verify_password(password: str, password_hash: str) -> bool:
@@ -191,6 +171,7 @@ def setup_password(name: str, password: str, ip_address: str = None) -> dict:
     # Create session - CRITICAL: Mark as permanent BEFORE setting values
     session.permanent = True
     session['user_id'] = user['id']
+    _forget_current_user()
     
     # Cache user info in session to avoid DB calls
     user_dict = {
@@ -259,6 +240,7 @@ def login(name: str, password: str, ip_address: str = None) -> dict:
     # Create session - CRITICAL: Mark as permanent BEFORE setting values
     session.permanent = True
     session['user_id'] = user['id']
+    _forget_current_user()
     
     # Cache user info in session to avoid DB calls
     user_dict = {
@@ -325,6 +307,7 @@ def check_user_status(name: str, ip_address: str = None) -> dict:
 def logout():
     """Logout user"""
     session.clear()
+    _forget_current_user()
     # Also clear any cached user info
     if 'user_info' in session:
         del session['user_info']
@@ -333,6 +316,63 @@ def logout():
 
 
 def current_user() -> Optional[dict]:
+    """Get current logged-in user (resolved once per request, see _resolve_current_user)"""
+    if not has_request_context():
+        return _resolve_current_user()
+    if '_current_user' not in g:
+        g._current_user = _resolve_current_user()
+    return g._current_user
+
+
+def get_token_cache_stats() -> Dict:
+    """Get Supabase token cache size and hit/miss counters"""
+    return _token_user_cache.stats()
+
+
+def _forget_current_user():
+    """Drop the per-request user after the session changed (login/logout)"""
+    if has_request_context():
+        g.pop('_current_user', None)
+
+
+def _user_from_supabase_token(token: str) -> Optional[dict]:
+    """
+    Map a Supabase access token to the internal user.
+
+    HS256 tokens are verified locally when SUPABASE_JWT_SECRET is set; other
+    tokens are verified by GoTrue. Either way the result is cached until the
+    token expires (capped at TOKEN_USER_TTL). Returns None for tokens that are
+    not JWTs (API keys) without a network call.
+    """
+    decoded = supabase_jwt.decode_unverified(token)
+    if decoded is None:
+        return None
+    header, claims = decoded
+
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = _token_user_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if supabase_jwt.can_verify_locally(header):
+        if not supabase_jwt.verify(token, claims):
+            return None
+        email = claims.get('email')
+    else:
+        supabase_user = db.verify_supabase_token(token)
+        email = supabase_user.email if supabase_user else None
+    if not email:
+        return None
+
+    # Map back to internal user
+    internal_user = db.get_user_by_email(email)
+    ttl = min(TOKEN_USER_TTL, supabase_jwt.seconds_until_expiry(claims))
+    if internal_user and ttl > 0:
+        _token_user_cache.set(cache_key, internal_user, ttl=ttl)
+    return internal_user
+
+
+def _resolve_current_user() -> Optional[dict]:
     """Get current logged-in user with caching in session"""
     # Ensure session is accessible
     if not hasattr(session, 'get'):
@@ -346,17 +386,11 @@ def current_user() -> Optional[dict]:
             token = auth_header.split(' ', 1)[1].strip()  # Get everything after 'Bearer '
             
             # 1. Try as Supabase JWT
-            # Note: This verifies the token with Supabase and gets the user identity
-            supabase_user = db.verify_supabase_token(token)
-            if supabase_user:
-                email = supabase_user.email
-                if email:
-                    # Map back to internal user
-                    internal_user = db.get_user_by_email(email)
-                    if internal_user:
-                        # Ensure role is set correctly (especially for Theo/Vyrez)
-                        # We might need to sync role from metadata? For now trust internal DB status.
-                        return internal_user
+            internal_user = _user_from_supabase_token(token)
+            if internal_user:
+                # Ensure role is set correctly (especially for Theo/Vyrez)
+                # We might need to sync role from metadata? For now trust internal DB status.
+                return internal_user
 
             # 2. Try as API Key
             # print(f"DEBUG: Extracted token: {token[:10]}...") 
@@ -0,0 +1,267 @@
+"""
+Background Writer - write-behind queue for post-response persistence
+
+Work submitted here (chat message inserts, analytics counters) is accepted
+immediately and committed by worker threads right after the response is
+sent. Inserts into the same table are batched into a single request.
+
+Ordering:
+    Queued work can carry a key (the chat session). write_through() waits
+    until a key's queued writes are committed, so a session's next
+    synchronous insert (the visitor's following question) is never stored
+    before the previous turn's queued reply and gets a later seq.
+
+Durability:
+    CHAT_WRITE_MODE=async  write-behind (default outside Vercel)
+    CHAT_WRITE_MODE=sync   commit before responding (default on Vercel, where
+                           an idle instance can be frozen or recycled before
+                           the queue drains)
+    Tenants can override this with widget_settings['durability'].
+
+Environment:
+    BACKGROUND_WRITER_WORKERS        worker threads (default 2)
+    BACKGROUND_WRITER_QUEUE_SIZE     max queued jobs before writes run inline (default 1000)
+    BACKGROUND_WRITER_BATCH_SIZE     max jobs per batch (default 50)
+    BACKGROUND_WRITER_BATCH_WAIT_MS  how long a worker waits to fill a batch (default 50)
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+from collections import defaultdict
+from typing import Dict, Any, List, Callable, Optional
+
+CHAT_WRITE_MODE = os.getenv('CHAT_WRITE_MODE') or ('sync' if os.getenv('VERCEL') else 'async')
+BACKGROUND_WRITER_WORKERS = int(os.getenv('BACKGROUND_WRITER_WORKERS', '2'))
+BACKGROUND_WRITER_QUEUE_SIZE = int(os.getenv('BACKGROUND_WRITER_QUEUE_SIZE', '1000'))
+BACKGROUND_WRITER_BATCH_SIZE = int(os.getenv('BACKGROUND_WRITER_BATCH_SIZE', '50'))
+BACKGROUND_WRITER_BATCH_WAIT_MS = int(os.getenv('BACKGROUND_WRITER_BATCH_WAIT_MS', '50'))
+SHUTDOWN_FLUSH_TIMEOUT = 5.0  # seconds
+KEY_FLUSH_TIMEOUT = 5.0  # seconds a synchronous write waits for its key's queued writes
+
+
+def is_async_write(widget_settings: Dict = None) -> bool:
+    """Whether post-response writes for a tenant may be deferred"""
+    mode = (widget_settings or {}).get('durability') or CHAT_WRITE_MODE
+    return mode == 'async'
+
+
+class BackgroundWriter:
+    """Bounded job queue drained by worker threads in batches"""
+
+    def __init__(self, db_module,
+                 workers: int = BACKGROUND_WRITER_WORKERS,
+                 queue_size: int = BACKGROUND_WRITER_QUEUE_SIZE,
+                 batch_size: int = BACKGROUND_WRITER_BATCH_SIZE,
+                 batch_wait_ms: int = BACKGROUND_WRITER_BATCH_WAIT_MS):
+        self.db = db_module
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Queued, not yet committed jobs per key
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._pending_done = threading.Condition()
+        self.stats = {
+            'submitted': 0,
+            'written': 0,
+            'failed': 0,
+            'inline': 0,
+            'batches': 0
+        }
+
+    # =========================================================================
+    # Submitting work
+    # =========================================================================
+
+    def submit_insert(self, table: str, row: Dict, key: str = None) -> None:
+        """
+        Queue a row insert (batched with other inserts into the same table).
+
+        Args:
+            key: Ordering key (e.g. the session id), see write_through()
+        """
+        self._put(('insert', table, row), key)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> None:
+        """Queue an arbitrary call, e.g. an analytics counter update"""
+        self._put(('call', fn, args, kwargs))
+
+    def write_through(self, key: str, timeout: float = KEY_FLUSH_TIMEOUT) -> bool:
+        """
+        Wait until the queued writes for `key` are committed.
+
+        Returns:
+            True if nothing for `key` is left in the queue
+        """
+        deadline = time.monotonic() + timeout
+        with self._pending_done:
+            while self._pending.get(key):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Background writer: writes for {key} not committed after {timeout}s")
+                    return False
+                self._pending_done.wait(remaining)
+        return True
+
+    def _put(self, job, key: str = None) -> None:
+        self._ensure_started()
+        self._count('submitted')
+        if key:
+            with self._pending_done:
+                self._pending[key] += 1
+        try:
+            self._queue.put_nowait((job, key))
+        except queue.Full:
+            # Backpressure: run in the caller instead of dropping the write
+            self._count('inline')
+            try:
+                self._run_batch([job])
+            finally:
+                self._release([key])
+
+    def _release(self, keys: List[Optional[str]]) -> None:
+        """Mark jobs as committed (or failed) for write_through()"""
+        keys = [key for key in keys if key]
+        if not keys:
+            return
+        with self._pending_done:
+            for key in keys:
+                self._pending[key] -= 1
+                if self._pending[key] <= 0:
+                    del self._pending[key]
+            self._pending_done.notify_all()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    # =========================================================================
+    # Workers
+    # =========================================================================
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f'background-writer-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            atexit.register(self.flush, SHUTDOWN_FLUSH_TIMEOUT)
+
+    def _worker(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._run_batch([job for job, _ in batch])
+            except Exception as e:
+                print(f"Background writer error: {e}")
+            finally:
+                self._release([key for _, key in batch])
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _run_batch(self, batch: List) -> None:
+        self._count('batches')
+        inserts = defaultdict(list)
+        calls = []
+        for job in batch:
+            if job[0] == 'insert':
+                inserts[job[1]].append(job[2])
+            else:
+                calls.append(job)
+
+        # Inserts first so counters never run ahead of the rows they describe
+        for table, rows in inserts.items():
+            self._insert_rows(table, rows)
+
+        for _, fn, args, kwargs in calls:
+            try:
+                fn(*args, **kwargs)
+                self._count('written')
+            except Exception as e:
+                self._count('failed')
+                print(f"Background call {getattr(fn, '__name__', fn)} failed: {e}")
+
+    def _insert_rows(self, table: str, rows: List[Dict]) -> None:
+        db_client = self.db.get_db()
+        try:
+            db_client.table(table).insert(rows, returning='minimal').execute()
+            self._count('written', len(rows))
+            return
+        except Exception as e:
+            if len(rows) == 1:
+                self._count('failed')
+                print(f"Background insert into {table} failed: {e}")
+                return
+            print(f"Background batch insert into {table} failed, retrying rows individually: {e}")
+
+        # One bad row must not drop the rest of the batch
+        for row in rows:
+            try:
+                db_client.table(table).insert(row, returning='minimal').execute()
+                self._count('written')
+            except Exception as e:
+                self._count('failed')
+                print(f"Background insert into {table} failed: {e}")
+
+    # =========================================================================
+    # Shutdown / introspection
+    # =========================================================================
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all queued work is committed.
+
+        Returns:
+            True if the queue drained within the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    print(f"Background writer: {self._queue.unfinished_tasks} jobs not flushed")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and write counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {**stats, 'queued': self._queue.qsize(), 'mode': CHAT_WRITE_MODE}
+
+
+# Global instance
+_background_writer = None
+_background_writer_lock = threading.Lock()
+
+
+def get_background_writer() -> BackgroundWriter:
+    """Get the global background writer"""
+    global _background_writer
+    if _background_writer is None:
+        with _background_writer_lock:
+            if _background_writer is None:
+                import db
+                _background_writer = BackgroundWriter(db)
+    return _background_writer
@@ -0,0 +1,192 @@
+"""
+Context Assembly - token-budgeted prompts for CompanyBot
+
+Splits the model's context into per-section budgets (system prompt, knowledge,
+history, completion) and fits each section into its budget. History is
+trimmed from the oldest end; the latest user message is always kept.
+
+Token counts use tiktoken when installed, otherwise a calibrated character
+estimate (CONTEXT_CHARS_PER_TOKEN, conservative for mixed German/English).
+
+Per-company budgets can be set in widget_settings['context_budget'], e.g.
+    {"system": 1500, "knowledge": 2500, "history": 3000, "completion": 1000}
+
+Environment:
+    CONTEXT_SYSTEM_TOKENS      default system prompt budget (1500)
+    CONTEXT_KNOWLEDGE_TOKENS   default knowledge budget (2500)
+    CONTEXT_HISTORY_TOKENS     default history budget (3000)
+    CONTEXT_COMPLETION_TOKENS  default completion budget / max_tokens (1000)
+    CONTEXT_CHARS_PER_TOKEN    estimate used without tiktoken (3.5)
+"""
+
+import os
+import math
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_BUDGET = {
+    'system': int(os.getenv('CONTEXT_SYSTEM_TOKENS', '1500')),
+    'knowledge': int(os.getenv('CONTEXT_KNOWLEDGE_TOKENS', '2500')),
+    'history': int(os.getenv('CONTEXT_HISTORY_TOKENS', '3000')),
+    'completion': int(os.getenv('CONTEXT_COMPLETION_TOKENS', '1000')),
+}
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv('CONTEXT_CHARS_PER_TOKEN', '3.5'))
+
+# Framing tokens the chat format adds per message
+MESSAGE_OVERHEAD = 4
+
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 16385
+
+KNOWLEDGE_SEPARATOR = '---\n'
+TRUNCATION_MARK = ' [...]'
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base' if model.startswith('gpt-4o') else 'cl100k_base')
+
+
+def count_tokens(text: str, model: str = 'gpt-4o') -> int:
+    """Count tokens in text (exact with tiktoken, estimated otherwise)"""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = 'gpt-4o') -> str:
+    """Cut text to at most max_tokens, keeping the beginning"""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    limit = max_tokens - count_tokens(TRUNCATION_MARK, model)
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max(limit, 0)]) + TRUNCATION_MARK
+    return text[:int(max(limit, 0) * CONTEXT_CHARS_PER_TOKEN)] + TRUNCATION_MARK
+
+
+def get_budget(model: str, overrides: Dict = None) -> Dict[str, int]:
+    """
+    Resolve section budgets for a company, scaled down if they would not fit
+    the model's context window.
+    """
+    budget = dict(DEFAULT_BUDGET)
+    for section, value in (overrides or {}).items():
+        if section in budget:
+            try:
+                budget[section] = max(0, int(value))
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid context budget for {section}: {value}")
+
+    window = next((size for prefix, size in sorted(MODEL_CONTEXT_WINDOWS.items(),
+                                                   key=lambda item: -len(item[0]))
+                   if model.startswith(prefix)), DEFAULT_CONTEXT_WINDOW)
+    total = sum(budget.values())
+    if total > window:
+        scale = window / total
+        budget = {section: int(value * scale) for section, value in budget.items()}
+    return budget
+
+
+class ContextAssembler:
+    """Fits prompt sections into their token budgets and records usage"""
+
+    def __init__(self, model: str, budget_overrides: Dict = None):
+        self.model = model
+        self.budget = get_budget(model, budget_overrides)
+        self.usage = {'system': 0, 'knowledge': 0, 'history': 0,
+                      'history_messages': 0, 'history_dropped': 0}
+
+    def fit_system(self, text: str, suffix: str = '') -> Tuple[str, str]:
+        """
+        Truncate the system prompt to its budget. The suffix (e.g. the
+        current-time note) is never cut.
+        """
+        suffix_tokens = count_tokens(suffix, self.model)
+        text = truncate_tokens(text or '', self.budget['system'] - suffix_tokens, self.model)
+        self.usage['system'] = count_tokens(text, self.model) + suffix_tokens
+        return text, suffix
+
+    def fit_knowledge(self, text: str) -> str:
+        """Keep whole knowledge passages, best first, until the budget is spent"""
+        if not text:
+            return ''
+        budget = self.budget['knowledge']
+        head, _, body = text.partition(KNOWLEDGE_SEPARATOR)
+        kept = head
+        used = count_tokens(head, self.model)
+        for passage in body.split(KNOWLEDGE_SEPARATOR) if body else []:
+            block = KNOWLEDGE_SEPARATOR + passage
+            tokens = count_tokens(block, self.model)
+            if used + tokens > budget:
+                if kept == head:
+                    # Even the best passage is too long: keep its beginning
+                    block = truncate_tokens(block, budget - used, self.model)
+                    kept += block
+                    used += count_tokens(block, self.model)
+                break
+            kept += block
+            used += tokens
+        if kept == head:
+            return ''
+        self.usage['knowledge'] = used
+        return kept
+
+    def fit_history(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Keep the newest messages that fit the history budget.
+        The latest message is always kept (truncated if needed).
+        """
+        budget = self.budget['history']
+        kept: List[Dict] = []
+        used = 0
+        for message in reversed(messages):
+            content = message.get('content') or ''
+            tokens = count_tokens(content, self.model) + MESSAGE_OVERHEAD
+            if used + tokens > budget:
+                if not kept:
+                    content = truncate_tokens(content, budget - MESSAGE_OVERHEAD, self.model)
+                    kept.append({'role': message['role'], 'content': content})
+                    used += count_tokens(content, self.model) + MESSAGE_OVERHEAD
+                break
+            kept.append({'role': message['role'], 'content': content})
+            used += tokens
+
+        kept.reverse()
+        self.usage['history'] = used
+        self.usage['history_messages'] = len(kept)
+        self.usage['history_dropped'] = len(messages) - len(kept)
+        return kept
+
+    @property
+    def max_completion_tokens(self) -> int:
+        return self.budget['completion']
+
+    def get_usage(self) -> Dict[str, int]:
+        """Tokens used per section, plus the prompt total and completion budget"""
+        usage = dict(self.usage)
+        usage['prompt'] = usage['system'] + usage['knowledge'] + usage['history'] + MESSAGE_OVERHEAD
+        usage['completion_budget'] = self.budget['completion']
+        usage['estimated'] = tiktoken is None
+        return usage
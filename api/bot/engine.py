@@ -1,10 +1,18 @@
 import os
 import json
+import time
 import logging
-import requests
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Iterator
 from datetime import datetime
 from appointment_service import AppointmentService
+from bot.knowledge import retrieve_knowledge
+from bot.context import ContextAssembler
+import tenant_cache
+import timing
+import metrics
+from http_client import get_http_client
+
+OPENAI_CHAT_URL = 'https://api.openai.com/v1/chat/completions'
 
 class CompanyBot:
     def __init__(self, company_id: str, db_module, config: Dict = None):
@@ -23,33 +31,39 @@ class CompanyBot:
     def _load_config(self) -> Dict:
         """Load company-specific bot settings"""
         try:
-            company = self.db.get_company_by_id(self.company_id)
-            if not company:
+            tenant = tenant_cache.get_tenant_context(self.db, self.company_id)
+            if not tenant:
                 return {}
-            
-            # Default settings if none exist
-            defaults = {
-                'name': 'Kian',
-                'system_prompt': 'You are a helpful assistant for this company.',
-                'model': 'gpt-4o',
-                'temperature': 0.7
-            }
-            
-            # Merge stored settings
-            settings = company.get('widget_settings', {})
-            
-            # Map simplified settings to config
-            return {
-                'name': settings.get('bot_name', defaults['name']),
-                'system_prompt': settings.get('instructions') or settings.get('system_prompt') or defaults['system_prompt'],
-                'model': settings.get('model', defaults['model']),
-                'temperature': settings.get('temperature', defaults['temperature']),
-                'welcome_message': settings.get('welcome_message', "Hello! How can I help you?")
-            }
+            return dict(tenant['bot_config'])
         except Exception as e:
             logging.error(f"Error loading bot config for {self.company_id}: {e}")
             return {}
 
+    @staticmethod
+    def build_config(company: Dict) -> Dict:
+        """Map a company's widget_settings to bot config"""
+        # Default settings if none exist
+        defaults = {
+            'name': 'Kian',
+            'system_prompt': 'You are a helpful assistant for this company.',
+            'model': 'gpt-4o',
+            'temperature': 0.7
+        }
+
+        # Merge stored settings
+        settings = company.get('widget_settings') or {}
+
+        # Map simplified settings to config
+        return {
+            'name': settings.get('bot_name', defaults['name']),
+            'system_prompt': settings.get('instructions') or settings.get('system_prompt') or defaults['system_prompt'],
+            'model': settings.get('model', defaults['model']),
+            'temperature': settings.get('temperature', defaults['temperature']),
+            'welcome_message': settings.get('welcome_message', "Hello! How can I help you?"),
+            'knowledge_top_k': settings.get('knowledge_top_k'),
+            'context_budget': settings.get('context_budget')
+        }
+
     def get_appointment_tool_def(self):
         """Define the appointment booking tool for OpenAI"""
         return {
@@ -110,62 +124,127 @@ class CompanyBot:
             }
         }
 
-    def generate_response(self, messages: List[Dict], 
-                        user_context: Dict = None, 
-                        system_prompt: str = None, 
-                        enable_tools: bool = False,
-                        session_id: str = None) -> Dict:
+    def _build_payload(self, messages: List[Dict], system_prompt: str = None,
+                       enable_tools: bool = False) -> Tuple[Dict, Dict]:
         """
-        Generate a response with optional tool support
+        Assemble the chat/completions payload (system prompt, knowledge, history)
+        within the company's token budgets.
+
+        Returns:
+            Tuple of (payload, tokens used per context section)
         """
-        if not self.openai_api_key:
-            return {'error': 'OpenAI API not configured'}
+        model = self.config.get('model', self.openai_model)
+        context = ContextAssembler(model, self.config.get('context_budget'))
 
         # Priority: Passed system_prompt > Config system_prompt
-        final_system_prompt = system_prompt or self.config.get('system_prompt', '')
-        
-        # Inject Company Knowledge Base
+        base_prompt = system_prompt or self.config.get('system_prompt', '')
+
+        # Add basic context if not already included in system_prompt
+        time_note = ''
+        if "IMPORTANT:" not in base_prompt:
+            time_note = f"\n\nIMPORTANT: Current Time: {datetime.utcnow().isoformat()}"
+        base_prompt, time_note = context.fit_system(base_prompt, time_note)
+
+        # Inject the knowledge passages relevant to the latest user turns
+        knowledge = ''
         try:
-            knowledge = self.db.get_company_knowledge(self.company_id)
-            if knowledge:
-                 final_system_prompt += f"\n\n### INTERNAL KNOWLEDGE BASE ###\n{knowledge}\n"
+            user_turns = [m['content'] for m in messages if m.get('role') == 'user' and m.get('content')]
+            query = ' '.join(user_turns[-2:])
+            with timing.stage('knowledge'):
+                knowledge = context.fit_knowledge(retrieve_knowledge(
+                    self.db, self.company_id, query, top_k=self.config.get('knowledge_top_k')
+                ))
         except Exception as e:
             logging.error(f"Failed to inject knowledge base: {e}")
 
-        # Add basic context if not already included in system_prompt
-        if "IMPORTANT:" not in final_system_prompt:
-             final_system_prompt += f"\n\nIMPORTANT: Current Time: {datetime.utcnow().isoformat()}"
+        final_system_prompt = base_prompt
+        if knowledge:
+            final_system_prompt += f"\n\n### INTERNAL KNOWLEDGE BASE ###\n{knowledge}\n"
+        final_system_prompt += time_note
 
-        # Context Injection (RAG lite) - if enabled in future
-        # For now, we rely on what passed in via system_prompt or base knowledge
-        
         api_messages = [{'role': 'system', 'content': final_system_prompt}]
-        for m in messages:
-            api_messages.append({'role': m['role'], 'content': m['content']})
+        api_messages.extend(context.fit_history(messages))
 
         payload = {
-            'model': self.config.get('model', self.openai_model),
+            'model': model,
             'messages': api_messages,
-            'temperature': self.config.get('temperature', 0.7)
+            'temperature': self.config.get('temperature', 0.7),
+            'max_tokens': context.max_completion_tokens
         }
 
         if enable_tools:
             payload['tools'] = [self.get_appointment_tool_def(), self.get_date_picker_tool_def()]
             payload['tool_choice'] = "auto"
 
+        return payload, context.get_usage()
+
+    def _execute_tool_call(self, function_name: str, arguments_str: str,
+                           session_id: str = None) -> Tuple[str, Optional[str]]:
+        """
+        Run a tool requested by the model.
+
+        Returns:
+            Tuple of (tool output content, triggered widget action or None)
+        """
+        print(f"Tool: {function_name}, Args: {arguments_str}")
+        
+        try:
+            arguments = json.loads(arguments_str or '{}')
+        except Exception as json_e:
+            print(f"JSON Parse Error: {json_e}")
+            arguments = {}
+
+        if function_name == 'ask_for_time':
+            print("Triggering Date Picker Tool...")
+            return json.dumps({"status": "success", "message": "Date picker displayed."}), 'request_date'
+
+        if function_name == 'book_appointment':
+            # Execute tool
+            try:
+                print(f"Executing AppointmentService...")
+                result = AppointmentService.create_appointment(
+                    self.db,
+                    self.company_id,
+                    session_id,
+                    arguments.get('name'),
+                    arguments.get('email'),
+                    arguments.get('date_time'),
+                    arguments.get('purpose', 'General Consultation'),
+                    company_name=arguments.get('company_name'),
+                    topic_type=arguments.get('topic_type')
+                )
+                print(f"Appointment Result: {result}")
+                
+                output_content = json.dumps({"status": "success", "details": str(result)}) if result else json.dumps({"status": "error", "message": "Failed to book appointment"})
+            except Exception as e:
+                print(f"Tool Execution Error: {str(e)}")
+                output_content = json.dumps({"status": "error", "message": str(e)})
+            return output_content, None
+
+        return json.dumps({"status": "error", "message": f"Unknown tool: {function_name}"}), None
+
+    def generate_response(self, messages: List[Dict], 
+                        user_context: Dict = None, 
+                        system_prompt: str = None, 
+                        enable_tools: bool = False,
+                        session_id: str = None) -> Dict:
+        """
+        Generate a response with optional tool support
+        """
+        if not self.openai_api_key:
+            return {'error': 'OpenAI API not configured'}
+
+        payload, context_usage = self._build_payload(messages, system_prompt, enable_tools)
+        api_messages = payload['messages']
+
         triggered_action = None
+        tools_used = []
+        llm_ms = 0.0
 
         try:
             logging.info(f"Sending request to OpenAI using model: {payload['model']}")
-            response = requests.post(
-                'https://api.openai.com/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {self.openai_api_key}',
-                    'Content-Type': 'application/json'
-                },
-                json=payload,
-                timeout=30
-            )
+            response, elapsed_ms = self._post_completion(payload)
+            llm_ms += elapsed_ms
 
             if response.status_code != 200:
                 error_msg = f"Provider Error: {response.status_code} - {response.text}"
@@ -174,6 +253,8 @@ class CompanyBot:
                 return {'error': error_msg}
 
             data = response.json()
+            metrics.observe_openai_tokens(payload['model'], self.company_id,
+                                          (data.get('usage') or {}).get('total_tokens'))
             choice = data['choices'][0]
             message = choice['message']
             
@@ -185,41 +266,13 @@ class CompanyBot:
                 
                 for tool_call in tool_calls:
                     function_name = tool_call['function']['name']
-                    arguments_str = tool_call['function']['arguments']
-                    print(f"Tool: {function_name}, Args: {arguments_str}")
-                    
-                    try:
-                        arguments = json.loads(arguments_str)
-                    except Exception as json_e:
-                        print(f"JSON Parse Error: {json_e}")
-                        arguments = {}
-
-                    if function_name == 'ask_for_time':
-                        print("Triggering Date Picker Tool...")
-                        triggered_action = 'request_date'
-                        output_content = json.dumps({"status": "success", "message": "Date picker displayed."})
-
-                    elif function_name == 'book_appointment':
-                        # Execute tool
-                        try:
-                            print(f"Executing AppointmentService...")
-                            result = AppointmentService.create_appointment(
-                                self.db,
-                                self.company_id,
-                                session_id,
-                                arguments.get('name'),
-                                arguments.get('email'),
-                                arguments.get('date_time'),
-                                arguments.get('purpose', 'General Consultation'),
-                                company_name=arguments.get('company_name'),
-                                topic_type=arguments.get('topic_type')
-                            )
-                            print(f"Appointment Result: {result}")
-                            
-                            output_content = json.dumps({"status": "success", "details": str(result)}) if result else json.dumps({"status": "error", "message": "Failed to book appointment"})
-                        except Exception as e:
-                            print(f"Tool Execution Error: {str(e)}")
-                            output_content = json.dumps({"status": "error", "message": str(e)})
+                    tools_used.append(function_name)
+                    with timing.stage('tools'):
+                        output_content, action = self._execute_tool_call(
+                            function_name, tool_call['function']['arguments'], session_id
+                        )
+                    if action:
+                        triggered_action = action
 
                     api_messages.append({
                         "role": "tool",
@@ -232,15 +285,8 @@ class CompanyBot:
                 payload['messages'] = api_messages
                 
                 print("Sending Follow-up to OpenAI...")
-                response = requests.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Authorization': f'Bearer {self.openai_api_key}',
-                        'Content-Type': 'application/json'
-                    },
-                    json=payload,
-                    timeout=30
-                )
+                response, elapsed_ms = self._post_completion(payload)
+                llm_ms += elapsed_ms
                 
                 if response.status_code != 200:
                     error_msg = f"Provider Error (Follow-up): {response.status_code} - {response.text}"
@@ -249,6 +295,8 @@ class CompanyBot:
                     return {'error': "Error generating final response after tool use"}
                     
                 data = response.json()
+                metrics.observe_openai_tokens(payload['model'], self.company_id,
+                                              (data.get('usage') or {}).get('total_tokens'))
                 content = data['choices'][0]['message']['content']
             else:
                 content = message['content']
@@ -259,7 +307,10 @@ class CompanyBot:
                 'action': triggered_action,
                 'metadata': {
                     'model': data['model'],
-                    'tokens': data['usage']['total_tokens']
+                    'tokens': data['usage']['total_tokens'],
+                    'context_tokens': context_usage,
+                    'response_time_ms': int(llm_ms),
+                    'tools_used': tools_used
                 }
             }
 
@@ -269,3 +320,222 @@ class CompanyBot:
             traceback.print_exc() # Print full stack trace to stdout
             print(f"CRITICAL BOT ERROR: {str(e)}")
             return {'error': str(e)}
+
+    def stream_response(self, messages: List[Dict],
+                        system_prompt: str = None,
+                        enable_tools: bool = False,
+                        session_id: str = None) -> Iterator[Dict]:
+        """
+        Stream a response token by token.
+
+        Yields event dicts:
+            {'type': 'delta', 'content': str}
+            {'type': 'action', 'action': str}     (tool triggered a widget action)
+            {'type': 'done', 'content': str, 'action': str|None, 'metadata': {...}}
+            {'type': 'error', 'error': str}
+
+        Tool calls are accumulated from the stream; once the model finishes the
+        tool turn they are executed and the follow-up answer is streamed as well.
+        """
+        if not self.openai_api_key:
+            yield {'type': 'error', 'error': 'OpenAI API not configured'}
+            return
+
+        payload, context_usage = self._build_payload(messages, system_prompt, enable_tools)
+        payload['stream'] = True
+        payload['stream_options'] = {'include_usage': True}
+        api_messages = payload['messages']
+
+        content_parts = []
+        triggered_action = None
+        tools_used = []
+        model = payload['model']
+        tokens = 0
+        llm = {'ms': 0.0}
+
+        try:
+            logging.info(f"Streaming request to OpenAI using model: {payload['model']}")
+            tool_calls = {}
+            for chunk in self._timed_completion(payload, llm):
+                if chunk.get('error'):
+                    yield {'type': 'error', 'error': chunk['error']}
+                    return
+                model = chunk.get('model') or model
+                if chunk.get('usage'):
+                    tokens += chunk['usage'].get('total_tokens') or 0
+
+                for choice in chunk.get('choices') or []:
+                    delta = choice.get('delta') or {}
+                    if delta.get('content'):
+                        content_parts.append(delta['content'])
+                        yield {'type': 'delta', 'content': delta['content']}
+
+                    # Tool call arguments arrive in fragments keyed by index
+                    for tc in delta.get('tool_calls') or []:
+                        entry = tool_calls.setdefault(tc.get('index', 0), {
+                            'id': None, 'type': 'function',
+                            'function': {'name': '', 'arguments': ''}
+                        })
+                        if tc.get('id'):
+                            entry['id'] = tc['id']
+                        fn = tc.get('function') or {}
+                        if fn.get('name'):
+                            entry['function']['name'] += fn['name']
+                        if fn.get('arguments'):
+                            entry['function']['arguments'] += fn['arguments']
+
+            # Handle Tool Calls
+            if tool_calls:
+                print("--- Tool Call Detected (stream) ---")
+                ordered_calls = [tool_calls[i] for i in sorted(tool_calls)]
+                api_messages.append({
+                    'role': 'assistant',
+                    'content': ''.join(content_parts) or None,
+                    'tool_calls': ordered_calls
+                })
+
+                for tool_call in ordered_calls:
+                    function_name = tool_call['function']['name']
+                    tools_used.append(function_name)
+                    with timing.stage('tools'):
+                        output_content, action = self._execute_tool_call(
+                            function_name, tool_call['function']['arguments'], session_id
+                        )
+                    if action:
+                        triggered_action = action
+                        yield {'type': 'action', 'action': action}
+
+                    api_messages.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call['id'],
+                        "name": function_name,
+                        "content": output_content
+                    })
+
+                # Follow-up request to stream the final answer
+                payload['messages'] = api_messages
+                print("Streaming Follow-up from OpenAI...")
+                for chunk in self._timed_completion(payload, llm):
+                    if chunk.get('error'):
+                        yield {'type': 'error', 'error': "Error generating final response after tool use"}
+                        return
+                    if chunk.get('usage'):
+                        tokens += chunk['usage'].get('total_tokens') or 0
+                    for choice in chunk.get('choices') or []:
+                        delta = choice.get('delta') or {}
+                        if delta.get('content'):
+                            content_parts.append(delta['content'])
+                            yield {'type': 'delta', 'content': delta['content']}
+
+            yield {
+                'type': 'done',
+                'content': ''.join(content_parts),
+                'action': triggered_action,
+                'metadata': {
+                    'model': model,
+                    'tokens': tokens,
+                    'context_tokens': context_usage,
+                    'response_time_ms': int(llm['ms']),
+                    'tools_used': tools_used
+                }
+            }
+
+        except Exception as e:
+            logging.error(f"Streaming error: {e}")
+            import traceback
+            traceback.print_exc()
+            print(f"CRITICAL BOT ERROR (stream): {str(e)}")
+            yield {'type': 'error', 'error': str(e)}
+
+    def _post_completion(self, payload: Dict) -> Tuple[Any, float]:
+        """
+        POST a chat/completions request as the request's 'llm' stage and
+        record it in the OpenAI metrics (the caller records the tokens once
+        it has parsed the body).
+
+        Returns:
+            (response, elapsed ms)
+        """
+        status = 'error'
+        started = time.perf_counter()
+        try:
+            with timing.stage('llm'):
+                response = get_http_client().post(
+                    OPENAI_CHAT_URL,
+                    headers={
+                        'Authorization': f'Bearer {self.openai_api_key}',
+                        'Content-Type': 'application/json'
+                    },
+                    json=payload,
+                    timeout=30
+                )
+            if response.status_code == 200:
+                status = 'ok'
+            return response, (time.perf_counter() - started) * 1000
+        finally:
+            metrics.observe_openai(payload['model'], self.company_id,
+                                   time.perf_counter() - started, status=status)
+
+    def _timed_completion(self, payload: Dict, llm: Dict) -> Iterator[Dict]:
+        """
+        _stream_completion, adding the time spent waiting on the provider to
+        llm['ms'] and the request's 'llm' stage. Time the caller spends
+        between chunks (writing to the client) is not counted.
+        """
+        chunks = self._stream_completion(payload)
+        waited_total = 0.0
+        tokens = 0
+        status = 'ok'
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = next(chunks, None)
+                except Exception:
+                    status = 'error'
+                    raise
+                finally:
+                    waited = (time.perf_counter() - started) * 1000
+                    waited_total += waited
+                    llm['ms'] += waited
+                    timing.add('llm', waited)
+                if chunk is None:
+                    return
+                if chunk.get('error'):
+                    status = 'error'
+                elif chunk.get('usage'):
+                    tokens += chunk['usage'].get('total_tokens') or 0
+                yield chunk
+        finally:
+            metrics.observe_openai(payload['model'], self.company_id,
+                                   waited_total / 1000, tokens, status)
+
+    def _stream_completion(self, payload: Dict) -> Iterator[Dict]:
+        """POST a streaming chat/completions request and yield parsed SSE chunks"""
+        with get_http_client().stream(
+            'POST',
+            OPENAI_CHAT_URL,
+            headers={
+                'Authorization': f'Bearer {self.openai_api_key}',
+                'Content-Type': 'application/json'
+            },
+            json=payload,
+            timeout=30
+        ) as response:
+            if response.status_code != 200:
+                error_msg = f"Provider Error: {response.status_code} - {response.text}"
+                logging.error(f"OpenAI Error: {error_msg}")
+                print(f"FAILED OPENAI CALL: {error_msg}")
+                yield {'error': error_msg}
+                return
+
+            for line in response.iter_lines():
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    yield json.loads(data)
+                except json.JSONDecodeError:
+                    continue
@@ -1,7 +1,435 @@
 """Knowledge Base Component - Manages company-specific knowledge"""
+import os
+import re
+import hashlib
+import math
+import time
+import threading
+import unicodedata
 import uuid
+from collections import Counter, defaultdict
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from cache import TTLCache
+
+# Retrieval settings
+KNOWLEDGE_TOP_K = int(os.getenv('KNOWLEDGE_TOP_K', '5'))
+KNOWLEDGE_PASSAGE_CHARS = int(os.getenv('KNOWLEDGE_PASSAGE_CHARS', '800'))
+KNOWLEDGE_INDEX_TTL = int(os.getenv('KNOWLEDGE_INDEX_TTL', '300'))  # seconds
+# Knowledge bases up to this size are still injected in full
+KNOWLEDGE_FULL_DUMP_MAX_CHARS = int(os.getenv('KNOWLEDGE_FULL_DUMP_MAX_CHARS', '4000'))
+# Entry columns returned to callers (excludes the generated search vectors)
+KNOWLEDGE_COLUMNS = ('id, company_id, title, content, source_url, metadata, is_active, '
+                     'created_at, updated_at, category, tags, type, description')
+# Where the bot ranks knowledge: 'database' (full-text search RPC) or
+# 'local' (in-process BM25 + vectors). The database avoids loading whole
+# knowledge bases into short-lived serverless instances: only the size and
+# change marker (knowledge_stats RPC) are fetched, and the local index is
+# built for small knowledge bases (injected in full) or if an RPC fails.
+KNOWLEDGE_SEARCH_BACKEND = os.getenv('KNOWLEDGE_SEARCH_BACKEND') or ('database' if os.getenv('VERCEL') else 'local')
+KNOWLEDGE_STATS_TTL = int(os.getenv('KNOWLEDGE_STATS_TTL', '60'))  # seconds
+# Each ranker contributes top_k * factor candidates to the fusion
+KNOWLEDGE_CANDIDATE_FACTOR = 4
+RRF_K = 60
+
+# =============================================================================
+# Tokenization (German + English)
+# =============================================================================
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does for from had has have how i if in into is it its
+me my no not of on or our so than that the their them then there these they this to was we were
+what when where which who why will with would you your
+aber als am an auch auf aus bei bin bis bist da dann das dass dem den der des die dies diese dieser
+dir doch du durch ein eine einem einen einer eines er es euch euer fur gibt habe haben hat hatte
+ich ihr ihre im in ist ja jede kann kein keine mich mir mit muss nach nicht noch nur ob oder sein
+seine sich sie sind so uber um und uns unser vom von vor war was wenn wer werden wie wir wird wo
+zu zum zur
+""".split())
+
+# Longest first; only stripped when at least 4 characters remain
+_SUFFIXES = ('erinnen', 'ungen', 'innen', 'ern', 'ung', 'ing', 'ies', 'en', 'er', 'es', 'e', 's')
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def _fold(text: str) -> str:
+    """Lowercase and strip diacritics (Führung -> fuhrung, ß -> ss)"""
+    text = text.lower().replace('ß', 'ss')
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+def _stem(token: str) -> str:
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized, stemmed terms without stopwords"""
+    if not text:
+        return []
+    return [_stem(t) for t in _TOKEN_RE.findall(_fold(text)) if t not in STOPWORDS and len(t) > 1]
+
+
+def split_passages(title: str, content: str, max_chars: int = KNOWLEDGE_PASSAGE_CHARS) -> List[str]:
+    """Split an entry into passages of roughly max_chars, on paragraph boundaries"""
+    content = (content or '').strip()
+    if len(content) <= max_chars:
+        return [content] if content else []
+
+    passages, current = [], ''
+    for paragraph in re.split(r'\n\s*\n', content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        # Hard-wrap paragraphs that are longer than a passage on their own
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(' ', 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            if current:
+                passages.append(current)
+                current = ''
+            passages.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            passages.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+# =============================================================================
+# BM25 Index
+# =============================================================================
+
+class BM25Index:
+    """
+    In-memory inverted index over knowledge passages with Okapi BM25 scoring.
+    Entries can be added, replaced and removed without a full rebuild.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.passages: Dict[int, Dict] = {}                  # passage id -> {entry_id, title, text, length}
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)  # term -> {passage id: tf}
+        self.entry_passages: Dict[str, List[int]] = {}      # entry id -> passage ids
+        self.total_length = 0
+        self.total_chars = 0
+        self.version = 0  # bumped on every change, used by derived indexes
+        self._signature = None
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def upsert_entry(self, entry: Dict) -> None:
+        """Index (or re-index) a knowledge entry"""
+        with self._lock:
+            self._remove(entry['id'])
+            title = entry.get('title') or ''
+            ids = []
+            for text in split_passages(title, entry.get('content') or ''):
+                # Title terms are counted twice so they outweigh body mentions
+                terms = tokenize(title) * 2 + tokenize(text)
+                if not terms:
+                    continue
+                pid = self._next_id
+                self._next_id += 1
+                counts = Counter(terms)
+                for term, tf in counts.items():
+                    self.postings[term][pid] = tf
+                self.passages[pid] = {
+                    'entry_id': entry['id'],
+                    'title': title,
+                    'text': text,
+                    'length': len(terms),
+                    'terms': tuple(counts)
+                }
+                self.total_length += len(terms)
+                self.total_chars += len(text)
+                ids.append(pid)
+            self.entry_passages[entry['id']] = ids
+            self.version += 1
+
+    def remove_entry(self, entry_id: str) -> None:
+        """Drop all passages of an entry"""
+        with self._lock:
+            self._remove(entry_id)
+            self.version += 1
+
+    def _remove(self, entry_id: str) -> None:
+        for pid in self.entry_passages.pop(entry_id, []):
+            passage = self.passages.pop(pid)
+            self.total_length -= passage['length']
+            self.total_chars -= len(passage['text'])
+            for term in passage['terms']:
+                postings = self.postings[term]
+                postings.pop(pid, None)
+                if not postings:
+                    del self.postings[term]
+
+    def signature(self) -> str:
+        """Hash of the indexed content; equal for equal knowledge bases"""
+        with self._lock:
+            if self._signature is None or self._signature[0] != self.version:
+                digest = hashlib.sha1()
+                for passage in sorted(self.passages.values(), key=lambda p: (str(p['entry_id']), p['text'])):
+                    digest.update(f"{passage['entry_id']}\0{passage['title']}\0{passage['text']}\0".encode('utf-8'))
+                self._signature = (self.version, digest.hexdigest()[:16])
+            return self._signature[1]
+
+    def snapshot(self) -> Tuple[int, List[Tuple[int, Dict]]]:
+        """Consistent (version, [(passage id, passage)]) view, ordered by id"""
+        with self._lock:
+            return self.version, sorted(self.passages.items())
+
+    def search(self, query: str, top_k: int = KNOWLEDGE_TOP_K) -> List[Tuple[float, Dict]]:
+        """Return up to top_k (score, passage) pairs, best first"""
+        with self._lock:
+            return [(score, self.passages[pid]) for score, pid in self.search_ids(query, top_k)]
+
+    def search_ids(self, query: str, top_k: int = KNOWLEDGE_TOP_K) -> List[Tuple[float, int]]:
+        """Return up to top_k (score, passage id) pairs, best first"""
+        terms = set(tokenize(query))
+        if not terms or not self.passages:
+            return []
+
+        with self._lock:
+            n = len(self.passages)
+            avgdl = self.total_length / n if n else 1.0
+            scores: Dict[int, float] = defaultdict(float)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for pid, tf in postings.items():
+                    length = self.passages[pid]['length']
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avgdl))
+                    scores[pid] += idf * norm
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [(score, pid) for pid, score in best]
+
+
+# Per-company indexes, loaded lazily: company_id -> (index, loaded_at)
+_indexes: Dict[str, Tuple[BM25Index, float]] = {}
+_indexes_lock = threading.Lock()
+_stats_cache = TTLCache(maxsize=1024, ttl=KNOWLEDGE_STATS_TTL)
+
+
+def get_company_index(db_module, company_id: str) -> Optional[BM25Index]:
+    """
+    Get the BM25 index for a company, building it on first use.
+    Indexes are rebuilt after KNOWLEDGE_INDEX_TTL so writes from other
+    instances or scripts are picked up.
+    """
+    cached = _indexes.get(company_id)
+    if cached and time.monotonic() - cached[1] < KNOWLEDGE_INDEX_TTL:
+        return cached[0]
+
+    try:
+        db_client = db_module.get_db()
+        if not db_client:
+            return cached[0] if cached else None
+        result = db_client.table('company_knowledge_base')\
+            .select('id, title, content')\
+            .eq('company_id', company_id)\
+            .eq('is_active', True)\
+            .execute()
+    except Exception as e:
+        print(f"Error loading knowledge index: {e}")
+        return cached[0] if cached else None
+
+    index = BM25Index()
+    for entry in result.data or []:
+        index.upsert_entry(entry)
+    with _indexes_lock:
+        _indexes[company_id] = (index, time.monotonic())
+    return index
+
+
+def _update_loaded_index(company_id: str, entry: Dict = None, removed_id: str = None) -> None:
+    """Apply a write to the company's index if it is loaded"""
+    _stats_cache.pop(company_id)
+    cached = _indexes.get(company_id)
+    if not cached:
+        return
+    index = cached[0]
+    if removed_id:
+        index.remove_entry(removed_id)
+    elif entry:
+        if entry.get('is_active', True):
+            index.upsert_entry(entry)
+        else:
+            index.remove_entry(entry['id'])
+
+
+def get_knowledge_stats(db_module, company_id: str) -> Optional[Dict]:
+    """
+    Size of a company's active knowledge from the knowledge_stats RPC,
+    cached for KNOWLEDGE_STATS_TTL.
+
+    Returns:
+        {entries, total_chars, updated_at}, or None if the RPC is unavailable
+    """
+    stats = _stats_cache.get(company_id)
+    if stats is not None:
+        return stats
+    try:
+        db_client = db_module.get_db()
+        if not db_client:
+            return None
+        result = db_client.rpc('knowledge_stats', {'p_company_id': company_id}).execute()
+        row = (result.data or [{}])[0]
+        stats = {
+            'entries': row.get('entries') or 0,
+            'total_chars': row.get('total_chars') or 0,
+            'updated_at': row.get('updated_at')
+        }
+    except Exception as e:
+        print(f"Knowledge stats RPC failed: {e}")
+        return None
+    _stats_cache.set(company_id, stats)
+    return stats
+
+
+def get_knowledge_version(db_module, company_id: str) -> Optional[str]:
+    """
+    Version of a company's active knowledge (None if unavailable): a content
+    hash of the local index, or with the database backend a hash of
+    knowledge_stats, which changes with every edit, addition or removal.
+    """
+    if KNOWLEDGE_SEARCH_BACKEND == 'database':
+        stats = get_knowledge_stats(db_module, company_id)
+        if stats is not None:
+            marker = f"{stats['entries']}\0{stats['total_chars']}\0{stats['updated_at']}"
+            return hashlib.sha1(marker.encode('utf-8')).hexdigest()[:16]
+    index = get_company_index(db_module, company_id)
+    return index.signature() if index is not None else None
+
+
+def invalidate_company_index(company_id: str) -> None:
+    """Drop a company's index so it is rebuilt on next use"""
+    _stats_cache.pop(company_id)
+    with _indexes_lock:
+        _indexes.pop(company_id, None)
+
+
+def format_knowledge(passages: List[Dict]) -> str:
+    """Format passages in the same layout as the full knowledge dump"""
+    if not passages:
+        return ""
+    knowledge_text = "\n\n### Company Knowledge Base:\n"
+    for passage in passages:
+        knowledge_text += f"---\nTitle: {passage.get('title') or 'Unknown'}\nContent:\n{passage.get('text', '')}\n"
+    return knowledge_text
+
+
+def search_passages(db_module, company_id: str, query: str, top_k: int = KNOWLEDGE_TOP_K) -> List[Dict]:
+    """
+    Hybrid search: BM25 and vector rankings merged with reciprocal rank
+    fusion. Falls back to BM25 alone if vector search is unavailable.
+    """
+    index = get_company_index(db_module, company_id)
+    if not index or not len(index) or not query:
+        return []
+
+    candidates = max(top_k * KNOWLEDGE_CANDIDATE_FACTOR, top_k)
+    rankings = [[pid for _, pid in index.search_ids(query, candidates)]]
+
+    from bot import vectors
+    vector_index = vectors.get_vector_index(company_id, index)
+    if vector_index is not None:
+        try:
+            rankings.append([pid for _, pid in vector_index.search(query, candidates)])
+        except Exception as e:
+            print(f"Vector search failed, using BM25 only: {e}")
+
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, pid in enumerate(ranking):
+            fused[pid] += 1.0 / (RRF_K + rank + 1)
+
+    best = sorted(fused, key=fused.get, reverse=True)
+    return [index.passages[pid] for pid in best if pid in index.passages][:top_k]
+
+
+def search_knowledge(db_module, company_id: str, query: str, k: int = KNOWLEDGE_TOP_K) -> Optional[List[Dict]]:
+    """
+    Rank a company's knowledge inside Postgres (search_knowledge RPC).
+
+    Returns:
+        List of {id, title, category, content, snippet, rank}, best first, or
+        None if the RPC is unavailable (migration not applied, no connection)
+    """
+    if not query or not query.strip():
+        return []
+    try:
+        db_client = db_module.get_db()
+        if not db_client:
+            return None
+        result = db_client.rpc('search_knowledge', {
+            'p_company_id': company_id,
+            'p_query': query,
+            'p_limit': k
+        }).execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Knowledge search RPC failed: {e}")
+        return None
+
+
+def best_passage(title: str, content: str, query: str) -> str:
+    """The passage of an entry sharing the most terms with the query"""
+    passages = split_passages(title, content)
+    if len(passages) <= 1:
+        return passages[0] if passages else ''
+    terms = set(tokenize(query))
+    return max(passages, key=lambda text: len(terms.intersection(tokenize(text))))
+
+
+def retrieve_knowledge(db_module, company_id: str, query: str, top_k: int = None) -> str:
+    """
+    Get the knowledge to inject for a user query.
+
+    Small knowledge bases (<= KNOWLEDGE_FULL_DUMP_MAX_CHARS) are injected in
+    full, so greetings and follow-ups without matching words still get them.
+    Larger ones contribute their top_k passages: with the database backend
+    one per entry ranked by the search_knowledge RPC (sized up front with
+    knowledge_stats, so the knowledge base is not downloaded), otherwise
+    from the local index (also the fallback when an RPC is unavailable).
+    """
+    top_k = top_k or KNOWLEDGE_TOP_K
+    if KNOWLEDGE_SEARCH_BACKEND == 'database':
+        stats = get_knowledge_stats(db_module, company_id)
+        if stats is not None and not stats['entries']:
+            return ""
+        if stats is not None and stats['total_chars'] > KNOWLEDGE_FULL_DUMP_MAX_CHARS:
+            rows = search_knowledge(db_module, company_id, query, top_k)
+            if rows is not None:
+                return format_knowledge([
+                    {'title': row.get('title'), 'text': best_passage(row.get('title'), row.get('content'), query)}
+                    for row in rows
+                ])
+
+    index = get_company_index(db_module, company_id)
+    if not index or not len(index):
+        return ""
+
+    if index.total_chars <= KNOWLEDGE_FULL_DUMP_MAX_CHARS:
+        return format_knowledge([passage for _, passage in index.snapshot()[1]])
+
+    return format_knowledge(search_passages(db_module, company_id, query or '', top_k))
+
 
 class KnowledgeBase:
     """
@@ -10,6 +438,7 @@ class KnowledgeBase:
     """
     
     def __init__(self, db_module):
+        self.db_module = db_module
         self.db = db_module.get_db()
         
     def add_knowledge(self, company_id: str, title: str, content: str, 
@@ -51,6 +480,7 @@ class KnowledgeBase:
                 result = self.db.table('company_knowledge_base').insert(entry_data).execute()
                 
             if result.data:
+                _update_loaded_index(company_id, entry=result.data[0])
                 return result.data[0]
             return None
             
@@ -63,13 +493,30 @@ class KnowledgeBase:
                       query: str = None) -> List[Dict]:
         """
         Retrieve active knowledge entries for a company with optional filtering.
+        With a query, entries are ranked by full-text search (with a
+        `snippet` of the matching text), falling back to the local index.
         """
         if not self.db:
             return []
-            
+
+        if query:
+            # Ranked in the database; the local index covers a missing RPC
+            hits = search_knowledge(self.db_module, company_id, query, limit)
+            if hits is None:
+                ranked, snippets = self._search_entry_ids(company_id, query, limit), {}
+            else:
+                ranked = [hit['id'] for hit in hits]
+                snippets = {hit['id']: hit.get('snippet') for hit in hits}
+            if ranked:
+                entries = self._get_ranked_entries(company_id, ranked, category, tags)
+                for entry in entries:
+                    if snippets.get(entry['id']):
+                        entry['snippet'] = snippets[entry['id']]
+                return entries
+
         try:
             req = self.db.table('company_knowledge_base')\
-                .select('*')\
+                .select(KNOWLEDGE_COLUMNS)\
                 .eq('company_id', company_id)\
                 .eq('is_active', True)
             
@@ -81,8 +528,7 @@ class KnowledgeBase:
                 req = req.contains('tags', tags)
             
             if query:
-                # Simple text search on title or content
-                # Note: For better search, use full text search or embeddings
+                # Fallback when the search index has no match
                 req = req.ilike('title', f'%{query}%')
 
             result = req.order('created_at', desc=True)\
@@ -94,6 +540,38 @@ class KnowledgeBase:
             print(f"Error retrieving knowledge: {e}")
             return []
 
+    def _search_entry_ids(self, company_id: str, query: str, limit: int) -> List[str]:
+        """Entry ids ranked by their best matching passage"""
+        try:
+            passages = search_passages(self.db_module, company_id, query, top_k=limit * 3)
+        except Exception as e:
+            print(f"Error searching knowledge: {e}")
+            return []
+        ranked = []
+        for passage in passages:
+            if passage['entry_id'] not in ranked:
+                ranked.append(passage['entry_id'])
+        return ranked[:limit]
+
+    def _get_ranked_entries(self, company_id: str, entry_ids: List[str],
+                            category: str = None, tags: List[str] = None) -> List[Dict]:
+        """Load entries by id, keeping the search ranking"""
+        try:
+            req = self.db.table('company_knowledge_base')\
+                .select(KNOWLEDGE_COLUMNS)\
+                .eq('company_id', company_id)\
+                .eq('is_active', True)\
+                .in_('id', entry_ids)
+            if category:
+                req = req.eq('category', category)
+            if tags:
+                req = req.contains('tags', tags)
+            rows = {row['id']: row for row in (req.execute().data or [])}
+            return [rows[entry_id] for entry_id in entry_ids if entry_id in rows]
+        except Exception as e:
+            print(f"Error retrieving knowledge: {e}")
+            return []
+
     def update_knowledge(self, entry_id: str, updates: Dict) -> Optional[Dict]:
         """
         Update specific fields of a knowledge entry.
@@ -104,7 +582,11 @@ class KnowledgeBase:
         try:
             updates['updated_at'] = datetime.utcnow().isoformat()
             result = self.db.table('company_knowledge_base').update(updates).eq('id', entry_id).execute()
-            return result.data[0] if result.data else None
+            if not result.data:
+                return None
+            entry = result.data[0]
+            _update_loaded_index(entry.get('company_id'), entry=entry)
+            return entry
         except Exception as e:
             print(f"Error updating knowledge: {e}")
             return None
@@ -118,12 +600,14 @@ class KnowledgeBase:
             
         try:
             if soft_delete:
-                self.db.table('company_knowledge_base').update({
+                result = self.db.table('company_knowledge_base').update({
                     'is_active': False,
                     'updated_at': datetime.utcnow().isoformat()
                 }).eq('id', entry_id).execute()
             else:
-                self.db.table('company_knowledge_base').delete().eq('id', entry_id).execute()
+                result = self.db.table('company_knowledge_base').delete().eq('id', entry_id).execute()
+            for row in result.data or []:
+                _update_loaded_index(row.get('company_id'), removed_id=entry_id)
             return True
         except Exception as e:
             print(f"Error deleting knowledge: {e}")
@@ -138,6 +622,7 @@ class KnowledgeBase:
             
         try:
             self.db.table('company_knowledge_base').delete().eq('company_id', company_id).execute()
+            invalidate_company_index(company_id)
             return True
         except Exception as e:
             print(f"Error clearing knowledge: {e}")
@@ -0,0 +1,183 @@
+"""
+Vector Search - offline, CPU-only semantic retrieval over knowledge passages
+
+Passages are embedded with a signed feature-hashing embedder (stemmed words
+plus character 4-grams, IDF-weighted per company) into float32 vectors, so no
+model download, GPU or network call is needed. Each company's matrix is
+persisted as a memory-mapped file and searched with a single matrix-vector
+product. NumPy is optional: without it callers fall back to BM25.
+
+Environment:
+    VECTOR_DIM        embedding dimensions (default 512)
+    VECTOR_STORE_DIR  where per-company matrices are stored
+                      (default /tmp/syntra_vectors)
+    VECTOR_MIN_SCORE  cosine similarity below which hits are dropped (default 0.1)
+"""
+
+import os
+import glob
+import zlib
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bot.knowledge import tokenize, _fold, _TOKEN_RE
+
+VECTOR_DIM = int(os.getenv('VECTOR_DIM', '512'))
+VECTOR_STORE_DIR = os.getenv('VECTOR_STORE_DIR', '/tmp/syntra_vectors')
+VECTOR_MIN_SCORE = float(os.getenv('VECTOR_MIN_SCORE', '0.1'))
+
+NGRAM_SIZE = 4
+NGRAM_WEIGHT = 0.5
+
+
+def is_available() -> bool:
+    """Whether vector search can run (NumPy installed)"""
+    return np is not None
+
+
+def _features(text: str) -> Dict[str, float]:
+    """Weighted hashing features: stemmed words and character n-grams"""
+    features: Dict[str, float] = {}
+    for term in tokenize(text):
+        features['w:' + term] = features.get('w:' + term, 0.0) + 1.0
+    # N-grams let compounds ("Konfliktmanagement") match their parts
+    for word in _TOKEN_RE.findall(_fold(text or '')):
+        padded = f" {word} "
+        for i in range(len(padded) - NGRAM_SIZE + 1):
+            key = 'c:' + padded[i:i + NGRAM_SIZE]
+            features[key] = features.get(key, 0.0) + NGRAM_WEIGHT
+    return features
+
+
+def embed(texts: List[str], dim: int = VECTOR_DIM):
+    """Embed texts into an (n, dim) float32 matrix of raw hashed counts"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, weight in _features(text).items():
+            # crc32 is stable across processes (unlike hash())
+            h = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            matrix[row, h % dim] += sign * weight
+    # Sublinear tf so repeated words do not dominate
+    return np.sign(matrix) * np.log1p(np.abs(matrix))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """Row-normalized passage vectors plus the IDF weights used to build them"""
+
+    def __init__(self, passage_ids: List[int], matrix, idf):
+        self.passage_ids = passage_ids
+        self.matrix = matrix
+        self.idf = idf
+
+    def __len__(self) -> int:
+        return len(self.passage_ids)
+
+    @classmethod
+    def build(cls, passage_ids: List[int], texts: List[str], dim: int = VECTOR_DIM) -> 'VectorIndex':
+        raw = embed(texts, dim)
+        n = max(len(texts), 1)
+        df = np.count_nonzero(raw, axis=0)
+        idf = (np.log((n + 1) / (df + 1)) + 1.0).astype(np.float32)
+        return cls(passage_ids, _normalize(raw * idf).astype(np.float32), idf)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, int]]:
+        """Return up to top_k (cosine score, passage id) pairs, best first"""
+        if not len(self.passage_ids):
+            return []
+        q = _normalize(embed([query], self.matrix.shape[1])[0] * self.idf)
+        if not q.any():
+            return []
+
+        scores = self.matrix @ q
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.passage_ids[i]) for i in top if scores[i] >= VECTOR_MIN_SCORE]
+
+
+# =============================================================================
+# Memory-mapped persistence
+# =============================================================================
+
+def _signature(texts: List[str], dim: int) -> str:
+    digest = hashlib.sha1(str(dim).encode())
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def load_or_build(company_id: str, passage_ids: List[int], texts: List[str],
+                  dim: int = VECTOR_DIM) -> VectorIndex:
+    """
+    Get the vector index for a company's passages, reusing the memory-mapped
+    matrix from a previous build when the passages are unchanged.
+    The file holds the passage vectors followed by one row of IDF weights.
+    """
+    path = os.path.join(VECTOR_STORE_DIR, f"{company_id}-{_signature(texts, dim)}.f32")
+    rows = len(texts) + 1
+
+    if os.path.exists(path) and os.path.getsize(path) == rows * dim * 4:
+        try:
+            data = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, dim))
+            return VectorIndex(passage_ids, data[:-1], np.array(data[-1]))
+        except Exception as e:
+            print(f"Error loading vector store {path}: {e}")
+
+    index = VectorIndex.build(passage_ids, texts, dim)
+    try:
+        os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        data = np.memmap(tmp_path, dtype=np.float32, mode='w+', shape=(rows, dim))
+        data[:-1] = index.matrix
+        data[-1] = index.idf
+        data.flush()
+        del data
+        os.replace(tmp_path, path)
+        # Drop matrices from older versions of this company's knowledge
+        for old in glob.glob(os.path.join(VECTOR_STORE_DIR, f"{company_id}-*.f32")):
+            if old != path:
+                os.remove(old)
+    except Exception as e:
+        print(f"Error saving vector store {path}: {e}")
+    return index
+
+
+# Per-company vector indexes: company_id -> (bm25 index, bm25 version, vector index)
+_vector_indexes: Dict[str, Tuple[object, int, VectorIndex]] = {}
+_vector_lock = threading.Lock()
+
+
+def get_vector_index(company_id: str, bm25_index) -> Optional[VectorIndex]:
+    """Get the vector index matching the current state of a company's BM25 index"""
+    if np is None or bm25_index is None:
+        return None
+
+    cached = _vector_indexes.get(company_id)
+    if cached and cached[0] is bm25_index and cached[1] == bm25_index.version:
+        return cached[2]
+
+    with _vector_lock:
+        version, passages = bm25_index.snapshot()
+        passage_ids = [pid for pid, _ in passages]
+        texts = [f"{p['title']}\n{p['text']}" for _, p in passages]
+        try:
+            index = load_or_build(company_id, passage_ids, texts)
+        except Exception as e:
+            print(f"Error building vector index: {e}")
+            return None
+        _vector_indexes[company_id] = (bm25_index, version, index)
+        return index
@@ -5,14 +5,287 @@ This service tracks:
 - Messages sent per company
 - Sessions created per company
 - Tokens consumed per company
-- Average response times
+- Response times (exact average plus a latency histogram)
+- Chat turns rejected by the throttle (chat_throttle.py)
 
 Statistics are aggregated daily for efficient querying.
+
+Buffering:
+    Counters are accumulated in memory per (company, day) and written as one
+    batched upsert every ANALYTICS_FLUSH_INTERVAL seconds or after
+    ANALYTICS_FLUSH_EVENTS tracked events, whichever comes first, and on
+    process exit. If a process is killed without running its exit handlers,
+    at most the events of one flush window are lost. Serverless instances
+    are frozen between requests and recycled without exit handlers, so on
+    Vercel buffering is off by default and every event is written
+    immediately (as with CHAT_WRITE_MODE in background_writer.py).
+
+    Throttled turns (track_throttle) are always buffered, so a flood of
+    rejected requests never turns into one database write each. With
+    buffering off they ride along with the next immediate write, or are
+    flushed after THROTTLE_FLUSH_INTERVAL seconds.
+
+Environment:
+    ANALYTICS_FLUSH_INTERVAL  seconds between flushes, 0 = unbuffered (default 10, 0 on Vercel)
+    ANALYTICS_FLUSH_EVENTS    events that trigger an early flush (default 200)
+    CHAT_SUMMARY_CACHE_TTL    seconds the admin companies summary is cached (default 30)
 """
 
-from datetime import datetime, date, timedelta, timezone
-from typing import Optional, Dict, List, Any
+import os
+import atexit
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Dict, List, Any, Tuple
 import db
+from cache import TTLCache
+
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '0' if os.getenv('VERCEL') else '10'))
+ANALYTICS_FLUSH_EVENTS = int(os.getenv('ANALYTICS_FLUSH_EVENTS', '200'))
+# Flush interval for throttle counts when ANALYTICS_FLUSH_INTERVAL is 0
+THROTTLE_FLUSH_INTERVAL = 10.0  # seconds
+CHAT_SUMMARY_CACHE_TTL = int(os.getenv('CHAT_SUMMARY_CACHE_TTL', '30'))  # seconds
+
+SUMMARY_SORTS = ('messages', 'sessions', 'tokens', 'response_time', 'name')
+_summary_cache = TTLCache(maxsize=64, ttl=CHAT_SUMMARY_CACHE_TTL)
+
+# Response time histogram bucket upper bounds (ms); slower responses go to 'inf'
+LATENCY_BUCKETS_MS = (100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000,
+                      8000, 10000, 15000, 20000, 30000, 60000)
+
+
+def latency_bucket(response_time_ms: int) -> str:
+    """Histogram bucket key for a response time"""
+    index = bisect_left(LATENCY_BUCKETS_MS, response_time_ms)
+    return str(LATENCY_BUCKETS_MS[index]) if index < len(LATENCY_BUCKETS_MS) else 'inf'
+
+
+def estimate_percentile(histogram: Dict[str, int], quantile: float) -> Optional[int]:
+    """
+    Estimate a response time percentile from a histogram.
+    
+    Returns:
+        Upper bound (ms) of the bucket containing the quantile, or None if empty
+    """
+    counts = [(float(key), int(count)) for key, count in (histogram or {}).items()]
+    total = sum(count for _, count in counts)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for bound, count in sorted(counts):
+        seen += count
+        if seen >= rank:
+            return None if bound == float('inf') else int(bound)
+    return None
+
+
+def merge_histograms(histograms) -> Dict[str, int]:
+    """Add up {bucket: count} histograms"""
+    merged: Dict[str, int] = defaultdict(int)
+    for histogram in histograms:
+        for key, count in (histogram or {}).items():
+            merged[key] += int(count)
+    return dict(merged)
+
+
+def _new_delta() -> Dict[str, Any]:
+    return {
+        'messages': 0,
+        'sessions': 0,
+        'tokens': 0,
+        'response_time_sum_ms': 0,
+        'response_time_count': 0,
+        'throttled': 0,
+        'histogram': defaultdict(int)
+    }
+
+
+def _write_batch(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Upsert aggregated deltas (one row per company and day) in one call.
+    
+    Returns:
+        Rows that could not be written
+    """
+    db_client = db.get_db()
+    if not db_client:
+        print("Database not available for chat analytics")
+        return rows
+    try:
+        db_client.rpc('increment_chat_stats_batch', {'p_rows': rows}).execute()
+        return []
+    except Exception as e:
+        # Batch RPC not deployed yet: fall back to one upsert per row
+        # (histograms are not stored by the single-row RPC)
+        print(f"Batch stats upsert failed, writing rows individually: {e}")
+
+    failed = []
+    for row in rows:
+        try:
+            db_client.rpc('increment_chat_stats', {
+                'p_company_id': row['company_id'],
+                'p_date': row['date'],
+                'p_messages': row['messages'],
+                'p_sessions': row['sessions'],
+                'p_tokens': row['tokens'],
+                'p_response_ms': (row['response_time_sum_ms'] // row['response_time_count']
+                                  if row['response_time_count'] else None)
+            }).execute()
+        except Exception as e:
+            print(f"Error writing chat statistics for {row['company_id']}: {e}")
+            failed.append(row)
+    return failed
+
+
+class StatsAggregator:
+    """Accumulates statistics deltas in memory and flushes them in batches"""
+
+    def __init__(self, flush_interval: float = ANALYTICS_FLUSH_INTERVAL,
+                 flush_events: int = ANALYTICS_FLUSH_EVENTS):
+        self.flush_interval = flush_interval
+        self.flush_events = max(1, flush_events)
+        self._deltas: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'events': 0, 'flushes': 0, 'rows_written': 0, 'failed_flushes': 0}
+
+    def record(self, company_id: str, messages: int = 0, sessions: int = 0,
+               tokens: int = 0, response_time_ms: Optional[int] = None,
+               day: Optional[date] = None, throttled: int = 0) -> None:
+        """Add deltas for a company's day (written on the next flush)"""
+        self._ensure_started()
+        key = (company_id, str(day or date.today()))
+        with self._lock:
+            delta = self._deltas.get(key)
+            if delta is None:
+                delta = self._deltas[key] = _new_delta()
+            delta['messages'] += messages
+            delta['sessions'] += sessions
+            delta['tokens'] += tokens or 0
+            delta['throttled'] += throttled
+            if response_time_ms is not None:
+                delta['response_time_sum_ms'] += int(response_time_ms)
+                delta['response_time_count'] += 1
+                delta['histogram'][latency_bucket(response_time_ms)] += 1
+            self._events += 1
+            self.stats['events'] += 1
+            if self._events >= self.flush_events:
+                self._wake.set()
+
+    def flush(self) -> bool:
+        """
+        Write all pending deltas as one batch.
+        
+        Returns:
+            False if the write failed (deltas are kept for the next flush)
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._deltas = self._deltas, {}
+                self._events = 0
+            if not pending:
+                return True
+
+            rows = [
+                {**delta, 'company_id': company_id, 'date': day, 'histogram': dict(delta['histogram'])}
+                for (company_id, day), delta in pending.items()
+            ]
+            failed = _write_batch(rows)
+            self.stats['flushes'] += 1
+            self.stats['rows_written'] += len(rows) - len(failed)
+            if not failed:
+                return True
+            self.stats['failed_flushes'] += 1
+            self._restore({(row['company_id'], row['date']): pending[(row['company_id'], row['date'])]
+                           for row in failed})
+            return False
+
+    def _restore(self, pending: Dict[Tuple[str, str], Dict[str, Any]]) -> None:
+        """Merge unwritten deltas back so the next flush retries them"""
+        with self._lock:
+            for key, old in pending.items():
+                delta = self._deltas.get(key)
+                if delta is None:
+                    self._deltas[key] = old
+                    continue
+                for field in ('messages', 'sessions', 'tokens', 'response_time_sum_ms', 'response_time_count',
+                              'throttled'):
+                    delta[field] += old[field]
+                for bucket, count in old['histogram'].items():
+                    delta['histogram'][bucket] += count
+
+    def _ensure_started(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name='chat-stats-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Chat statistics flusher error: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pending and flushed counters"""
+        with self._lock:
+            pending = len(self._deltas)
+        return {**self.stats, 'pending_rows': pending, 'flush_interval': self.flush_interval}
+
+
+# Global instance
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_stats_aggregator() -> StatsAggregator:
+    """Get the global statistics aggregator"""
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = StatsAggregator(ANALYTICS_FLUSH_INTERVAL or THROTTLE_FLUSH_INTERVAL)
+    return _aggregator
+
+
+def increment_stats(company_id: str, messages: int = 0, sessions: int = 0,
+                    tokens: int = 0, response_time_ms: Optional[int] = None,
+                    day: Optional[date] = None, throttled: int = 0) -> None:
+    """
+    Add deltas to a company's daily statistics.
+    
+    Buffered in the aggregator unless ANALYTICS_FLUSH_INTERVAL is 0, in
+    which case they are written immediately in one atomic upsert, together
+    with any buffered throttle counts.
+    
+    Args:
+        company_id: Company UUID
+        messages: Messages to add
+        sessions: Sessions to add
+        tokens: Tokens to add
+        response_time_ms: One response time sample (None if not measured)
+        day: Statistics day (defaults to today)
+        throttled: Rejected chat turns to add
+    """
+    aggregator = get_stats_aggregator()
+    aggregator.record(company_id, messages, sessions, tokens, response_time_ms, day, throttled)
+    if ANALYTICS_FLUSH_INTERVAL > 0:
+        return
+
+    if not aggregator.flush():
+        raise RuntimeError("Chat statistics could not be written")
 
 
 def track_message(company_id: Optional[str], tokens_used: Optional[int] = 0, 
@@ -29,52 +302,8 @@ def track_message(company_id: Optional[str], tokens_used: Optional[int] = 0,
         return  # Skip tracking if no company
     
     try:
-        db_client = db.get_db()
-        if not db_client:
-            print("Database not available for chat analytics")
-            return
-        
-        today = date.today()
-        
-        # Upsert daily statistics
-        # PostgreSQL doesn't have native UPSERT in basic queries, use ON CONFLICT
-        result = db_client.table('chat_statistics').select('*').eq(
-            'company_id', company_id
-        ).eq('date', str(today)).execute()
-        
-        if result.data and len(result.data) > 0:
-            # Update existing record
-            stats = result.data[0]
-            new_total_messages = stats['total_messages'] + 1
-            new_total_tokens = stats['total_tokens'] + (tokens_used or 0)
-            
-            # Calculate running average response time
-            if response_time_ms and stats['avg_response_time_ms']:
-                old_avg = stats['avg_response_time_ms']
-                old_count = stats['total_messages']
-                new_avg = ((old_avg * old_count) + response_time_ms) / new_total_messages
-            elif response_time_ms:
-                new_avg = response_time_ms
-            else:
-                new_avg = stats['avg_response_time_ms']
-            
-            db_client.table('chat_statistics').update({
-                'total_messages': new_total_messages,
-                'total_tokens': new_total_tokens,
-                'avg_response_time_ms': int(new_avg) if new_avg else None,
-                'updated_at': datetime.now(timezone.utc).isoformat()
-            }).eq('id', stats['id']).execute()
-        else:
-            # Insert new record
-            db_client.table('chat_statistics').insert({
-                'company_id': company_id,
-                'date': str(today),
-                'total_messages': 1,
-                'total_sessions': 0,  # Updated separately
-                'total_tokens': tokens_used or 0,
-                'avg_response_time_ms': response_time_ms
-            }).execute()
-            
+        increment_stats(company_id, messages=1, tokens=tokens_used or 0,
+                        response_time_ms=response_time_ms)
     except Exception as e:
         print(f"Error tracking message stats: {e}")
 
@@ -90,40 +319,55 @@ def track_session(company_id: Optional[str]) -> None:
         return
     
     try:
-        db_client = db.get_db()
-        if not db_client:
-            return
-        
-        today = date.today()
-        
-        result = db_client.table('chat_statistics').select('*').eq(
-            'company_id', company_id
-        ).eq('date', str(today)).execute()
-        
-        if result.data and len(result.data) > 0:
-            stats = result.data[0]
-            db_client.table('chat_statistics').update({
-                'total_sessions': stats['total_sessions'] + 1,
-                'updated_at': datetime.now(timezone.utc).isoformat()
-            }).eq('id', stats['id']).execute()
-        else:
-            # Create initial record
-            db_client.table('chat_statistics').insert({
-                'company_id': company_id,
-                'date': str(today),
-                'total_messages': 0,
-                'total_sessions': 1,
-                'total_tokens': 0
-            }).execute()
-            
+        increment_stats(company_id, sessions=1)
     except Exception as e:
         print(f"Error tracking session: {e}")
 
 
+def track_throttle(company_id: Optional[str]) -> None:
+    """
+    Count a chat turn rejected by the throttle for a company.
+    
+    Args:
+        company_id: Company UUID (None if the turn was rejected before the
+            company was resolved)
+    """
+    if not company_id:
+        return
+    
+    # Always buffered: the rejection path must not wait on the database
+    try:
+        get_stats_aggregator().record(company_id, throttled=1)
+    except Exception as e:
+        print(f"Error tracking throttled request: {e}")
+
+
+def get_chat_activity(company_id: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """
+    Per-day message, token and session counts of a company, served from the
+    analytics rollups with raw rows for the part not rolled up yet
+    (get_chat_activity RPC).
+    
+    Returns:
+        List of {day, user_messages, assistant_messages, tokens, new_sessions}
+    """
+    result = db.get_db().rpc('get_chat_activity', {
+        'p_company_id': company_id,
+        'p_start': start.isoformat(),
+        'p_end': end.isoformat()
+    }).execute()
+    return result.data or []
+
+
 def get_company_stats(company_id: str, days: int = 30) -> Dict[str, Any]:
     """
     Get aggregated statistics for a company.
     
+    Message, session and token counts come from the analytics rollups;
+    response times come from chat_statistics, the only place they are
+    recorded. Falls back to chat_statistics counts if the rollup RPC is
+    unavailable.
+    
     Args:
         company_id: Company UUID
         days: Number of days to include
@@ -136,32 +380,77 @@ def get_company_stats(company_id: str, days: int = 30) -> Dict[str, Any]:
         if not db_client:
             return {'error': 'Database not available'}
         
-        start_date = date.today() - timedelta(days=days)
+        now = datetime.now(timezone.utc)
+        start_date = now.date() - timedelta(days=days)
         
-        result = db_client.table('chat_statistics').select('*').eq(
-            'company_id', company_id
-        ).gte('date', str(start_date)).order('date', desc=False).execute()
+        columns = ('date, total_messages, total_sessions, total_tokens, avg_response_time_ms, '
+                   'response_time_sum_ms, response_time_count, response_time_histogram')
+        
+        def load_statistics(select: str):
+            return db_client.table('chat_statistics').select(select).eq('company_id', company_id) \
+                .gte('date', str(start_date)).order('date', desc=False).execute()
+        
+        try:
+            result = load_statistics(columns + ', throttled_requests')
+        except Exception as e:
+            # Column added by database_migration_chat_throttling.sql
+            print(f"Error reading throttled_requests, skipping it: {e}")
+            result = load_statistics(columns)
         
         daily_stats = result.data if result.data else []
         
+        try:
+            start = datetime.combine(start_date, datetime.min.time(), tzinfo=timezone.utc)
+            activity = get_chat_activity(company_id, start, now)
+        except Exception as e:
+            print(f"Error reading chat rollups, using chat_statistics: {e}")
+            activity = None
+        
+        if activity is not None:
+            response_times = {s['date']: s for s in daily_stats}
+            daily_stats = []
+            for row in activity:
+                timing = response_times.pop(row['day'], {})
+                daily_stats.append({
+                    'date': row['day'],
+                    'total_messages': row['assistant_messages'],
+                    'user_messages': row['user_messages'],
+                    'total_sessions': row['new_sessions'],
+                    'total_tokens': row['tokens'],
+                    'avg_response_time_ms': timing.get('avg_response_time_ms'),
+                    'response_time_sum_ms': timing.get('response_time_sum_ms') or 0,
+                    'response_time_count': timing.get('response_time_count') or 0,
+                    'response_time_histogram': timing.get('response_time_histogram') or {},
+                    'throttled_requests': timing.get('throttled_requests') or 0
+                })
+            # Days with timings but no stored messages (e.g. chat_messages pruned)
+            for timing in response_times.values():
+                daily_stats.append({**timing, 'total_messages': 0, 'user_messages': 0,
+                                    'total_sessions': 0, 'total_tokens': 0})
+            daily_stats.sort(key=lambda s: s['date'])
+        
         # Calculate totals
         total_messages = sum(s['total_messages'] for s in daily_stats)
         total_sessions = sum(s['total_sessions'] for s in daily_stats)
         total_tokens = sum(s['total_tokens'] for s in daily_stats)
+        throttled_requests = sum(s.get('throttled_requests') or 0 for s in daily_stats)
         
-        # Average response time (weighted by message count)
-        total_time = sum(
-            s['total_messages'] * (s['avg_response_time_ms'] or 0) 
-            for s in daily_stats
-        )
-        avg_response_time = total_time / total_messages if total_messages > 0 else None
+        # Average response time (exact: sum and count of measured responses)
+        total_time = sum(s.get('response_time_sum_ms') or 0 for s in daily_stats)
+        timed_responses = sum(s.get('response_time_count') or 0 for s in daily_stats)
+        avg_response_time = total_time / timed_responses if timed_responses > 0 else None
+        histogram = merge_histograms(s.get('response_time_histogram') for s in daily_stats)
         
         return {
             'period_days': days,
             'total_messages': total_messages,
             'total_sessions': total_sessions,
             'total_tokens': total_tokens,
+            'throttled_requests': throttled_requests,
             'avg_response_time_ms': int(avg_response_time) if avg_response_time else None,
+            'p50_response_time_ms': estimate_percentile(histogram, 0.5),
+            'p95_response_time_ms': estimate_percentile(histogram, 0.95),
+            'response_time_histogram': histogram,
             'daily_breakdown': daily_stats
         }
         
@@ -170,56 +459,72 @@ def get_company_stats(company_id: str, days: int = 30) -> Dict[str, Any]:
         return {'error': str(e)}
 
 
-def get_all_companies_summary() -> List[Dict[str, Any]]:
+def get_companies_summary_page(days: int = 30, sort: str = 'messages',
+                               descending: bool = True, limit: int = 50,
+                               offset: int = 0) -> Dict[str, Any]:
+    """
+    Get one page of per-company statistics, aggregated and sorted in the
+    database (get_chat_stats_summary RPC). Results are cached for
+    CHAT_SUMMARY_CACHE_TTL seconds.
+    
+    Args:
+        days: Number of days to include
+        sort: 'messages', 'sessions', 'tokens', 'response_time' or 'name'
+        descending: Sort direction
+        limit: Page size
+        offset: Rows to skip
+        
+    Returns:
+        Dict with companies (list of summaries) and total (number of companies)
+    """
+    if sort not in SUMMARY_SORTS:
+        sort = 'messages'
+    key = (days, sort, descending, limit, offset)
+    cached = _summary_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    db_client = db.get_db()
+    if not db_client:
+        return {'companies': [], 'total': 0}
+    
+    result = db_client.rpc('get_chat_stats_summary', {
+        'p_start_date': str(date.today() - timedelta(days=days)),
+        'p_sort': sort,
+        'p_desc': descending,
+        'p_limit': limit,
+        'p_offset': offset
+    }).execute()
+    
+    rows = result.data or []
+    page = {
+        'companies': [
+            {
+                'company_id': row['company_id'],
+                'company_name': row['company_name'],
+                'total_messages': row['total_messages'],
+                'total_sessions': row['total_sessions'],
+                'total_tokens': row['total_tokens'],
+                'avg_response_time_ms': row.get('avg_response_time_ms'),
+                'has_activity': row['total_messages'] > 0
+            }
+            for row in rows
+        ],
+        'total': rows[0]['total_count'] if rows else 0
+    }
+    _summary_cache.set(key, page)
+    return page
+
+
+def get_all_companies_summary(limit: int = 1000, offset: int = 0) -> List[Dict[str, Any]]:
     """
     Get summary statistics for all companies (last 30 days).
     
     Returns:
-        List of company summaries with key metrics
+        List of company summaries with key metrics, most active first
     """
     try:
-        db_client = db.get_db()
-        if not db_client:
-            return []
-        
-        # Get all companies
-        companies_result = db_client.table('companies').select('id,name').execute()
-        if not companies_result.data:
-            return []
-        
-        companies = companies_result.data
-        summaries = []
-        
-        start_date = date.today() - timedelta(days=30)
-        
-        for company in companies:
-            company_id = company['id']
-            
-            # Get stats for this company
-            stats_result = db_client.table('chat_statistics').select('*').eq(
-                'company_id', company_id
-            ).gte('date', str(start_date)).execute()
-            
-            stats = stats_result.data if stats_result.data else []
-            
-            total_messages = sum(s['total_messages'] for s in stats)
-            total_sessions = sum(s['total_sessions'] for s in stats)
-            total_tokens = sum(s['total_tokens'] for s in stats)
-            
-            summaries.append({
-                'company_id': company_id,
-                'company_name': company['name'],
-                'total_messages': total_messages,
-                'total_sessions': total_sessions,
-                'total_tokens': total_tokens,
-                'has_activity': total_messages > 0
-            })
-        
-        # Sort by activity (most active first)
-        summaries.sort(key=lambda x: x['total_messages'], reverse=True)
-        
-        return summaries
-        
+        return get_companies_summary_page(limit=limit, offset=offset)['companies']
     except Exception as e:
         print(f"Error getting companies summary: {e}")
         return []
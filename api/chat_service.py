@@ -1,12 +1,18 @@
 """Chat Service - ChatGPT API integration and n8n workflow handling"""
 import os
 import json
+import time
 import uuid
-import requests
+from http_client import get_http_client
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Iterator
 from dotenv import load_dotenv
 import chat_analytics
+import tenant_cache
+import timing
+import metrics
+from background_writer import get_background_writer
+from history_cache import get_history_cache, HISTORY_CACHE_VALIDATE
 
 load_dotenv()
 
@@ -70,10 +76,11 @@ WHATSAPP STYLE MESSAGING:
         try:
             # Simple lightweight call to verify connectivity and auth
             # Listing models is a fast way to check validity without generating tokens
-            requests.get(
+            get_http_client().get(
                 'https://api.openai.com/v1/models',
                 headers={'Authorization': f'Bearer {self.openai_api_key}'},
-                timeout=5
+                timeout=5,
+                max_retries=0
             )
             return {'status': 'ok', 'message': 'Connected to OpenAI'}
         except Exception as e:
@@ -85,55 +92,110 @@ WHATSAPP STYLE MESSAGING:
                                company_id: str = None,
                                context: Dict = None,
                                metadata: Dict = None) -> Tuple[Dict, bool]:
-        """Get existing session or create new one"""
+        """Get existing session or create new one
+        
+        Single round trip via the upsert_chat_session RPC. The returned session
+        dict only carries id, session_key and company_id.
+        """
         try:
             db_client = db_module.get_db()
             if db_client is None:
                 print("Database not available for chat session")
                 return None, False
             
-            # Try to get existing session
-            result = db_client.table('chat_sessions').select('*').eq(
-                'session_key', session_key
-            ).execute()
-            
-            if result.data and len(result.data) > 0:
-                return result.data[0], False
-            
-            # Create new session
-            # Note: We use session_key as the session_id column for client mapping
             # user_id must be valid UUID or None (if FK). Store anon ID in metadata.
             anon_id = f"anon_{uuid.uuid4().hex[:8]}"
-            
-            session_data = {
-                'session_key': session_key,
-                'widget_id': widget_id,
-                'user_id': user_id, # Must be UUID or None
-                'company_id': company_id,
-                'metadata': metadata or {'messages': [], 'anon_id': anon_id}, # Init messages in metadata
-                'is_active': True,
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat()
-            }
+            session_metadata = metadata or {'anon_id': anon_id} # Messages live in chat_messages
             
             # If context provided, add to metadata
             if context:
-                session_data['metadata']['context'] = context
+                session_metadata['context'] = context
             
-            result = db_client.table('chat_sessions').insert(session_data).execute()
+            try:
+                result = db_client.rpc('upsert_chat_session', {
+                    'p_session_key': session_key,
+                    'p_widget_id': widget_id,
+                    'p_user_id': user_id,
+                    'p_company_id': company_id,
+                    'p_metadata': session_metadata
+                }).execute()
+                row = result.data[0] if result.data else None
+            except Exception as rpc_error:
+                # RPC not deployed yet (database_migration_chat_session_upsert.sql)
+                print(f"upsert_chat_session unavailable, using select+insert: {rpc_error}")
+                row = self._get_or_create_session_fallback(
+                    db_client, session_key, widget_id, user_id, company_id, session_metadata
+                )
             
-            if result.data and len(result.data) > 0:
+            if not row:
+                return None, False
+            
+            session = {
+                'id': row['id'],
+                'session_key': session_key,
+                'company_id': row.get('company_id')
+            }
+            is_new = bool(row.get('inserted'))
+            
+            if is_new:
+                # A new session has no history yet - prime the cache
+                get_history_cache().put(session['id'], [], complete=True)
+                
                 # Track new session creation in analytics
                 if company_id:
                     chat_analytics.track_session(company_id)
-                return result.data[0], True
             
-            return None, False
+            return session, is_new
             
         except Exception as e:
             print(f"Error in get_or_create_session: {e}")
             return None, False
     
+    def _get_or_create_session_fallback(self, db_client, session_key: str, widget_id: str,
+                                        user_id: str, company_id: str,
+                                        session_metadata: Dict) -> Optional[Dict]:
+        """Two-step get-or-create used when the upsert RPC is missing"""
+        result = db_client.table('chat_sessions').select('id, company_id').eq(
+            'session_key', session_key
+        ).limit(1).execute()
+        if result.data:
+            return {**result.data[0], 'inserted': False}
+        
+        result = db_client.table('chat_sessions').insert({
+            'session_key': session_key,
+            'widget_id': widget_id,
+            'user_id': user_id,
+            'company_id': company_id,
+            'metadata': session_metadata,
+            'is_active': True,
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat()
+        }).execute()
+        if result.data:
+            return {'id': result.data[0]['id'], 'company_id': company_id, 'inserted': True}
+        return None
+    
+    def resolve_session(self, db_module, session_key: str) -> Optional[Dict]:
+        """Look up a session by key without creating it
+        
+        Returns:
+            Dict with id, company_id and is_active, or None if unknown
+        """
+        if not session_key:
+            return None
+        try:
+            db_client = db_module.get_db()
+            if db_client is None:
+                return None
+            
+            result = db_client.table('chat_sessions').select('id, company_id, is_active').eq(
+                'session_key', session_key
+            ).limit(1).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            print(f"Error resolving session: {e}")
+            return None
+    
     def update_session_context(self, db_module, session_id_rec: str, context: Dict) -> bool:
         """Update session context data (metadata)"""
         try:
@@ -183,63 +245,77 @@ WHATSAPP STYLE MESSAGING:
     def save_message(self, db_module, session_id_rec: str, role: str, content: str,
                      tokens_used: int = None, model: str = None,
                      metadata: Dict = None,
-                     company_id: str = None) -> Optional[Dict]:
-        """Save a message to the database (append to JSONB) and track analytics"""
+                     company_id: str = None,
+                     background: bool = False,
+                     response_time_ms: int = None) -> Optional[Dict]:
+        """Save a message to the database (append-only insert) and track analytics
+        
+        With background=True the insert and analytics update are queued on the
+        background writer and committed right after the response is sent.
+        response_time_ms (LLM latency of an assistant reply) goes into the
+        chat statistics.
+        """
         try:
             db_client = db_module.get_db()
             if db_client is None:
                 return None
             
+            session_uuid = self._resolve_session_uuid(db_client, session_id_rec)
+            if not session_uuid:
+                return None
+            
             msg_id = str(uuid.uuid4())
+            timestamp = datetime.utcnow().isoformat()
             message = {
                 'id': msg_id,
                 'role': role,
                 'content': content,
-                'timestamp': datetime.utcnow().isoformat(),
+                'timestamp': timestamp,
+                'created_at': timestamp,
                 'tokens_used': tokens_used,
                 'model': model,
                 'metadata': metadata or {}
             }
             
-            # 1. Fetch current messages
-            # Note: We use the internal UUID (id) for updates if possible, or session_id key
-            # The session object passed usually has 'id' (UUID) if fetched from table
-            
-            # Check if session_id_rec is UUID or key. Assuming UUID from previous fetch.
-            # But let's be safe. If it looks like UUID use id, else session_id.
-            
-            # Fetch current metadata
-            key_col = 'id' # Default to PK lookup
-            result = db_client.table('chat_sessions').select('metadata').eq(key_col, session_id_rec).execute()
-            
-            if not result.data:
-                # Try lookup by session_key (string key)
-                key_col = 'session_key'
-                result = db_client.table('chat_sessions').select('metadata').eq(key_col, session_id_rec).execute()
-                if not result.data:
-                    return None
-            
-            current_meta = result.data[0].get('metadata', {}) or {}
-            current_messages = current_meta.get('messages', [])
-            
-            if not isinstance(current_messages, list):
-                current_messages = []
-                
-            current_messages.append(message)
-            current_meta['messages'] = current_messages
-            
-            # 2. Update array in metadata
-            db_client.table('chat_sessions').update({
-                'metadata': current_meta,
-                'updated_at': datetime.utcnow().isoformat()
-            }).eq(key_col, session_id_rec).execute()
+            row = {
+                'id': msg_id,
+                'session_id': session_uuid,
+                'role': role,
+                'content': content,
+                'tokens_used': tokens_used,
+                'model': model,
+                'metadata': metadata or {},
+                'created_at': timestamp
+            }
+            track_analytics = role == 'assistant' and company_id and tokens_used
+            
+            if background:
+                # Write-through so the next history read is served from memory
+                get_history_cache().append(session_uuid, message)
+                writer = get_background_writer()
+                writer.submit_insert('chat_messages', row, key=session_uuid)
+                if track_analytics:
+                    with timing.stage('analytics'):
+                        writer.submit(chat_analytics.track_message, company_id, tokens_used=tokens_used,
+                                      response_time_ms=response_time_ms)
+                return message
+            
+            # Single INSERT - no need to read the existing history.
+            # Ordering comes from chat_messages.seq; the session's updated_at is
+            # bumped by a trigger (see database_migration_chat_messages.sql).
+            # A reply of this session still queued must get its seq first.
+            get_background_writer().write_through(session_uuid)
+            db_client.table('chat_messages').insert(row, returning='minimal').execute()
+            get_history_cache().append(session_uuid, message)
             
             # Track analytics for assistant responses
-            if role == 'assistant' and company_id and tokens_used:
-                chat_analytics.track_message(
-                    company_id, 
-                    tokens_used=tokens_used
-                )
+            if track_analytics:
+                with timing.stage('analytics'):
+                    chat_analytics.track_message(
+                        company_id, 
+                        tokens_used=tokens_used,
+                        response_time_ms=response_time_ms
+                    )
             
             return message
             
@@ -251,33 +327,67 @@ WHATSAPP STYLE MESSAGING:
     
     def get_conversation_history(self, db_module, session_id_rec: str, 
                                   limit: int = 50) -> List[Dict]:
-        """Get conversation history for a session from JSONB"""
+        """Get the last `limit` messages of a session, oldest first
+        
+        Served from the in-process history cache when possible.
+        """
         try:
             db_client = db_module.get_db()
             if db_client is None:
                 return []
             
-            # Try UUID first
-            result = db_client.table('chat_sessions').select('metadata').eq('id', session_id_rec).execute()
+            session_uuid = self._resolve_session_uuid(db_client, session_id_rec)
+            if not session_uuid:
+                return []
             
-            if not result.data:
-                # Try session_key
-                result = db_client.table('chat_sessions').select('metadata').eq('session_key', session_id_rec).execute()
+            cache = get_history_cache()
+            cached = cache.get(session_uuid, limit)
+            if cached is not None:
+                if not HISTORY_CACHE_VALIDATE or self._latest_message_id(db_client, session_uuid) == cache.last_message_id(session_uuid):
+                    return cached
+                cache.invalidate(session_uuid)
+            
+            query = db_client.table('chat_messages').select(
+                'id, role, content, tokens_used, model, metadata, created_at'
+            ).eq('session_id', session_uuid).order('seq', desc=True)
+            if limit:
+                query = query.limit(limit)
+            result = query.execute()
             
-            if result.data and result.data[0]:
-                meta = result.data[0].get('metadata', {})
-                msgs = meta.get('messages', [])
-                # Return last N messages. JSONB array is ordered by insertion.
-                if limit and len(msgs) > limit:
-                    return msgs[-limit:]
-                return msgs
+            msgs = []
+            for row in reversed(result.data or []):
+                row['timestamp'] = row.get('created_at')
+                msgs.append(row)
             
-            return []
+            cache.put(session_uuid, msgs, complete=not limit or len(msgs) < limit)
+            return [dict(m) for m in msgs]
             
         except Exception as e:
             print(f"Error getting conversation history: {e}")
             return []
     
+    def _latest_message_id(self, db_client, session_uuid: str) -> Optional[str]:
+        """Id of the newest stored message of a session"""
+        result = db_client.table('chat_messages').select('id').eq(
+            'session_id', session_uuid
+        ).order('seq', desc=True).limit(1).execute()
+        return result.data[0]['id'] if result.data else None
+    
+    def _resolve_session_uuid(self, db_client, session_id_rec: str) -> Optional[str]:
+        """Map a session reference (internal UUID or session_key) to the UUID"""
+        if not session_id_rec:
+            return None
+        try:
+            uuid.UUID(str(session_id_rec))
+            return session_id_rec
+        except ValueError:
+            pass
+        
+        result = db_client.table('chat_sessions').select('id').eq(
+            'session_key', session_id_rec
+        ).execute()
+        return result.data[0]['id'] if result.data else None
+    
     def format_messages_for_openai(self, messages: List[Dict], 
                                     system_prompt: str = None) -> List[Dict]:
         """Format database messages for OpenAI API"""
@@ -346,14 +456,15 @@ WHATSAPP STYLE MESSAGING:
                           db_module = None,
                           company_id: str = None,
                           session_id: str = None,
-                          enable_tools: bool = False) -> Tuple[Optional[str], Optional[Dict]]:
+                          enable_tools: bool = False,
+                          bot_config: Dict = None) -> Tuple[Optional[str], Optional[Dict]]:
         """Generate AI response using CompanyBot engine"""
         
         # Use new isolated engine if company_id is present
         if company_id and db_module:
             try:
                 from bot.engine import CompanyBot
-                bot = CompanyBot(company_id, db_module)
+                bot = CompanyBot(company_id, db_module, config=bot_config)
                 
                 # Transform messages for engine (it expects dicts)
                 # Engine handles system prompt and context internally
@@ -427,32 +538,86 @@ WHATSAPP STYLE MESSAGING:
             # However, simpler to just rely on the new engine for companies. 
             # I will just implement the standard call here for non-company cases.
             
-            response = requests.post(
-                'https://api.openai.com/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {self.openai_api_key}',
-                    'Content-Type': 'application/json'
-                },
-                json=payload,
-                timeout=60
-            )
+            started = time.perf_counter()
+            with timing.stage('llm'):
+                response = get_http_client().post(
+                    'https://api.openai.com/v1/chat/completions',
+                    headers={
+                        'Authorization': f'Bearer {self.openai_api_key}',
+                        'Content-Type': 'application/json'
+                    },
+                    json=payload,
+                    timeout=60
+                )
+            llm_ms = (time.perf_counter() - started) * 1000
             
             if response.status_code != 200:
+                metrics.observe_openai(self.openai_model, company_id, llm_ms / 1000, status='error')
                 return None, {'error': f'API error: {response.status_code} - {response.text}'}
             
             data = response.json()
             # ... (Simplified extraction for legacy)
             content = data['choices'][0]['message']['content']
             usage = data.get('usage', {})
+            metrics.observe_openai(self.openai_model, company_id, llm_ms / 1000, usage.get('total_tokens'))
             metadata = {
                 'model': data.get('model'),
-                'tokens_total': usage.get('total_tokens')
+                'tokens_total': usage.get('total_tokens'),
+                'response_time_ms': int(llm_ms)
             }
             return content, metadata
             
         except Exception as e:
             print(f"Error generation response (Legacy): {e}")
             return None, {'error': str(e)}
+
+    def stream_response(self, messages: List[Dict],
+                        system_prompt: str = None,
+                        db_module = None,
+                        company_id: str = None,
+                        session_id: str = None,
+                        enable_tools: bool = False,
+                        bot_config: Dict = None) -> Iterator[Dict]:
+        """Stream an AI response as delta/action/done/error events
+        
+        Company chats stream through CompanyBot. Non-company chats use the
+        legacy (non-streaming) path and emit the whole answer as one delta.
+        """
+        if company_id and db_module:
+            try:
+                from bot.engine import CompanyBot
+                bot = CompanyBot(company_id, db_module, config=bot_config)
+                yield from bot.stream_response(
+                    messages,
+                    system_prompt=system_prompt,
+                    enable_tools=enable_tools,
+                    session_id=session_id
+                )
+                return
+            except Exception as e:
+                print(f"Error streaming with CompanyBot engine: {e}")
+                yield {'type': 'error', 'error': str(e)}
+                return
+
+        content, metadata = self.generate_response(
+            messages,
+            system_prompt=system_prompt,
+            db_module=db_module,
+            session_id=session_id,
+            enable_tools=enable_tools
+        )
+        if not content:
+            yield {'type': 'error', 'error': (metadata or {}).get('error', 'No response generated')}
+            return
+
+        yield {'type': 'delta', 'content': content}
+        yield {
+            'type': 'done',
+            'content': content,
+            'action': None,
+            'metadata': {'model': metadata.get('model'), 'tokens': metadata.get('tokens_total'),
+                         'response_time_ms': metadata.get('response_time_ms')}
+        }
     
 
     
@@ -474,23 +639,8 @@ WHATSAPP STYLE MESSAGING:
             return None
             
         try:
-            db_client = db_module.get_db()
-            if db_client is None:
-                return None
-            
-            result = db_client.table('companies').select('*').eq(
-                'id', company_id
-            ).execute()
-            
-            if result.data and len(result.data) > 0:
-                company = result.data[0]
-                return {
-                    'id': company.get('id'),
-                    'name': company.get('name'),
-                    'slug': company.get('slug'),
-                    'settings': company.get('settings', {})
-                }
-            return None
+            tenant = tenant_cache.get_tenant_context(db_module, company_id)
+            return tenant['company'] if tenant else None
             
         except Exception as e:
             print(f"Error getting company context: {e}")
@@ -528,88 +678,17 @@ WHATSAPP STYLE MESSAGING:
 
     def get_widget_config(self, db_module, widget_id: str, 
                           company_id: str = None) -> Optional[Dict]:
-        """Get widget configuration, prioritizing new widget_settings table"""
+        """Get widget configuration, prioritizing company widget_settings"""
         try:
+            # 1. Modern settings live on the companies row (where Admin UI saves them)
+            if company_id:
+                tenant = tenant_cache.get_tenant_context(db_module, company_id)
+                if tenant:
+                    return dict(tenant['widget_config'])
+            
             db_client = db_module.get_db()
             if db_client is None:
                 return None
-            
-            # 1. Try to get from modern 'widget_settings' table first (by company_id if available)
-            # We need company_id for this. If not provided, we might be stuck unless we map widget_id -> company_id
-            
-            config = self.get_default_widget_config()
-            
-            if company_id:
-                # Read from companies table (where Admin UI saves it)
-                settings_result = db_client.table('companies').select('name, widget_settings').eq('id', company_id).execute()
-                if settings_result.data:
-                    company_data = settings_result.data[0]
-                    company_name = company_data.get('name', 'this company')
-                    settings = company_data.get('widget_settings', {})
-                    
-                    # Support both nested (legacy/planned) and flat (current admin) structures
-                    # Flat structure: { bot_name, welcome_message, theme, language, position, primary_color, ... }
-                    
-                    # 1. Theme
-                    if settings.get('appearance') and settings['appearance'].get('theme'):
-                        config['theme'] = settings['appearance'].get('theme')
-                    elif settings.get('theme'):
-                        config['theme'] = settings.get('theme')
-                        
-                    # 2. Name / Header Title
-                    if settings.get('content') and settings['content'].get('headerTitle'):
-                        config['name'] = settings['content'].get('headerTitle')
-                    elif settings.get('bot_name'):
-                        config['name'] = settings.get('bot_name')
-                        
-                    # 3. Welcome Message
-                    if settings.get('content') and settings['content'].get('welcomeMessage'):
-                        config['welcome_message'] = settings['content'].get('welcomeMessage')
-                    elif settings.get('welcome_message'):
-                        config['welcome_message'] = settings.get('welcome_message')
-                        
-                    # 4. Instructions / System Prompt
-                    instructions = ""
-                    if settings.get('bot') and settings['bot'].get('instructions'):
-                        instructions = settings['bot'].get('instructions')
-                    elif settings.get('instructions'):
-                        instructions = settings.get('instructions')
-                        
-                    if instructions:
-                        # Inject Company Name to override generic "THIS company" in default prompt
-                        context_header = f"OPERATIONAL CONTEXT: You are the AI Assistant for '{company_name}'.\nYour knowledge base and answers must focus on '{company_name}'."
-                        config['system_prompt'] = f"{self.default_system_prompt}\n\n{context_header}\n\nIMPORTANT INSTRUCTIONS:\n{instructions}"
-                        
-                    # 4b. Language
-                    language = settings.get('language')
-                    if language:
-                        lang_map = {'de': 'German', 'fr': 'French', 'es': 'Spanish', 'en': 'English'}
-                        lang_name = lang_map.get(language, 'English')
-                        
-                        if language != 'en':
-                            lang_prompt = f"\n\nIMPORTANT: You must respond in {lang_name}."
-                            if config.get('system_prompt'):
-                                config['system_prompt'] += lang_prompt
-                            else:
-                                config['system_prompt'] = self.default_system_prompt + lang_prompt
-                                
-                            # Localize Default Welcome Message if not custom
-                            if language == 'de' and not config.get('welcome_message'):
-                                config['welcome_message'] = "Hallo! Ich bin Kian, Ihr KI-Assistent. Wie kann ich Ihnen helfen?"
-                            elif language == 'de' and config.get('welcome_message') == self.get_default_widget_config().get('welcome_message'):
-                                # Also override if it's just the exact English default
-                                config['welcome_message'] = "Hallo! Ich bin Kian, Ihr KI-Assistent. Wie kann ich Ihnen helfen?"
-
-                    # 5. Position
-                    if settings.get('position'):
-                        config['position'] = settings.get('position')
-                        
-                    # 6. Primary Color (if needed in config, strictly handled by CSS usually but passed for safety)
-                    if settings.get('primary_color'):
-                        config['primary_color'] = settings.get('primary_color')
-                            
-                    config['settings'] = settings # Keep raw settings properties available
-                    return config
 
             # 2. Fallback to legacy 'widget_configs' if no modern settings or no company_id
             query = db_client.table('widget_configs').select('*').eq(
@@ -627,13 +706,84 @@ WHATSAPP STYLE MESSAGING:
                 
             # If we have company_id but no config found, return default
             if company_id:
-                return config
+                return self.get_default_widget_config()
                 
             return None
             
         except Exception as e:
             print(f"Error getting widget config: {e}")
             return None
+
+    def build_widget_config(self, company: Dict) -> Dict:
+        """Build widget configuration from a company row's widget_settings"""
+        config = self.get_default_widget_config()
+        
+        company_name = company.get('name', 'this company')
+        settings = company.get('widget_settings') or {}
+        
+        # Support both nested (legacy/planned) and flat (current admin) structures
+        # Flat structure: { bot_name, welcome_message, theme, language, position, primary_color, ... }
+        
+        # 1. Theme
+        if settings.get('appearance') and settings['appearance'].get('theme'):
+            config['theme'] = settings['appearance'].get('theme')
+        elif settings.get('theme'):
+            config['theme'] = settings.get('theme')
+            
+        # 2. Name / Header Title
+        if settings.get('content') and settings['content'].get('headerTitle'):
+            config['name'] = settings['content'].get('headerTitle')
+        elif settings.get('bot_name'):
+            config['name'] = settings.get('bot_name')
+            
+        # 3. Welcome Message
+        if settings.get('content') and settings['content'].get('welcomeMessage'):
+            config['welcome_message'] = settings['content'].get('welcomeMessage')
+        elif settings.get('welcome_message'):
+            config['welcome_message'] = settings.get('welcome_message')
+            
+        # 4. Instructions / System Prompt
+        instructions = ""
+        if settings.get('bot') and settings['bot'].get('instructions'):
+            instructions = settings['bot'].get('instructions')
+        elif settings.get('instructions'):
+            instructions = settings.get('instructions')
+            
+        if instructions:
+            # Inject Company Name to override generic "THIS company" in default prompt
+            context_header = f"OPERATIONAL CONTEXT: You are the AI Assistant for '{company_name}'.\nYour knowledge base and answers must focus on '{company_name}'."
+            config['system_prompt'] = f"{self.default_system_prompt}\n\n{context_header}\n\nIMPORTANT INSTRUCTIONS:\n{instructions}"
+            
+        # 4b. Language
+        language = settings.get('language')
+        if language:
+            lang_map = {'de': 'German', 'fr': 'French', 'es': 'Spanish', 'en': 'English'}
+            lang_name = lang_map.get(language, 'English')
+            
+            if language != 'en':
+                lang_prompt = f"\n\nIMPORTANT: You must respond in {lang_name}."
+                if config.get('system_prompt'):
+                    config['system_prompt'] += lang_prompt
+                else:
+                    config['system_prompt'] = self.default_system_prompt + lang_prompt
+                    
+                # Localize Default Welcome Message if not custom
+                if language == 'de' and not config.get('welcome_message'):
+                    config['welcome_message'] = "Hallo! Ich bin Kian, Ihr KI-Assistent. Wie kann ich Ihnen helfen?"
+                elif language == 'de' and config.get('welcome_message') == self.get_default_widget_config().get('welcome_message'):
+                    # Also override if it's just the exact English default
+                    config['welcome_message'] = "Hallo! Ich bin Kian, Ihr KI-Assistent. Wie kann ich Ihnen helfen?"
+
+        # 5. Position
+        if settings.get('position'):
+            config['position'] = settings.get('position')
+            
+        # 6. Primary Color (if needed in config, strictly handled by CSS usually but passed for safety)
+        if settings.get('primary_color'):
+            config['primary_color'] = settings.get('primary_color')
+                
+        config['settings'] = settings # Keep raw settings properties available
+        return config
     
     def get_default_widget_config(self) -> Dict:
         """Get default widget configuration"""
@@ -0,0 +1,99 @@
+"""
+Chat Throttle - layered token buckets for the public chat endpoints
+
+/api/chat/message and /api/chat/stream need no authentication, so every
+turn passes three GCRA buckets (see rate_limit.py) before any message is
+stored or an LLM is called:
+
+    ip       per client IP, checked first (before the tenant is resolved)
+    session  per session key; a misbehaving embed or script
+    company  per company, shared by all visitors of a tenant
+
+A layer with burst or per_minute <= 0 is not limited. Tenants can override
+the session and company layers through widget_settings['rate_limits']:
+    {"company": {"burst": 200, "per_minute": 600},
+     "session": {"burst": 5, "per_minute": 10}}
+
+Rejections are counted in /metrics (chat_throttled_total) and, for a known
+company, in its daily chat statistics (throttled_requests).
+
+The buckets live in their own limiter ('chat'), so with the memory store
+a flood of client keys cannot evict the login lockouts kept by auth.py.
+The client IP is request.remote_addr, which ProxyFix in app.py resolves
+from X-Forwarded-For for the configured number of trusted proxy hops
+(TRUSTED_PROXY_HOPS); a client-supplied header is never trusted beyond that.
+
+Environment:
+    CHAT_RATE_IP_BURST / CHAT_RATE_IP_PER_MINUTE            (default 20 / 30)
+    CHAT_RATE_SESSION_BURST / CHAT_RATE_SESSION_PER_MINUTE  (default 5 / 12)
+    CHAT_RATE_COMPANY_BURST / CHAT_RATE_COMPANY_PER_MINUTE  (default 100 / 300)
+    CHAT_RATE_LIMIT_MAX_KEYS  keys kept by the chat buckets' memory store (default 10000)
+"""
+
+import os
+import math
+from typing import Optional, Dict, Tuple
+
+import metrics
+import rate_limit
+import chat_analytics
+
+DEFAULT_LIMITS = {
+    'ip': (int(os.getenv('CHAT_RATE_IP_BURST', '20')),
+           float(os.getenv('CHAT_RATE_IP_PER_MINUTE', '30'))),
+    'session': (int(os.getenv('CHAT_RATE_SESSION_BURST', '5')),
+                float(os.getenv('CHAT_RATE_SESSION_PER_MINUTE', '12'))),
+    'company': (int(os.getenv('CHAT_RATE_COMPANY_BURST', '100')),
+                float(os.getenv('CHAT_RATE_COMPANY_PER_MINUTE', '300')))
+}
+CHAT_RATE_LIMIT_MAX_KEYS = int(os.getenv('CHAT_RATE_LIMIT_MAX_KEYS', '10000'))
+
+THROTTLED = metrics.get_registry().counter(
+    'chat_throttled_total', 'Chat turns rejected with 429 by throttle layer', ('scope',))
+
+
+def get_limits(scope: str, widget_settings: Optional[Dict] = None) -> Tuple[int, float]:
+    """(burst, per_minute) for a layer, with the tenant's override if set"""
+    burst, per_minute = DEFAULT_LIMITS[scope]
+    override = ((widget_settings or {}).get('rate_limits') or {}).get(scope)
+    if isinstance(override, dict):
+        try:
+            burst = int(override.get('burst', burst))
+            per_minute = float(override.get('per_minute', per_minute))
+        except (TypeError, ValueError):
+            print(f"Invalid rate_limits.{scope} in widget settings: {override}")
+    return burst, per_minute
+
+
+def check(scope: str, key: str, widget_settings: Optional[Dict] = None,
+          company_id: Optional[str] = None) -> Optional[int]:
+    """
+    Take one token from a layer's bucket.
+
+    Args:
+        scope: 'ip', 'session' or 'company'
+        key: Client IP, session key or company id
+        widget_settings: Tenant widget settings (session/company overrides)
+        company_id: Company the turn belongs to, for analytics
+
+    Returns:
+        None if allowed, else seconds until a retry can succeed (Retry-After)
+    """
+    if not key:
+        return None
+    burst, per_minute = get_limits(scope, widget_settings)
+    if burst <= 0 or per_minute <= 0:
+        return None
+
+    allowed, retry_after = rate_limit.get_limiter('chat', CHAT_RATE_LIMIT_MAX_KEYS).acquire(f"chat:{scope}:{key}", per_minute / 60, burst)
+    if allowed:
+        return None
+
+    THROTTLED.inc(scope=scope)
+    chat_analytics.track_throttle(company_id)
+    return max(1, math.ceil(retry_after))
+
+
+def client_ip(request) -> str:
+    """Client address as resolved by ProxyFix for the trusted proxy hops"""
+    return request.remote_addr or ''
@@ -6,6 +6,11 @@ from datetime import datetime
 from typing import Optional, List, Dict, Any, Tuple
 from supabase import create_client, Client
 from dotenv import load_dotenv
+import tenant_cache
+import seminar_matcher
+import request_cache
+import metrics
+from cache import TTLCache
 
 load_dotenv()
 
@@ -101,7 +106,7 @@ def get_db() -> Optional[Client]:
     
     # Create Supabase client
     try:
-        client = create_client(url, key)
+        client = metrics.instrument_client(create_client(url, key))
         _db_client = client
         print("Database client created successfully")
         return client
@@ -177,8 +182,18 @@ def verify_supabase_token(token: str) -> Optional[Dict]:
         return None
 
 
+def _invalidate_user(user_id: str):
+    """Forget cached copies of a user after a write"""
+    request_cache.invalidate('users', user_id)
+    # API key entries are keyed by digest, not user; user writes are rare
+    _api_key_cache.clear()
+
+
 def get_user_by_id(user_id: str) -> Optional[Dict]:
-    """Get user by ID"""
+    """Get user by ID (memoized for the current request)"""
+    return request_cache.get_or_load('users', user_id, lambda: _load_user(user_id))
+
+def _load_user(user_id: str) -> Optional[Dict]:
     try:
         db_client = get_db()
         if db_client is None:
@@ -274,6 +289,7 @@ def create_user(
 
 def update_user_role(user_id: str, role: str) -> bool:
     """Update user role"""
+    _invalidate_user(user_id)
     try:
         db_client = get_db()
         if db_client is None:
@@ -290,6 +306,7 @@ def update_user_role(user_id: str, role: str) -> bool:
 
 def update_user_password(user_id: str, password_hash: str) -> bool:
     """Update user password"""
+    _invalidate_user(user_id)
     try:
         db_client = get_db()
         if db_client is None:
@@ -305,6 +322,7 @@ def update_user_password(user_id: str, password_hash: str) -> bool:
 
 def update_user(user_id: str, updates: Dict) -> bool:
     """Update user details (name, role, company_id)"""
+    _invalidate_user(user_id)
     try:
         db_client = get_db()
         if db_client is None:
@@ -326,6 +344,7 @@ def update_user(user_id: str, updates: Dict) -> bool:
 
 def delete_user(user_id: str) -> bool:
     """Delete a user by ID"""
+    _invalidate_user(user_id)
     try:
         db_client = get_db()
         if db_client is None:
@@ -342,6 +361,18 @@ def hash_token(token: str) -> str:
     return hashlib.sha256(token.encode()).hexdigest()
 
 
+# API key digest -> user, per process. Deleting a key or changing a user clears
+# the entry here; other instances may accept a deleted key for up to the TTL.
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', '60'))  # seconds
+API_KEY_CACHE_SIZE = int(os.getenv('API_KEY_CACHE_SIZE', '1024'))
+_api_key_cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+
+
+def get_api_key_cache_stats() -> Dict[str, Any]:
+    """Get API key cache size and hit/miss counters"""
+    return _api_key_cache.stats()
+
+
 # ============================================================================
 # API KEYS OPERATIONS
 # ============================================================================
@@ -372,7 +403,9 @@ def create_api_key(user_id: str, data: Dict) -> Dict:
 def delete_api_key(key_id: str, user_id: str) -> bool:
     """Delete API key"""
     try:
-        get_db().table('api_keys').delete().eq('id', key_id).eq('user_id', user_id).execute()
+        result = get_db().table('api_keys').delete().eq('id', key_id).eq('user_id', user_id).execute()
+        for row in result.data or []:
+            _api_key_cache.pop(row.get('key_hash') or hash_token(row['key_value']))
         return True
     except:
         return False
@@ -452,7 +485,10 @@ def get_companies() -> List[Dict]:
         return []
 
 def get_company_by_id(company_id: str) -> Optional[Dict]:
-    """Get company by ID"""
+    """Get company by ID (memoized for the current request)"""
+    return request_cache.get_or_load('companies', company_id, lambda: _load_company(company_id))
+
+def _load_company(company_id: str) -> Optional[Dict]:
     try:
         result = get_db().table('companies').select('*').eq('id', company_id).execute()
         return result.data[0] if result.data else None
@@ -520,6 +556,8 @@ def update_company(company_id: str, updates: Dict) -> bool:
     try:
         updates['updated_at'] = datetime.utcnow().isoformat()
         get_db().table('companies').update(updates).eq('id', company_id).execute()
+        tenant_cache.invalidate_tenant(company_id)
+        request_cache.invalidate('companies', company_id)
         return True
     except:
         return False
@@ -528,6 +566,8 @@ def delete_company(company_id: str) -> bool:
     """Delete company"""
     try:
         get_db().table('companies').delete().eq('id', company_id).execute()
+        tenant_cache.invalidate_tenant(company_id)
+        request_cache.invalidate('companies', company_id)
         return True
     except:
         return False
@@ -545,6 +585,7 @@ def get_company_users(company_id: str) -> List[Dict]:
 
 def assign_user_to_company(user_id: str, company_id: str, role: str = 'member') -> bool:
     """Assign user to a company"""
+    _invalidate_user(user_id)
     try:
         update_data = {'company_id': company_id}
         if role:
@@ -560,6 +601,7 @@ def assign_user_to_company(user_id: str, company_id: str, role: str = 'member')
 
 def remove_user_from_company(user_id: str) -> bool:
     """Remove user from company (set company_id to None and role to user)"""
+    _invalidate_user(user_id)
     try:
         get_db().table('users').update({'company_id': None, 'role': 'user'}).eq('id', user_id).execute()
         return True
@@ -650,19 +692,34 @@ def get_company_knowledge(company_id: str) -> str:
 # ============================================================================
 
 def get_user_by_api_key(api_key: str) -> Optional[Dict]:
-    """Get user associated with an API key"""
+    """Get user associated with an API key (one query by digest, cached briefly)"""
+    key_hash = hash_token(api_key)
+    user = _api_key_cache.get(key_hash)
+    if user is not None:
+        return user
     try:
-        # 1. Find the key
-        result = get_db().table('api_keys').select('*').eq('key_value', api_key).eq('is_active', True).execute()
+        # Key and user in one round trip via the api_keys.user_id foreign key
+        result = get_db().table('api_keys').select('user_id, users(*)') \
+            .eq('key_hash', key_hash).eq('is_active', True).limit(1).execute()
+    except Exception as e:
+        # key_hash missing until database_migration_api_key_hash.sql has run
+        print(f"Error getting user by API key digest, falling back to key_value: {e}")
+        return _get_user_by_api_key_value(api_key)
+
+    if not result.data:
+        return None
+    user = result.data[0].get('users')
+    if user:
+        _api_key_cache.set(key_hash, user)
+    return user
+
+
+def _get_user_by_api_key_value(api_key: str) -> Optional[Dict]:
+    try:
+        result = get_db().table('api_keys').select('user_id').eq('key_value', api_key).eq('is_active', True).execute()
         if not result.data:
             return None
-            
-        key_record = result.data[0]
-        user_id = key_record['user_id']
-        
-        # 2. Get the user
-        user = get_user_by_id(user_id)
-        return user
+        return get_user_by_id(result.data[0]['user_id'])
     except Exception as e:
         print(f"Error getting user by API key: {e}")
         return None
@@ -743,10 +800,23 @@ def get_active_chat_session(user_identifier: str, company_id: str) -> Optional[D
     except:
         return None
 
+def search_seminar_qa(query_text: str, limit: int = 3) -> List[Dict]:
+    """Rank seminar Q&A rows with Postgres full-text search (search_seminar_qa RPC)"""
+    try:
+        db_client = get_db()
+        if not db_client or not query_text:
+            return []
+        result = db_client.rpc('search_seminar_qa', {'p_query': query_text, 'p_limit': limit}).execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Error searching seminar Q&A: {e}")
+        return []
+
+
 def get_seminar_context(query_text: str) -> str:
     """
-    Get seminar Q&A context based on query text using basic keyword matching.
-    In a production env with pgvector, this would be a vector similarity search.
+    Get seminar Q&A context based on query text using keyword matching.
+    Names and keywords are matched in one pass by the compiled seminar matcher.
     """
     try:
         if not query_text:
@@ -755,49 +825,18 @@ def get_seminar_context(query_text: str) -> str:
         db_client = get_db()
         if not db_client:
             return ""
-            
-        # Basic keyword search using ILIKE
-        # We search matching keywords or seminar names
-        # Note: This is simple and can be improved with full text search
-        
-        # Clean query for basic search
-        import re
-        clean_query = re.sub(r'[^\w\s]', '', query_text).lower()
-        search_terms = clean_query.split()
-        
-        # We pull all Q&A items and filter in python for this MVP phase 
-        # (assuming table size < 1000 rows, this is fast enough)
-        # For larger datasets, use .textSearch() or RPC
-        result = db_client.table('seminar_qa').select('*').execute()
         
-        if not result.data:
+        matcher = seminar_matcher.get_seminar_matcher(db_client)
+        if not matcher:
             return ""
-            
-        matched_items = []
-        for item in result.data:
-            score = 0
-            
-            # Check seminar name match
-            if item.get('seminar_name', '').lower() in clean_query:
-                score += 10
-                
-            # Check keywords match
-            keywords = item.get('keywords', []) or []
-            for kw in keywords:
-                if kw.lower() in clean_query:
-                    score += 5
-                    
-            if score > 0:
-                matched_items.append((score, item))
-                
-        # Sort by score desc
-        matched_items.sort(key=lambda x: x[0], reverse=True)
         
-        if not matched_items:
-            return ""
-            
         # Take top 3 matches to build context
-        top_matches = matched_items[:3]
+        top_matches = matcher.match(query_text, limit=3)
+        if not top_matches:
+            # No name/keyword hit: let Postgres full-text search rank the Q&A
+            top_matches = [(row.get('rank'), row) for row in search_seminar_qa(query_text, limit=3)]
+        if not top_matches:
+            return ""
         
         context_str = "### Seminar Knowledge Base:\n\n"
         for _, item in top_matches:
@@ -855,3 +894,67 @@ def close_chat_session(session_id: str) -> bool:
         return True
     except:
         return False
+
+# ============================================================================
+# WORKFLOW ANALYTICS
+# ============================================================================
+
+WORKFLOW_COLUMNS = 'id, n8n_workflow_id, name, description, category, is_active, is_public, created_at, updated_at'
+
+def get_workflow_by_id(workflow_id: str) -> Optional[Dict]:
+    """Get workflow by ID (memoized for the current request)"""
+    return get_workflows_by_ids([workflow_id]).get(workflow_id)
+
+def get_workflows_by_ids(workflow_ids: List[str], columns: str = WORKFLOW_COLUMNS) -> Dict[str, Dict]:
+    """
+    Get several workflows in one query.
+
+    Rows already loaded in this request are served from the request cache;
+    the rest are fetched with a single `in` filter.
+
+    Returns:
+        Dict mapping workflow id to row (unknown ids are left out)
+    """
+    def load(missing: List[str]) -> Dict[str, Dict]:
+        result = get_db().table('workflows').select(columns).in_('id', missing).execute()
+        return {row['id']: row for row in result.data or []}
+
+    try:
+        if columns != WORKFLOW_COLUMNS:
+            return load(list(dict.fromkeys(w for w in workflow_ids if w)))
+        return request_cache.get_many('workflows', workflow_ids, load)
+    except Exception as e:
+        print(f"Error getting workflows: {e}")
+        return {}
+
+def _analytics_params(start: datetime, end: datetime, company_id: str = None, user_id: str = None) -> Dict:
+    """Common RPC parameters: date range and scope (company wins over user)"""
+    return {
+        'p_start': start.isoformat(),
+        'p_end': end.isoformat(),
+        'p_company_id': company_id,
+        'p_user_id': None if company_id else user_id
+    }
+
+def get_execution_stats(start: datetime, end: datetime, company_id: str = None,
+                        user_id: str = None, workflow_id: str = None) -> Optional[Dict]:
+    """Execution totals for a date range and scope (get_execution_stats RPC)"""
+    params = _analytics_params(start, end, company_id, user_id)
+    params['p_workflow_id'] = workflow_id
+    result = get_db().rpc('get_execution_stats', params).execute()
+    return result.data[0] if result.data else None
+
+def get_execution_timeline(start: datetime, end: datetime, company_id: str = None,
+                           user_id: str = None) -> List[Dict]:
+    """Daily execution counts, one row per day (get_execution_timeline RPC)"""
+    params = _analytics_params(start, end, company_id, user_id)
+    result = get_db().rpc('get_execution_timeline', params).execute()
+    return result.data or []
+
+def get_top_workflows(start: datetime, end: datetime, company_id: str = None,
+                      user_id: str = None, limit: int = 10) -> List[Dict]:
+    """Workflows with the most executions in a date range (get_top_workflows RPC)"""
+    params = _analytics_params(start, end, company_id, user_id)
+    params['p_limit'] = limit
+    result = get_db().rpc('get_top_workflows', params).execute()
+    return result.data or []
@@ -0,0 +1,186 @@
+"""
+History Cache - in-process conversation history per chat session
+
+Keeps the last HISTORY_CACHE_WINDOW messages of recently active sessions so a
+chat turn does not re-read history it has just written. ChatService writes
+through on every saved message; misses fall back to the database. Messages
+are copied in and out, so callers may modify what they get.
+
+With more than one process (serverless instances, gunicorn workers) another
+process may have written newer messages, so a hit is only trusted after the
+newest stored message id is checked. Deployments running a single process
+can set HISTORY_CACHE_SINGLE_PROCESS=1 to skip that query.
+
+Environment:
+    HISTORY_CACHE_SIZE       max cached sessions (default 2000)
+    HISTORY_CACHE_WINDOW     messages kept per session (default 50)
+    HISTORY_CACHE_MAX_BYTES  approximate memory cap for all entries (default 32MB)
+    HISTORY_CACHE_TTL        seconds an idle session stays cached (default 900)
+    HISTORY_CACHE_SINGLE_PROCESS  1 if this is the only process serving chats (default 0)
+    HISTORY_CACHE_VALIDATE   check the newest stored message id before trusting
+                             a hit (default on, off with HISTORY_CACHE_SINGLE_PROCESS)
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '2000'))
+HISTORY_CACHE_WINDOW = int(os.getenv('HISTORY_CACHE_WINDOW', '50'))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv('HISTORY_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+HISTORY_CACHE_TTL = float(os.getenv('HISTORY_CACHE_TTL', '900'))
+HISTORY_CACHE_SINGLE_PROCESS = os.getenv('HISTORY_CACHE_SINGLE_PROCESS', 'false').lower() in ('1', 'true', 'yes')
+HISTORY_CACHE_VALIDATE = os.getenv(
+    'HISTORY_CACHE_VALIDATE', 'false' if HISTORY_CACHE_SINGLE_PROCESS else 'true'
+).lower() in ('1', 'true', 'yes')
+
+
+def _message_size(message: Dict) -> int:
+    """Rough in-memory size of a message dict"""
+    return 256 + len(message.get('content') or '') + len(str(message.get('metadata') or ''))
+
+
+class HistoryCache:
+    """LRU of per-session message windows with a byte cap"""
+
+    def __init__(self, max_sessions: int = HISTORY_CACHE_SIZE,
+                 window: int = HISTORY_CACHE_WINDOW,
+                 max_bytes: int = HISTORY_CACHE_MAX_BYTES,
+                 ttl: float = HISTORY_CACHE_TTL):
+        self.max_sessions = max_sessions
+        self.window = window
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, limit: int = None) -> Optional[List[Dict]]:
+        """
+        Get the last `limit` messages (oldest first), or None on a miss.
+
+        A hit requires the entry to hold either the whole session history
+        or at least `limit` messages.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry['expires_at'] <= now:
+                if entry is not None:
+                    self._drop(session_id)
+                self.misses += 1
+                return None
+
+            messages = entry['messages']
+            if not entry['complete'] and (not limit or limit > len(messages)):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(session_id)
+            entry['expires_at'] = now + self.ttl
+            self.hits += 1
+            return [dict(m) for m in (messages[-limit:] if limit else messages)]
+
+    def put(self, session_id: str, messages: List[Dict], complete: bool) -> None:
+        """
+        Store history loaded from the database.
+
+        Args:
+            complete: True if `messages` is the session's entire history
+        """
+        messages = [dict(m) for m in messages]
+        if len(messages) > self.window:
+            messages = messages[-self.window:]
+            complete = False
+
+        with self._lock:
+            self._drop(session_id)
+            entry = {
+                'messages': messages,
+                'complete': complete,
+                'bytes': sum(_message_size(m) for m in messages),
+                'expires_at': time.monotonic() + self.ttl
+            }
+            self._entries[session_id] = entry
+            self._bytes += entry['bytes']
+            self._evict()
+
+    def append(self, session_id: str, message: Dict) -> bool:
+        """
+        Write-through a newly saved message.
+
+        Returns:
+            False if the session is not cached (nothing to update)
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False
+
+            entry['messages'].append(dict(message))
+            size = _message_size(message)
+            entry['bytes'] += size
+            self._bytes += size
+            while len(entry['messages']) > self.window:
+                removed = entry['messages'].pop(0)
+                removed_size = _message_size(removed)
+                entry['bytes'] -= removed_size
+                self._bytes -= removed_size
+                entry['complete'] = False
+
+            entry['expires_at'] = time.monotonic() + self.ttl
+            self._entries.move_to_end(session_id)
+            self._evict()
+            return True
+
+    def last_message_id(self, session_id: str) -> Optional[str]:
+        """Id of the newest cached message (None if empty or not cached)"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if not entry or not entry['messages']:
+                return None
+            return entry['messages'][-1].get('id')
+
+    def invalidate(self, session_id: str) -> None:
+        """Forget a session"""
+        with self._lock:
+            self._drop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            'sessions': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'window': self.window,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry:
+            self._bytes -= entry['bytes']
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_sessions or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry['bytes']
+
+
+# Global instance
+_history_cache = None
+
+
+def get_history_cache() -> HistoryCache:
+    """Get the global history cache"""
+    global _history_cache
+    if _history_cache is None:
+        _history_cache = HistoryCache()
+    return _history_cache
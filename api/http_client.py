@@ -0,0 +1,281 @@
+"""
+Outbound HTTP Client - pooled, keep-alive connections for provider calls
+
+All calls to external providers (OpenAI, Zoom) go through one shared client so
+TCP/TLS connections are reused across requests, including tool-call follow-ups.
+
+Environment:
+    OUTBOUND_CONNECT_TIMEOUT  connect timeout in seconds (default 5)
+    OUTBOUND_READ_TIMEOUT     read timeout in seconds (default 30)
+    OUTBOUND_POOL_MAXSIZE     keep-alive connections per host (default 10)
+    OUTBOUND_POOL_LIMITS      per-host overrides, e.g. "api.openai.com=20,zoom.us=2"
+    OUTBOUND_MAX_RETRIES      retries on 429/5xx and connect errors (default 2)
+    OUTBOUND_BACKOFF_BASE     base delay for jittered exponential backoff (default 0.5)
+    OUTBOUND_BACKOFF_MAX      max backoff / Retry-After we are willing to wait (default 10)
+    OUTBOUND_HTTP2            use HTTP/2 via httpx if the `h2` package is installed
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Iterator, Iterable
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_CONNECT_TIMEOUT = float(os.getenv('OUTBOUND_CONNECT_TIMEOUT', '5'))
+OUTBOUND_READ_TIMEOUT = float(os.getenv('OUTBOUND_READ_TIMEOUT', '30'))
+OUTBOUND_POOL_MAXSIZE = int(os.getenv('OUTBOUND_POOL_MAXSIZE', '10'))
+OUTBOUND_POOL_LIMITS = os.getenv('OUTBOUND_POOL_LIMITS', '')
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '2'))
+OUTBOUND_BACKOFF_BASE = float(os.getenv('OUTBOUND_BACKOFF_BASE', '0.5'))
+OUTBOUND_BACKOFF_MAX = float(os.getenv('OUTBOUND_BACKOFF_MAX', '10'))
+OUTBOUND_HTTP2 = os.getenv('OUTBOUND_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _parse_pool_limits(spec: str) -> Dict[str, int]:
+    """Parse "host=size,host=size" into a dict"""
+    limits = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        host, size = item.split('=', 1)
+        try:
+            limits[host.strip()] = int(size)
+        except ValueError:
+            logger.warning(f"Ignoring invalid OUTBOUND_POOL_LIMITS entry: {item}")
+    return limits
+
+
+def _retry_after_seconds(headers) -> Optional[float]:
+    """Read a Retry-After header (delta-seconds or HTTP date)"""
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class StreamedResponse:
+    """Backend-neutral view of a streaming response"""
+
+    def __init__(self, status_code: int, headers, lines: Iterable, read_text):
+        self.status_code = status_code
+        self.headers = headers
+        self._lines = lines
+        self._read_text = read_text
+
+    @property
+    def text(self) -> str:
+        return self._read_text()
+
+    def iter_lines(self) -> Iterator[str]:
+        for line in self._lines:
+            yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+class OutboundClient:
+    """Shared keep-alive client with timeouts and jittered retries"""
+
+    def __init__(self):
+        self.http2 = False
+        self._httpx = None
+        self._session = requests.Session()
+
+        default_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=OUTBOUND_POOL_MAXSIZE)
+        self._session.mount('https://', default_adapter)
+        self._session.mount('http://', default_adapter)
+        for host, size in _parse_pool_limits(OUTBOUND_POOL_LIMITS).items():
+            self._session.mount(f'https://{host}', HTTPAdapter(pool_connections=1, pool_maxsize=size))
+
+        if OUTBOUND_HTTP2:
+            try:
+                import h2  # noqa: F401 - required by httpx for HTTP/2
+                import httpx
+                self._httpx = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_keepalive_connections=OUTBOUND_POOL_MAXSIZE,
+                        max_connections=OUTBOUND_POOL_MAXSIZE * 4
+                    )
+                )
+                self.http2 = True
+            except ImportError:
+                logger.warning("OUTBOUND_HTTP2 is set but httpx[http2] is not installed; using HTTP/1.1")
+
+    # =========================================================================
+    # Public API
+    # =========================================================================
+
+    def request(self, method: str, url: str,
+                timeout: float = None,
+                max_retries: int = None,
+                retry_statuses=RETRY_STATUSES,
+                **kwargs):
+        """
+        Send a request, retrying 429/5xx responses and connect errors.
+
+        Args:
+            method: HTTP method
+            url: Absolute URL
+            timeout: Read timeout in seconds (connect timeout is global)
+            max_retries: Override OUTBOUND_MAX_RETRIES (0 disables retries)
+            retry_statuses: Status codes worth retrying. Use {429} for
+                non-idempotent calls that must not be repeated after a 5xx.
+            **kwargs: headers, json, data, params
+
+        Returns:
+            Response object with status_code, headers, text and json()
+        """
+        attempts = self._attempts(max_retries)
+        for attempt in range(attempts):
+            try:
+                response = self._send(method, url, timeout, kwargs)
+            except self._connect_errors() as e:
+                if attempt + 1 >= attempts:
+                    raise
+                self._wait(self._retry_delay(attempt, None, url), url, f"connect error: {e}")
+                continue
+
+            if response.status_code in retry_statuses and attempt + 1 < attempts:
+                delay = self._retry_delay(attempt, response.headers, url)
+                if delay is not None:
+                    self._wait(delay, url, f"status {response.status_code}")
+                    continue
+            return response
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    @contextmanager
+    def stream(self, method: str, url: str,
+               timeout: float = None,
+               max_retries: int = None,
+               retry_statuses=RETRY_STATUSES,
+               **kwargs) -> Iterator[StreamedResponse]:
+        """
+        Open a streaming request (e.g. SSE). Retries happen only before the
+        body is consumed, i.e. on the initial status code.
+
+        Usage:
+            with get_http_client().stream('POST', url, json=payload) as response:
+                for line in response.iter_lines(): ...
+        """
+        attempts = self._attempts(max_retries)
+        for attempt in range(attempts):
+            try:
+                ctx = self._open_stream(method, url, timeout, kwargs)
+                response = ctx.__enter__()
+            except self._connect_errors() as e:
+                if attempt + 1 >= attempts:
+                    raise
+                self._wait(self._retry_delay(attempt, None, url), url, f"connect error: {e}")
+                continue
+
+            if response.status_code in retry_statuses and attempt + 1 < attempts:
+                delay = self._retry_delay(attempt, response.headers, url)
+                if delay is not None:
+                    ctx.__exit__(None, None, None)
+                    self._wait(delay, url, f"status {response.status_code}")
+                    continue
+
+            try:
+                yield response
+            finally:
+                ctx.__exit__(None, None, None)
+            return
+
+    # =========================================================================
+    # Internals
+    # =========================================================================
+
+    def _attempts(self, max_retries: Optional[int]) -> int:
+        return 1 + (OUTBOUND_MAX_RETRIES if max_retries is None else max(0, max_retries))
+
+    def _timeout(self, read_timeout: Optional[float]):
+        read = OUTBOUND_READ_TIMEOUT if read_timeout is None else read_timeout
+        if self._httpx is not None:
+            import httpx
+            return httpx.Timeout(read, connect=OUTBOUND_CONNECT_TIMEOUT)
+        return (OUTBOUND_CONNECT_TIMEOUT, read)
+
+    def _connect_errors(self):
+        if self._httpx is not None:
+            import httpx
+            return (httpx.ConnectError, httpx.ConnectTimeout)
+        return (requests.exceptions.ConnectionError,)
+
+    def _send(self, method: str, url: str, timeout: Optional[float], kwargs: Dict):
+        if self._httpx is not None:
+            return self._httpx.request(method, url, timeout=self._timeout(timeout), **kwargs)
+        return self._session.request(method, url, timeout=self._timeout(timeout), **kwargs)
+
+    @contextmanager
+    def _open_stream(self, method: str, url: str, timeout: Optional[float], kwargs: Dict):
+        if self._httpx is not None:
+            with self._httpx.stream(method, url, timeout=self._timeout(timeout), **kwargs) as r:
+                def read_text():
+                    r.read()
+                    return r.text
+                yield StreamedResponse(r.status_code, r.headers, r.iter_lines(), read_text)
+            return
+
+        r = self._session.request(method, url, timeout=self._timeout(timeout), stream=True, **kwargs)
+        try:
+            yield StreamedResponse(r.status_code, r.headers, r.iter_lines(), lambda: r.text)
+        finally:
+            r.close()
+
+    def _retry_delay(self, attempt: int, headers, url: str) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt. Honours Retry-After when
+        present, otherwise uses full-jitter exponential backoff.
+
+        Returns:
+            None if the server asked us to wait longer than OUTBOUND_BACKOFF_MAX
+        """
+        retry_after = _retry_after_seconds(headers)
+        if retry_after is not None:
+            if retry_after > OUTBOUND_BACKOFF_MAX:
+                logger.warning(f"Not retrying {url}: Retry-After {retry_after:.1f}s exceeds limit")
+                return None
+            return retry_after
+        return random.uniform(0, min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE * (2 ** attempt)))
+
+    def _wait(self, delay: float, url: str, reason: str):
+        logger.warning(f"Retrying {url} in {delay:.2f}s ({reason})")
+        time.sleep(delay)
+
+
+# Global instance
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> OutboundClient:
+    """Get the global outbound HTTP client"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = OutboundClient()
+    return _http_client
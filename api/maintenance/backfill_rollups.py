@@ -0,0 +1,120 @@
+"""
+Backfill the analytics rollup tables from raw rows.
+
+Rebuilds the hourly/daily rollups day by day (one RPC per chunk, so no
+single statement runs into a timeout), then moves the watermark to the
+start of the backfill and runs one incremental refresh for rows written
+meanwhile. Safe to re-run; rebuilding an hour replaces its rollup rows.
+
+Readers treat everything before the watermark as rolled up, so --days
+must not leave unbuilt hours behind it: it is refused before the first
+full backfill, and it is extended back to the current watermark if that
+lies before the requested window.
+
+Usage:
+    python maintenance/backfill_rollups.py               # everything
+    python maintenance/backfill_rollups.py --days 90     # last 90 days
+    python maintenance/backfill_rollups.py --refresh     # incremental refresh only (cron)
+"""
+import sys
+import os
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# Add parent dir to path to import db
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import rollups
+
+
+def parse_ts(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+
+def earliest_raw_timestamp(db_client):
+    """Oldest started_at / created_at across the rolled-up tables"""
+    candidates = []
+    for table, column in (('workflow_executions', 'started_at'),
+                          ('chat_messages', 'created_at'),
+                          ('chat_sessions', 'created_at')):
+        result = db_client.table(table).select(column).not_.is_(column, 'null') \
+            .order(column).limit(1).execute()
+        if result.data:
+            candidates.append(parse_ts(result.data[0][column]))
+    return min(candidates) if candidates else None
+
+
+def current_watermark(db_client):
+    """processed_until of the analytics rollups, or None before the first backfill"""
+    result = db_client.table('rollup_watermarks').select('processed_until') \
+        .eq('name', 'analytics').limit(1).execute()
+    return parse_ts(result.data[0]['processed_until']) if result.data else None
+
+
+def backfill(days=None, chunk_days=1):
+    db_client = db.get_db()
+    if not db_client:
+        print("Database not available")
+        return False
+
+    # Rows written after this point are picked up by the final refresh
+    started = datetime.now(timezone.utc) - timedelta(seconds=rollups.ROLLUP_SETTLE_SECONDS)
+
+    if days:
+        start = started - timedelta(days=days)
+        watermark = current_watermark(db_client)
+        if watermark is None:
+            earliest = earliest_raw_timestamp(db_client)
+            if earliest is not None and earliest < start:
+                print("No rollups yet: --days would leave older data unrolled behind the "
+                      "watermark. Run the full backfill (without --days) first.")
+                return False
+        elif watermark < start:
+            print(f"Watermark at {watermark.isoformat(timespec='seconds')} is before the "
+                  f"requested window, rebuilding from there")
+            start = watermark
+    else:
+        start = earliest_raw_timestamp(db_client)
+        if start is None:
+            print("No raw rows to backfill")
+            start = started
+    start = start.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    chunk = start
+    hours = 0
+    while chunk < started:
+        chunk_end = min(chunk + timedelta(days=chunk_days), started)
+        result = db_client.rpc('rebuild_analytics_rollups', {
+            'p_start': chunk.isoformat(),
+            'p_end': chunk_end.isoformat()
+        }).execute()
+        hours += result.data or 0
+        print(f"  {chunk.date()} .. {chunk_end.isoformat(timespec='minutes')}: rebuilt")
+        chunk = chunk_end
+
+    db_client.rpc('advance_rollup_watermark', {'p_processed_until': started.isoformat()}).execute()
+    print(f"Rebuilt {hours} hours, watermark at {started.isoformat(timespec='seconds')}")
+
+    result = rollups.refresh_rollups()
+    print(f"Catch-up refresh: {result}")
+    return result is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill or refresh analytics rollups')
+    parser.add_argument('--days', type=int, help='only rebuild the last N days, after a full backfill (default: all raw data)')
+    parser.add_argument('--chunk-days', type=int, default=1, help='days per rebuild RPC (default 1)')
+    parser.add_argument('--refresh', action='store_true', help='run one incremental refresh and exit')
+    args = parser.parse_args()
+
+    if args.refresh:
+        result = rollups.refresh_rollups()
+        print(result)
+        sys.exit(0 if result is not None else 1)
+
+    sys.exit(0 if backfill(args.days, args.chunk_days) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare full knowledge-base injection with BM25 passage retrieval.
+
+Reports prompt size (approx. tokens = chars / 4) and lookup latency for a set
+of questions. Uses a company's knowledge base when COMPANY_SLUG is given,
+otherwise a synthetic corpus.
+
+Usage:
+    python maintenance/benchmark_knowledge_retrieval.py [company_slug] [entries]
+"""
+import sys
+import os
+import time
+import random
+from dotenv import load_dotenv
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+from bot.knowledge import BM25Index, format_knowledge, KNOWLEDGE_TOP_K
+
+QUESTIONS = [
+    "Welche Seminare bieten Sie zum Thema Führung an?",
+    "Was kostet ein Inhouse Training?",
+    "Do you offer coaching for new managers?",
+    "Wie kann ich einen Termin vereinbaren?",
+    "Gibt es Seminare zu Konfliktmanagement und Kommunikation?",
+]
+
+TOPICS = ["Führung", "Kommunikation", "Konfliktmanagement", "Zeitmanagement", "Verhandlung",
+          "Coaching", "Teamentwicklung", "Change Management", "Präsentation", "Vertrieb"]
+
+
+def load_entries(slug):
+    """Load a company's active knowledge entries"""
+    from db import get_db, get_company_by_slug
+    company = get_company_by_slug(slug)
+    if not company:
+        print(f"Company {slug} not found")
+        sys.exit(1)
+    result = get_db().table('company_knowledge_base')\
+        .select('id, title, content')\
+        .eq('company_id', company['id'])\
+        .eq('is_active', True)\
+        .execute()
+    return result.data or []
+
+
+def synthetic_entries(count):
+    """Generate a corpus of seminar-like entries"""
+    rng = random.Random(42)
+    entries = []
+    for i in range(count):
+        topic = rng.choice(TOPICS)
+        paragraphs = [
+            f"Unser Seminar {topic} {i} richtet sich an Fach- und Führungskräfte. "
+            f"Dauer: {rng.randint(1, 3)} Tage, Preis: {rng.randint(8, 25) * 100} EUR.",
+            f"Inhalte: Grundlagen {topic}, Praxisübungen, Fallbeispiele und Transfer in den Alltag. " * 4,
+            "Termine und Inhouse-Trainings auf Anfrage. Buchung über unser Kontaktformular.",
+        ]
+        entries.append({'id': str(i), 'title': f"{topic} Seminar {i}", 'content': "\n\n".join(paragraphs)})
+    return entries
+
+
+def full_dump(entries):
+    """Same layout as db.get_company_knowledge"""
+    text = "\n\n### Company Knowledge Base:\n"
+    for entry in entries:
+        text += f"---\nTitle: {entry.get('title', 'Unknown')}\nContent:\n{(entry.get('content') or '')[:2000]}\n"
+    return text
+
+
+def main():
+    slug = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].isdigit() else None
+    count = int(sys.argv[-1]) if len(sys.argv) > 1 and sys.argv[-1].isdigit() else 200
+
+    entries = load_entries(slug) if slug else synthetic_entries(count)
+    print(f"Corpus: {len(entries)} entries ({'company ' + slug if slug else 'synthetic'})")
+
+    start = time.perf_counter()
+    index = BM25Index()
+    for entry in entries:
+        index.upsert_entry(entry)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Index build: {build_ms:.1f}ms, {len(index)} passages, {len(index.postings)} terms")
+
+    dump_tokens = len(full_dump(entries)) // 4
+    print(f"\nFull dump: ~{dump_tokens} tokens per request\n")
+    print(f"{'question':<60} {'tokens':>7} {'search ms':>10}")
+
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        for _ in range(100):
+            hits = index.search(question, KNOWLEDGE_TOP_K)
+        search_ms = (time.perf_counter() - start) * 1000 / 100
+        tokens = len(format_knowledge([p for _, p in hits])) // 4
+        print(f"{question[:58]:<60} {tokens:>7} {search_ms:>10.3f}")
+        for score, passage in hits[:3]:
+            print(f"    {score:6.2f}  {passage['title']}")
+
+
+if __name__ == "__main__":
+    main()
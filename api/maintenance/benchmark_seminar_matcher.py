@@ -0,0 +1,96 @@
+"""
+Microbenchmark: seminar Q&A keyword matching at 10k rows.
+
+Compares the previous per-row substring scan with the compiled Aho-Corasick
+matcher on a synthetic seminar_qa table (no database needed).
+
+Usage:
+    python maintenance/benchmark_seminar_matcher.py [rows]
+"""
+import sys
+import os
+import re
+import time
+import random
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seminar_matcher import SeminarMatcher
+
+SEMINARS = ["Führung", "Kommunikation", "Konfliktmanagement", "Zeitmanagement", "Verhandlung",
+            "Coaching", "Teamentwicklung", "Change Management", "Präsentation", "Vertrieb",
+            "Resilienz", "Projektmanagement", "Moderation", "Feedback", "Selbstorganisation"]
+
+QUERIES = [
+    "Welche Seminare bieten Sie zum Thema Führung an?",
+    "Ich suche ein Training für Konfliktmanagement und Kommunikation im Team",
+    "Was kostet das Coaching für neue Führungskräfte?",
+    "Hallo, wie geht es?",
+    "Gibt es Inhouse Schulungen zu Projektmanagement oder Moderation in München?",
+]
+
+
+def synthetic_rows(count):
+    """seminar_qa rows: ~40 seminar variants, keywords from a shared vocabulary"""
+    rng = random.Random(7)
+    vocabulary = [f"{topic.lower()} {suffix}" for topic in SEMINARS
+                  for suffix in ("grundlagen", "kompakt", "online", "inhouse", "kosten", "termine")]
+    vocabulary += [f"stichwort{i}" for i in range(3000)]
+    rows = []
+    for i in range(count):
+        topic = rng.choice(SEMINARS)
+        rows.append({
+            'id': str(i),
+            'seminar_name': f"{topic} {rng.choice(['Basis', 'Aufbau', 'Intensiv'])}",
+            'question': f"Frage {i} zu {topic}?",
+            'answer': f"Antwort {i}",
+            'keywords': [topic.lower()] + rng.sample(vocabulary, 4)
+        })
+    return rows
+
+
+def scan_match(rows, query_text):
+    """Previous implementation: substring checks per row and keyword"""
+    clean_query = re.sub(r'[^\w\s]', '', query_text).lower()
+    matched = []
+    for item in rows:
+        score = 0
+        if item.get('seminar_name', '').lower() in clean_query:
+            score += 10
+        for kw in item.get('keywords', []) or []:
+            if kw.lower() in clean_query:
+                score += 5
+        if score > 0:
+            matched.append((score, item))
+    matched.sort(key=lambda x: x[0], reverse=True)
+    return matched[:3]
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) * 1000 / repeat, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rows = synthetic_rows(count)
+
+    start = time.perf_counter()
+    matcher = SeminarMatcher(rows)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"{count} rows: automaton with {len(matcher.automaton.patterns)} patterns, "
+          f"{len(matcher.automaton.goto)} states, built in {build_ms:.1f}ms\n")
+    print(f"{'query':<62} {'scan ms':>9} {'automaton ms':>13} {'same':>5}")
+
+    for query in QUERIES:
+        scan_ms, scan_result = timed(lambda: scan_match(rows, query), 5)
+        ac_ms, ac_result = timed(lambda: matcher.match(query, limit=3), 200)
+        same = [(s, r['id']) for s, r in scan_result] == [(s, r['id']) for s, r in ac_result]
+        print(f"{query[:60]:<62} {scan_ms:>9.2f} {ac_ms:>13.3f} {str(same):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,18 +33,16 @@ def deep_search():
     except:
         pass
 
-    # 3. Chat Messages (in chat_sessions metadata)
-    # This is expensive, but let's check recent ones
-    print("Checking recent 'chat_sessions' messages...")
+    # 3. Chat Messages
+    print("Checking 'chat_messages'...")
     try:
-        res = client.table('chat_sessions').select('*').order('updated_at', desc=True).limit(50).execute()
+        res = client.table('chat_messages').select('session_id, content').ilike('content', f'%{term}%').limit(50).execute()
         for row in res.data:
-            meta = str(row.get('metadata', ''))
-            if term in meta:
-                print(f"FOUND in Session: {row['session_key']}")
-                # print snippet
-                start = meta.find(term)
-                print(f"Snippet: {meta[start-50:start+50]}")
+            print(f"FOUND in Session: {row['session_id']}")
+            # print snippet
+            content = row.get('content', '')
+            start = content.find(term)
+            print(f"Snippet: {content[max(start-50, 0):start+50]}")
     except:
         pass
 
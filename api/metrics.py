@@ -0,0 +1,416 @@
+"""
+Metrics - in-process counters, gauges and histograms
+
+A small Prometheus-compatible registry that needs no client library or
+external service. Metrics live in process memory (each serverless instance
+or gunicorn worker has its own) and are exported in the Prometheus text
+format by the admin-protected `/metrics` route.
+
+Instrumented:
+    http_*      per-route request counts and latency (app.py request hooks)
+    supabase_*  calls and latency per table / RPC (instrument_client, used by db.get_db)
+    openai_*    requests, latency and tokens per model and company (bot engine, chat service)
+    cache_*     hit/miss counters and sizes of the in-process caches (collected on scrape)
+
+Environment:
+    METRICS_TOKEN  bearer token accepted by /metrics in addition to an admin session
+"""
+
+import os
+import time
+import hmac
+import bisect
+import threading
+from typing import Dict, List, Optional, Tuple, Callable, Iterable, Any
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers fast cache-backed routes up to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple('' if labels[n] is None else str(labels[n]) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}']
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down per label set"""
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram per label set (bucket counts, sum and count)"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get(self, **labels) -> Dict[str, Any]:
+        """Cumulative bucket counts, sum and count for one label set"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if state is None:
+                return {'buckets': {}, 'sum': 0.0, 'count': 0}
+            counts, total, count = list(state[0]), state[1], state[2]
+        cumulative, running = {}, 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            running += n
+            cumulative[bound] = running
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+    def _render_sample(self, key, state) -> List[str]:
+        lines, running = [], 0
+        for bound, n in zip(self.buckets + (float('inf'),), state[0]):
+            running += n
+            le = 'le="{}"'.format(_format_value(bound))
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {running}')
+        labels = _format_labels(self.label_names, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(state[1])}')
+        lines.append(f'{self.name}_count{labels} {state[2]}')
+        return lines
+
+    def render(self) -> List[str]:
+        # _values holds mutable state lists; copy them under the lock
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._values.items())
+        for key, state in items:
+            lines.extend(self._render_sample(key, state))
+        return lines
+
+
+# A collector returns (name, type, help, [(labels, value), ...]) tuples on scrape
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    """Named metrics plus collectors that read existing stats at scrape time"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.type_name}")
+            return metric
+
+    def counter(self, name: str, description: str, labels: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, description, labels)
+
+    def histogram(self, name: str, description: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+    def register_collector(self, collector: Collector):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Error collecting metrics from {getattr(collector, '__name__', collector)}: {e}")
+                continue
+            for name, type_name, description, samples in families:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    names = tuple(labels)
+                    values = tuple(str(labels[n]) for n in names)
+                    lines.append(f'{name}{_format_labels(names, values)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Clear all recorded values (collectors stay registered)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    """Get the process-wide metrics registry"""
+    return _registry
+
+
+def token_authorized(authorization: Optional[str]) -> bool:
+    """True if the Authorization header carries METRICS_TOKEN"""
+    if not METRICS_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization, f'Bearer {METRICS_TOKEN}')
+
+
+# ============================================
+# HTTP
+# ============================================
+
+HTTP_REQUESTS = _registry.counter(
+    'http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+HTTP_LATENCY = _registry.histogram(
+    'http_request_duration_seconds', 'Time until the response is returned (first byte for streams)',
+    ('route', 'method'))
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    HTTP_REQUESTS.inc(route=route, method=method, status=status)
+    HTTP_LATENCY.observe(seconds, route=route, method=method)
+
+
+# ============================================
+# SUPABASE
+# ============================================
+
+SUPABASE_REQUESTS = _registry.counter(
+    'supabase_requests_total', 'Supabase calls by table (or RPC), operation and outcome',
+    ('table', 'operation', 'status'))
+SUPABASE_LATENCY = _registry.histogram(
+    'supabase_request_duration_seconds', 'Supabase call latency by table (or RPC) and operation',
+    ('table', 'operation'))
+
+_OPERATIONS = frozenset(('select', 'insert', 'update', 'upsert', 'delete'))
+
+
+class _InstrumentedQuery:
+    """Wraps a postgrest request builder; times its execute() call"""
+
+    __slots__ = ('_builder', '_table', '_operation')
+
+    def __init__(self, builder, table: str, operation: str):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == 'execute':
+            return self._execute
+        operation = name if name in _OPERATIONS else self._operation
+        if callable(attr):
+            def call(*args, **kwargs):
+                return self._wrap(attr(*args, **kwargs), operation)
+            return call
+        # Properties such as `not_` return a builder too
+        return self._wrap(attr, operation)
+
+    def _wrap(self, value, operation: str):
+        if hasattr(value, 'execute'):
+            return _InstrumentedQuery(value, self._table, operation)
+        return value
+
+    def _execute(self, *args, **kwargs):
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            return self._builder.execute(*args, **kwargs)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            SUPABASE_REQUESTS.inc(table=self._table, operation=self._operation, status=status)
+            SUPABASE_LATENCY.observe(time.perf_counter() - started,
+                                     table=self._table, operation=self._operation)
+
+
+class InstrumentedClient:
+    """Supabase client whose table() and rpc() queries are recorded"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name: str):
+        return _InstrumentedQuery(self._client.table(name), name, 'other')
+
+    from_ = table
+
+    def rpc(self, fn: str, *args, **kwargs):
+        return _InstrumentedQuery(self._client.rpc(fn, *args, **kwargs), fn, 'rpc')
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument_client(client):
+    """Wrap a Supabase client so its queries are counted and timed"""
+    return InstrumentedClient(client)
+
+
+# ============================================
+# OPENAI
+# ============================================
+
+OPENAI_REQUESTS = _registry.counter(
+    'openai_requests_total', 'Chat completion requests by model, company and outcome',
+    ('model', 'company', 'status'))
+OPENAI_LATENCY = _registry.histogram(
+    'openai_request_duration_seconds', 'Time spent waiting on chat completions by model and company',
+    ('model', 'company'))
+OPENAI_TOKENS = _registry.counter(
+    'openai_tokens_total', 'Tokens used by chat completions by model and company',
+    ('model', 'company'))
+
+
+def observe_openai(model: str, company_id: Optional[str], seconds: float,
+                   tokens: Optional[int] = None, status: str = 'ok'):
+    company = company_id or 'none'
+    OPENAI_REQUESTS.inc(model=model, company=company, status=status)
+    OPENAI_LATENCY.observe(seconds, model=model, company=company)
+    observe_openai_tokens(model, company, tokens)
+
+
+def observe_openai_tokens(model: str, company_id: Optional[str], tokens: Optional[int]):
+    if tokens:
+        OPENAI_TOKENS.inc(tokens, model=model, company=company_id or 'none')
+
+
+# ============================================
+# CACHES
+# ============================================
+
+def _cache_collector():
+    """Hit/miss counters and sizes of the in-process caches"""
+    import db
+    import auth
+    import tenant_cache
+    import answer_cache
+    from history_cache import get_history_cache
+    from background_writer import get_background_writer
+
+    caches = {
+        'tenant': tenant_cache.get_cache_stats(),
+        'history': get_history_cache().stats(),
+        'answers': answer_cache.get_cache_stats(),
+        'api_keys': db.get_api_key_cache_stats(),
+        'supabase_tokens': auth.get_token_cache_stats()
+    }
+    yield ('cache_hits_total', 'counter', 'Cache hits since the process started',
+           [({'cache': n}, s.get('hits')) for n, s in caches.items()])
+    yield ('cache_misses_total', 'counter', 'Cache misses since the process started',
+           [({'cache': n}, s.get('misses')) for n, s in caches.items()])
+    yield ('cache_hit_ratio', 'gauge', 'Cache hits / lookups since the process started',
+           [({'cache': n}, s.get('hit_rate')) for n, s in caches.items()])
+    yield ('cache_entries', 'gauge', 'Entries currently cached',
+           [({'cache': n}, s.get('size', s.get('sessions'))) for n, s in caches.items()])
+    yield ('background_writer_queue_depth', 'gauge', 'Chat writes waiting in the background queue',
+           [({}, get_background_writer().get_stats().get('queued'))])
+
+
+_registry.register_collector(_cache_collector)
@@ -0,0 +1,551 @@
+-- ============================================================================
+-- Analytics rollups: hourly and daily aggregates
+-- ============================================================================
+-- Workflow executions and chat activity are pre-aggregated into hourly and
+-- daily rollup tables. refresh_analytics_rollups() is incremental: it
+-- recomputes only the hours that received rows since the persisted
+-- watermark (and the hour the watermark falls in, for stragglers), then
+-- rebuilds the affected days from the hourly rows. Recomputing whole hours
+-- keeps the refresh idempotent and picks up status changes of running
+-- executions.
+--
+-- Readers combine daily rollups for complete days, hourly rollups for the
+-- edges of the range and raw rows for everything after the watermark hour
+-- (the current partial hour, or more if the refresher is behind). Without
+-- any refresh the readers return the same numbers from raw rows only.
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_workflow_analytics.sql
+-- and database_migration_chat_messages.sql, then fill the rollups with
+-- maintenance/backfill_rollups.py. Safe to run more than once.
+-- ============================================================================
+
+-- workflow_executions rows change after insert (running -> success), so the
+-- watermark follows updated_at rather than started_at
+ALTER TABLE workflow_executions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+CREATE INDEX IF NOT EXISTS idx_workflow_executions_updated_at ON workflow_executions(updated_at);
+
+DROP TRIGGER IF EXISTS update_workflow_executions_updated_at ON workflow_executions;
+CREATE TRIGGER update_workflow_executions_updated_at
+    BEFORE UPDATE ON workflow_executions
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at ON chat_messages(created_at);
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_created_at ON chat_sessions(created_at);
+
+-- ============================================================================
+-- Rollup tables
+-- ============================================================================
+-- bucket_start is the UTC start of the hour / day.
+
+CREATE TABLE IF NOT EXISTS workflow_execution_rollups_hourly (
+    bucket_start TIMESTAMPTZ NOT NULL,
+    workflow_activation_id UUID NOT NULL REFERENCES workflow_activations(id) ON DELETE CASCADE,
+    total INTEGER NOT NULL DEFAULT 0,
+    successful INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    duration_sum_ms BIGINT NOT NULL DEFAULT 0,
+    duration_count INTEGER NOT NULL DEFAULT 0,
+    duration_min_ms INTEGER,
+    duration_max_ms INTEGER,
+    last_started_at TIMESTAMPTZ,
+    PRIMARY KEY (bucket_start, workflow_activation_id)
+);
+
+CREATE TABLE IF NOT EXISTS workflow_execution_rollups_daily (
+    LIKE workflow_execution_rollups_hourly INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+    PRIMARY KEY (bucket_start, workflow_activation_id),
+    FOREIGN KEY (workflow_activation_id) REFERENCES workflow_activations(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS chat_activity_rollups_hourly (
+    bucket_start TIMESTAMPTZ NOT NULL,
+    company_id UUID NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+    user_messages INTEGER NOT NULL DEFAULT 0,
+    assistant_messages INTEGER NOT NULL DEFAULT 0,
+    tokens BIGINT NOT NULL DEFAULT 0,
+    new_sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, company_id)
+);
+
+CREATE TABLE IF NOT EXISTS chat_activity_rollups_daily (
+    LIKE chat_activity_rollups_hourly INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+    PRIMARY KEY (bucket_start, company_id),
+    FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_activity_hourly_company
+    ON chat_activity_rollups_hourly(company_id, bucket_start);
+CREATE INDEX IF NOT EXISTS idx_chat_activity_daily_company
+    ON chat_activity_rollups_daily(company_id, bucket_start);
+
+-- Everything before processed_until has been rolled up
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name TEXT PRIMARY KEY,
+    processed_until TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- ============================================================================
+-- rollup_analytics_hours: recompute a set of hours and their days
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION rollup_analytics_hours(p_hours TIMESTAMPTZ[])
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_days TIMESTAMPTZ[];
+BEGIN
+    IF p_hours IS NULL OR cardinality(p_hours) = 0 THEN
+        RETURN 0;
+    END IF;
+
+    SELECT array_agg(DISTINCT date_trunc('day', h AT TIME ZONE 'UTC') AT TIME ZONE 'UTC')
+    INTO v_days
+    FROM unnest(p_hours) AS h;
+
+    -- Workflow executions
+    DELETE FROM workflow_execution_rollups_hourly WHERE bucket_start = ANY(p_hours);
+
+    INSERT INTO workflow_execution_rollups_hourly (
+        bucket_start, workflow_activation_id, total, successful, failed,
+        duration_sum_ms, duration_count, duration_min_ms, duration_max_ms, last_started_at
+    )
+    SELECT h.hour, e.workflow_activation_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE e.status = 'success'),
+           COUNT(*) FILTER (WHERE e.status IN ('error', 'failed')),
+           COALESCE(SUM(e.duration_ms) FILTER (WHERE e.duration_ms > 0), 0),
+           COUNT(*) FILTER (WHERE e.duration_ms > 0),
+           MIN(e.duration_ms) FILTER (WHERE e.duration_ms > 0),
+           MAX(e.duration_ms) FILTER (WHERE e.duration_ms > 0),
+           MAX(e.started_at)
+    FROM unnest(p_hours) AS h(hour)
+    JOIN workflow_executions e
+      ON e.started_at >= h.hour AND e.started_at < h.hour + INTERVAL '1 hour'
+    GROUP BY h.hour, e.workflow_activation_id;
+
+    DELETE FROM workflow_execution_rollups_daily WHERE bucket_start = ANY(v_days);
+
+    INSERT INTO workflow_execution_rollups_daily (
+        bucket_start, workflow_activation_id, total, successful, failed,
+        duration_sum_ms, duration_count, duration_min_ms, duration_max_ms, last_started_at
+    )
+    SELECT d.day, r.workflow_activation_id,
+           SUM(r.total), SUM(r.successful), SUM(r.failed),
+           SUM(r.duration_sum_ms), SUM(r.duration_count),
+           MIN(r.duration_min_ms), MAX(r.duration_max_ms), MAX(r.last_started_at)
+    FROM unnest(v_days) AS d(day)
+    JOIN workflow_execution_rollups_hourly r
+      ON r.bucket_start >= d.day AND r.bucket_start < d.day + INTERVAL '1 day'
+    GROUP BY d.day, r.workflow_activation_id;
+
+    -- Chat activity
+    DELETE FROM chat_activity_rollups_hourly WHERE bucket_start = ANY(p_hours);
+
+    INSERT INTO chat_activity_rollups_hourly (
+        bucket_start, company_id, user_messages, assistant_messages, tokens, new_sessions
+    )
+    SELECT hour, company_id, SUM(user_messages), SUM(assistant_messages), SUM(tokens), SUM(new_sessions)
+    FROM (
+        SELECT h.hour, s.company_id,
+               COUNT(*) FILTER (WHERE m.role = 'user') AS user_messages,
+               COUNT(*) FILTER (WHERE m.role = 'assistant') AS assistant_messages,
+               COALESCE(SUM(m.tokens_used), 0) AS tokens,
+               0 AS new_sessions
+        FROM unnest(p_hours) AS h(hour)
+        JOIN chat_messages m
+          ON m.created_at >= h.hour AND m.created_at < h.hour + INTERVAL '1 hour'
+        JOIN chat_sessions s ON s.id = m.session_id
+        WHERE s.company_id IS NOT NULL
+        GROUP BY h.hour, s.company_id
+        UNION ALL
+        SELECT h.hour, s.company_id, 0, 0, 0, COUNT(*)
+        FROM unnest(p_hours) AS h(hour)
+        JOIN chat_sessions s
+          ON s.created_at >= h.hour AND s.created_at < h.hour + INTERVAL '1 hour'
+        WHERE s.company_id IS NOT NULL
+        GROUP BY h.hour, s.company_id
+    ) activity
+    GROUP BY hour, company_id;
+
+    DELETE FROM chat_activity_rollups_daily WHERE bucket_start = ANY(v_days);
+
+    INSERT INTO chat_activity_rollups_daily (
+        bucket_start, company_id, user_messages, assistant_messages, tokens, new_sessions
+    )
+    SELECT d.day, r.company_id,
+           SUM(r.user_messages), SUM(r.assistant_messages), SUM(r.tokens), SUM(r.new_sessions)
+    FROM unnest(v_days) AS d(day)
+    JOIN chat_activity_rollups_hourly r
+      ON r.bucket_start >= d.day AND r.bucket_start < d.day + INTERVAL '1 day'
+    GROUP BY d.day, r.company_id;
+
+    RETURN cardinality(p_hours);
+END;
+$$;
+
+-- ============================================================================
+-- refresh_analytics_rollups: incremental refresh from the watermark
+-- ============================================================================
+-- Rows younger than p_settle_seconds are left for the next run, so writes
+-- still in flight (background writer, long transactions) are not skipped.
+
+CREATE OR REPLACE FUNCTION refresh_analytics_rollups(p_settle_seconds INTEGER DEFAULT 120)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_from TIMESTAMPTZ;
+    v_until TIMESTAMPTZ := NOW() - make_interval(secs => p_settle_seconds);
+    v_hours TIMESTAMPTZ[];
+    v_count INTEGER;
+BEGIN
+    -- One refresher at a time (several app processes may run the job)
+    IF NOT pg_try_advisory_xact_lock(hashtext('refresh_analytics_rollups')) THEN
+        RETURN jsonb_build_object('skipped', 'locked');
+    END IF;
+
+    SELECT processed_until INTO v_from FROM rollup_watermarks WHERE name = 'analytics';
+    v_from := COALESCE(v_from, '-infinity'::TIMESTAMPTZ);
+    IF v_until <= v_from THEN
+        RETURN jsonb_build_object('skipped', 'up_to_date', 'processed_until', v_from);
+    END IF;
+
+    SELECT array_agg(DISTINCT hour) INTO v_hours
+    FROM (
+        SELECT date_trunc('hour', started_at) AS hour
+        FROM workflow_executions
+        WHERE updated_at > v_from AND updated_at <= v_until AND started_at IS NOT NULL
+        UNION
+        SELECT date_trunc('hour', created_at)
+        FROM chat_messages
+        WHERE created_at > v_from AND created_at <= v_until
+        UNION
+        SELECT date_trunc('hour', created_at)
+        FROM chat_sessions
+        WHERE created_at > v_from AND created_at <= v_until
+        UNION
+        SELECT date_trunc('hour', v_from)
+        WHERE v_from > '-infinity'::TIMESTAMPTZ
+    ) touched;
+
+    v_count := rollup_analytics_hours(v_hours);
+
+    INSERT INTO rollup_watermarks (name, processed_until, updated_at)
+    VALUES ('analytics', v_until, NOW())
+    ON CONFLICT (name) DO UPDATE SET processed_until = EXCLUDED.processed_until, updated_at = NOW();
+
+    RETURN jsonb_build_object('hours', v_count, 'processed_from', v_from, 'processed_until', v_until);
+END;
+$$;
+
+-- ============================================================================
+-- Backfill helpers
+-- ============================================================================
+
+-- Recompute every hour in [p_start, p_end); does not move the watermark
+CREATE OR REPLACE FUNCTION rebuild_analytics_rollups(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    SELECT rollup_analytics_hours(ARRAY(
+        SELECT h
+        FROM generate_series(date_trunc('hour', p_start), p_end, INTERVAL '1 hour') AS h
+        WHERE h < p_end
+    ));
+$$;
+
+-- Move the watermark forward (never back) after a backfill
+CREATE OR REPLACE FUNCTION advance_rollup_watermark(p_processed_until TIMESTAMPTZ)
+RETURNS TIMESTAMPTZ
+LANGUAGE sql
+AS $$
+    INSERT INTO rollup_watermarks AS w (name, processed_until, updated_at)
+    VALUES ('analytics', p_processed_until, NOW())
+    ON CONFLICT (name) DO UPDATE
+        SET processed_until = GREATEST(w.processed_until, EXCLUDED.processed_until),
+            updated_at = NOW()
+    RETURNING processed_until;
+$$;
+
+-- ============================================================================
+-- Reading: rollups up to the watermark hour, raw rows after it
+-- ============================================================================
+-- For [p_start, p_end]: daily rollups cover [day_start, day_end), hourly
+-- rollups cover [hour_start, day_start) and [day_end, hour_end), raw rows
+-- cover [p_start, hour_start) and [hour_end, p_end].
+
+CREATE OR REPLACE FUNCTION analytics_rollup_ranges(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    OUT hour_start TIMESTAMPTZ,
+    OUT hour_end TIMESTAMPTZ,
+    OUT day_start TIMESTAMPTZ,
+    OUT day_end TIMESTAMPTZ
+)
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+    v_rolled TIMESTAMPTZ;
+BEGIN
+    SELECT date_trunc('hour', processed_until) INTO v_rolled
+    FROM rollup_watermarks WHERE name = 'analytics';
+    v_rolled := COALESCE(v_rolled, '-infinity'::TIMESTAMPTZ);
+
+    hour_start := date_trunc('hour', p_start);
+    IF hour_start < p_start THEN
+        hour_start := hour_start + INTERVAL '1 hour';
+    END IF;
+    hour_end := LEAST(v_rolled, date_trunc('hour', p_end));
+    IF hour_end <= hour_start THEN
+        -- Nothing rolled up inside the range: raw rows only
+        hour_start := p_start;
+        hour_end := p_start;
+    END IF;
+
+    day_start := date_trunc('day', hour_start AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    IF day_start < hour_start THEN
+        day_start := day_start + INTERVAL '1 day';
+    END IF;
+    day_end := date_trunc('day', hour_end AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    IF day_end <= day_start THEN
+        -- No complete day: hourly rollups cover [hour_start, hour_end)
+        day_start := hour_start;
+        day_end := hour_start;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION workflow_execution_slices(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ)
+RETURNS TABLE (
+    bucket_start TIMESTAMPTZ,
+    workflow_activation_id UUID,
+    total BIGINT,
+    successful BIGINT,
+    failed BIGINT,
+    duration_sum_ms BIGINT,
+    duration_count BIGINT,
+    duration_min_ms INTEGER,
+    duration_max_ms INTEGER,
+    last_started_at TIMESTAMPTZ
+)
+LANGUAGE plpgsql STABLE
+AS $$
+#variable_conflict use_column
+DECLARE
+    r RECORD;
+BEGIN
+    SELECT * INTO r FROM analytics_rollup_ranges(p_start, p_end);
+
+    RETURN QUERY
+    SELECT d.bucket_start, d.workflow_activation_id,
+           d.total::BIGINT, d.successful::BIGINT, d.failed::BIGINT,
+           d.duration_sum_ms, d.duration_count::BIGINT,
+           d.duration_min_ms, d.duration_max_ms, d.last_started_at
+    FROM workflow_execution_rollups_daily d
+    WHERE d.bucket_start >= r.day_start AND d.bucket_start < r.day_end
+    UNION ALL
+    SELECT h.bucket_start, h.workflow_activation_id,
+           h.total::BIGINT, h.successful::BIGINT, h.failed::BIGINT,
+           h.duration_sum_ms, h.duration_count::BIGINT,
+           h.duration_min_ms, h.duration_max_ms, h.last_started_at
+    FROM workflow_execution_rollups_hourly h
+    WHERE (h.bucket_start >= r.hour_start AND h.bucket_start < r.day_start)
+       OR (h.bucket_start >= r.day_end AND h.bucket_start < r.hour_end)
+    UNION ALL
+    SELECT date_trunc('hour', e.started_at), e.workflow_activation_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE e.status = 'success'),
+           COUNT(*) FILTER (WHERE e.status IN ('error', 'failed')),
+           COALESCE(SUM(e.duration_ms) FILTER (WHERE e.duration_ms > 0), 0)::BIGINT,
+           COUNT(*) FILTER (WHERE e.duration_ms > 0),
+           MIN(e.duration_ms) FILTER (WHERE e.duration_ms > 0),
+           MAX(e.duration_ms) FILTER (WHERE e.duration_ms > 0),
+           MAX(e.started_at)
+    FROM workflow_executions e
+    WHERE (e.started_at >= p_start AND e.started_at < r.hour_start)
+       OR (e.started_at >= r.hour_end AND e.started_at <= p_end)
+    GROUP BY 1, 2;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION chat_activity_slices(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ, p_company_id UUID)
+RETURNS TABLE (
+    bucket_start TIMESTAMPTZ,
+    user_messages BIGINT,
+    assistant_messages BIGINT,
+    tokens BIGINT,
+    new_sessions BIGINT
+)
+LANGUAGE plpgsql STABLE
+AS $$
+#variable_conflict use_column
+DECLARE
+    r RECORD;
+BEGIN
+    SELECT * INTO r FROM analytics_rollup_ranges(p_start, p_end);
+
+    RETURN QUERY
+    SELECT d.bucket_start, d.user_messages::BIGINT, d.assistant_messages::BIGINT, d.tokens, d.new_sessions::BIGINT
+    FROM chat_activity_rollups_daily d
+    WHERE d.company_id = p_company_id
+      AND d.bucket_start >= r.day_start AND d.bucket_start < r.day_end
+    UNION ALL
+    SELECT h.bucket_start, h.user_messages::BIGINT, h.assistant_messages::BIGINT, h.tokens, h.new_sessions::BIGINT
+    FROM chat_activity_rollups_hourly h
+    WHERE h.company_id = p_company_id
+      AND ((h.bucket_start >= r.hour_start AND h.bucket_start < r.day_start)
+        OR (h.bucket_start >= r.day_end AND h.bucket_start < r.hour_end))
+    UNION ALL
+    SELECT date_trunc('hour', m.created_at),
+           COUNT(*) FILTER (WHERE m.role = 'user'),
+           COUNT(*) FILTER (WHERE m.role = 'assistant'),
+           COALESCE(SUM(m.tokens_used), 0)::BIGINT,
+           0::BIGINT
+    FROM chat_messages m
+    JOIN chat_sessions s ON s.id = m.session_id
+    WHERE s.company_id = p_company_id
+      AND ((m.created_at >= p_start AND m.created_at < r.hour_start)
+        OR (m.created_at >= r.hour_end AND m.created_at <= p_end))
+    GROUP BY 1
+    UNION ALL
+    SELECT date_trunc('hour', s.created_at), 0::BIGINT, 0::BIGINT, 0::BIGINT, COUNT(*)
+    FROM chat_sessions s
+    WHERE s.company_id = p_company_id
+      AND ((s.created_at >= p_start AND s.created_at < r.hour_start)
+        OR (s.created_at >= r.hour_end AND s.created_at <= p_end))
+    GROUP BY 1;
+END;
+$$;
+
+-- ============================================================================
+-- Workflow analytics RPCs (same signatures, now served from the rollups)
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION get_execution_stats(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_company_id UUID DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_workflow_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    total BIGINT,
+    successful BIGINT,
+    failed BIGINT,
+    avg_duration_ms NUMERIC,
+    min_duration_ms INTEGER,
+    max_duration_ms INTEGER,
+    last_started_at TIMESTAMPTZ
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT COALESCE(SUM(s.total), 0)::BIGINT,
+           COALESCE(SUM(s.successful), 0)::BIGINT,
+           COALESCE(SUM(s.failed), 0)::BIGINT,
+           ROUND(SUM(s.duration_sum_ms)::NUMERIC / NULLIF(SUM(s.duration_count), 0)),
+           MIN(s.duration_min_ms),
+           MAX(s.duration_max_ms),
+           MAX(s.last_started_at)
+    FROM workflow_execution_slices(p_start, p_end) s
+    JOIN workflow_activations a ON a.id = s.workflow_activation_id
+    WHERE (p_workflow_id IS NULL OR a.workflow_id = p_workflow_id)
+      AND CASE
+            WHEN p_company_id IS NOT NULL THEN a.company_id = p_company_id
+            WHEN p_user_id IS NOT NULL THEN a.user_id = p_user_id
+            ELSE TRUE
+          END;
+$$;
+
+CREATE OR REPLACE FUNCTION get_execution_timeline(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_company_id UUID DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL
+)
+RETURNS TABLE (day DATE, success BIGINT, failed BIGINT, total BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    WITH counts AS (
+        SELECT (s.bucket_start AT TIME ZONE 'UTC')::DATE AS day,
+               SUM(s.successful) AS success,
+               SUM(s.failed) AS failed,
+               SUM(s.total) AS total
+        FROM workflow_execution_slices(p_start, p_end) s
+        JOIN workflow_activations a ON a.id = s.workflow_activation_id
+        WHERE CASE
+                WHEN p_company_id IS NOT NULL THEN a.company_id = p_company_id
+                WHEN p_user_id IS NOT NULL THEN a.user_id = p_user_id
+                ELSE TRUE
+              END
+        GROUP BY 1
+    )
+    SELECT d::DATE,
+           COALESCE(c.success, 0)::BIGINT,
+           COALESCE(c.failed, 0)::BIGINT,
+           COALESCE(c.total, 0)::BIGINT
+    FROM generate_series(
+        (p_start AT TIME ZONE 'UTC')::DATE,
+        (p_end AT TIME ZONE 'UTC')::DATE,
+        INTERVAL '1 day'
+    ) AS d
+    LEFT JOIN counts c ON c.day = d::DATE
+    ORDER BY 1;
+$$;
+
+CREATE OR REPLACE FUNCTION get_top_workflows(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_company_id UUID DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE (workflow_id UUID, workflow_name TEXT, total BIGINT, success BIGINT, failed BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT w.id,
+           w.name::TEXT,
+           SUM(s.total)::BIGINT,
+           SUM(s.successful)::BIGINT,
+           SUM(s.failed)::BIGINT
+    FROM workflow_execution_slices(p_start, p_end) s
+    JOIN workflow_activations a ON a.id = s.workflow_activation_id
+    JOIN workflows w ON w.id = a.workflow_id
+    WHERE CASE
+            WHEN p_company_id IS NOT NULL THEN a.company_id = p_company_id
+            WHEN p_user_id IS NOT NULL THEN a.user_id = p_user_id
+            ELSE TRUE
+          END
+    GROUP BY w.id, w.name
+    ORDER BY 3 DESC, w.name
+    LIMIT p_limit;
+$$;
+
+-- ============================================================================
+-- get_chat_activity: per-day chat activity of one company
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION get_chat_activity(
+    p_company_id UUID,
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ
+)
+RETURNS TABLE (day DATE, user_messages BIGINT, assistant_messages BIGINT, tokens BIGINT, new_sessions BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT (s.bucket_start AT TIME ZONE 'UTC')::DATE,
+           SUM(s.user_messages)::BIGINT,
+           SUM(s.assistant_messages)::BIGINT,
+           SUM(s.tokens)::BIGINT,
+           SUM(s.new_sessions)::BIGINT
+    FROM chat_activity_slices(p_start, p_end, p_company_id) s
+    GROUP BY 1
+    ORDER BY 1;
+$$;
+
+GRANT EXECUTE ON FUNCTION refresh_analytics_rollups(INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION rebuild_analytics_rollups(TIMESTAMPTZ, TIMESTAMPTZ) TO service_role;
+GRANT EXECUTE ON FUNCTION advance_rollup_watermark(TIMESTAMPTZ) TO service_role;
+GRANT EXECUTE ON FUNCTION get_chat_activity(UUID, TIMESTAMPTZ, TIMESTAMPTZ) TO service_role;
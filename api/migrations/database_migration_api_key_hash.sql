@@ -0,0 +1,41 @@
+-- ============================================================================
+-- API Keys: SHA-256 digest lookup
+-- ============================================================================
+-- db.get_user_by_api_key used to find keys by plaintext key_value (no index)
+-- and then load the user in a second query. Keys are now resolved by the
+-- hex SHA-256 digest of the key (db.hash_token) through a unique index, with
+-- the user embedded in the same request.
+--
+-- key_value stays: the console shows and copies existing keys. The trigger
+-- is what fills key_hash (the API inserts only key_value, so creating keys
+-- keeps working before this migration has run).
+--
+-- Run this in Supabase SQL Editor AFTER supabase_schema.sql. Safe to run
+-- more than once. If the unique index fails, two rows share a key_value;
+-- delete one of them and re-run.
+-- ============================================================================
+
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS key_hash TEXT;
+
+-- Backfill (sha256() is built into PostgreSQL 11+)
+UPDATE api_keys
+SET key_hash = encode(sha256(convert_to(key_value, 'UTF8')), 'hex')
+WHERE key_hash IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_api_keys_key_hash ON api_keys(key_hash);
+
+CREATE OR REPLACE FUNCTION set_api_key_hash()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.key_hash = encode(sha256(convert_to(NEW.key_value, 'UTF8')), 'hex');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS set_api_keys_key_hash ON api_keys;
+CREATE TRIGGER set_api_keys_key_hash
+    BEFORE INSERT OR UPDATE OF key_value ON api_keys
+    FOR EACH ROW
+    EXECUTE FUNCTION set_api_key_hash();
+
+COMMENT ON COLUMN api_keys.key_hash IS 'Hex SHA-256 of key_value; lookups go through this column';
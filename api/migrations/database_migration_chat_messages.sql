@@ -0,0 +1,82 @@
+-- ============================================================================
+-- Chat Messages: append-only storage
+-- ============================================================================
+-- Moves conversation history out of chat_sessions.metadata->'messages' into
+-- the chat_messages table. Appending a message becomes a single INSERT and
+-- history is read with an ordered, limited query on (session_id, seq).
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_chat.sql.
+-- Safe to run more than once.
+-- ============================================================================
+
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    session_id UUID NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+    role VARCHAR(50) NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
+    content TEXT NOT NULL,
+    tokens_used INTEGER,
+    model VARCHAR(100),
+    metadata JSONB DEFAULT '{}',
+    n8n_execution_id VARCHAR(255),
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Monotonic insertion order (created_at can tie within a turn)
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS seq BIGSERIAL;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_seq
+    ON chat_messages(session_id, seq DESC);
+
+-- ============================================================================
+-- Backfill from chat_sessions.metadata->'messages'
+-- (runs before the activity trigger exists so session timestamps are kept)
+-- ============================================================================
+
+INSERT INTO chat_messages (id, session_id, role, content, tokens_used, model, metadata, created_at)
+SELECT
+    COALESCE((m.msg->>'id')::uuid, uuid_generate_v4()),
+    s.id,
+    m.msg->>'role',
+    COALESCE(m.msg->>'content', ''),
+    (m.msg->>'tokens_used')::integer,
+    m.msg->>'model',
+    COALESCE(m.msg->'metadata', '{}'::jsonb),
+    COALESCE((m.msg->>'timestamp')::timestamptz, s.created_at)
+FROM chat_sessions s
+CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(s.metadata->'messages') = 'array'
+         THEN s.metadata->'messages' ELSE '[]'::jsonb END
+) WITH ORDINALITY AS m(msg, ord)
+WHERE m.msg->>'role' IN ('user', 'assistant', 'system')
+ORDER BY s.id, m.ord
+ON CONFLICT (id) DO NOTHING;
+
+-- Drop the migrated arrays so session rows stay small
+-- (without bumping updated_at, which tracks last activity)
+ALTER TABLE chat_sessions DISABLE TRIGGER update_chat_sessions_updated_at;
+
+UPDATE chat_sessions
+SET metadata = metadata - 'messages'
+WHERE metadata ? 'messages';
+
+ALTER TABLE chat_sessions ENABLE TRIGGER update_chat_sessions_updated_at;
+
+-- ============================================================================
+-- Keep chat_sessions.updated_at as "last activity"
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION touch_chat_session()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE chat_sessions SET updated_at = NOW() WHERE id = NEW.session_id;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS touch_chat_session_on_message ON chat_messages;
+CREATE TRIGGER touch_chat_session_on_message
+    AFTER INSERT ON chat_messages
+    FOR EACH ROW
+    EXECUTE FUNCTION touch_chat_session();
@@ -0,0 +1,81 @@
+-- ============================================================================
+-- Chat Sessions: single-statement upsert on session_key
+-- ============================================================================
+-- Lets the API get-or-create a widget session in one round trip and return
+-- only what the chat path needs (id, company_id, whether it was created).
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_chat.sql.
+-- Safe to run more than once.
+-- ============================================================================
+
+-- Columns the API writes that older chat_sessions variants lack
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS session_key VARCHAR(255);
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS company_id UUID REFERENCES companies(id) ON DELETE SET NULL;
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS closed_at TIMESTAMPTZ;
+
+-- ON CONFLICT target: the baseline UNIQUE constraint on session_key
+-- (database_migration_chat.sql). Only the older variant without it
+-- (database_migration_chat_sessions.sql) gets a unique index here; an earlier
+-- version of this file created that index unconditionally, so a duplicate of
+-- the constraint is dropped again. If creating it fails, duplicate
+-- session_key rows exist and must be merged first.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'chat_sessions'::regclass
+          AND i.indisunique
+          AND i.indnatts = 1
+          AND a.attname = 'session_key'
+          AND i.indexrelid IS DISTINCT FROM to_regclass('idx_chat_sessions_session_key_unique')
+    ) THEN
+        DROP INDEX IF EXISTS idx_chat_sessions_session_key_unique;
+    ELSE
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_sessions_session_key_unique
+            ON chat_sessions(session_key);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_company_id ON chat_sessions(company_id);
+
+-- ============================================================================
+-- upsert_chat_session
+-- ============================================================================
+-- Returns the session id and company_id; `inserted` is true for new sessions.
+-- Existing sessions keep their metadata; a missing company_id is filled in.
+-- Other existing sessions are only read, so a chat turn does not write a new
+-- row version (or fire the updated_at trigger) just to look its session up.
+
+CREATE OR REPLACE FUNCTION upsert_chat_session(
+    p_session_key TEXT,
+    p_widget_id TEXT DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_company_id UUID DEFAULT NULL,
+    p_metadata JSONB DEFAULT '{}'::jsonb
+)
+RETURNS TABLE (id UUID, company_id UUID, inserted BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    INSERT INTO chat_sessions AS s (session_key, widget_id, user_id, company_id, metadata, is_active)
+    VALUES (p_session_key, p_widget_id, p_user_id, p_company_id, COALESCE(p_metadata, '{}'::jsonb), true)
+    ON CONFLICT (session_key) DO UPDATE
+        SET company_id = EXCLUDED.company_id
+        WHERE s.company_id IS NULL AND EXCLUDED.company_id IS NOT NULL
+    RETURNING s.id, s.company_id, (s.xmax = 0);
+
+    IF NOT FOUND THEN
+        -- Existing session with nothing to fill in
+        RETURN QUERY
+        SELECT s.id, s.company_id, false
+        FROM chat_sessions s
+        WHERE s.session_key = p_session_key;
+    END IF;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION upsert_chat_session(TEXT, TEXT, UUID, UUID, JSONB) TO service_role;
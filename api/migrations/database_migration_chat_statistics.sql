@@ -0,0 +1,125 @@
+-- ============================================================================
+-- Chat Statistics: atomic per-day counters
+-- ============================================================================
+-- One row per (company_id, date), updated with a single
+-- INSERT ... ON CONFLICT DO UPDATE instead of select-then-update, so
+-- concurrent chat messages can no longer lose increments or create
+-- duplicate day rows. Response time is kept as sum + count so averages are
+-- exact; avg_response_time_ms is maintained for existing readers.
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_companies.sql.
+-- Safe to run more than once.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS chat_statistics (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    company_id UUID NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    total_messages INTEGER NOT NULL DEFAULT 0,
+    total_sessions INTEGER NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    avg_response_time_ms INTEGER,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+ALTER TABLE chat_statistics ADD COLUMN IF NOT EXISTS response_time_sum_ms BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE chat_statistics ADD COLUMN IF NOT EXISTS response_time_count INTEGER NOT NULL DEFAULT 0;
+
+-- Seed sum/count from the old running average (approximate: the average was
+-- taken over messages that reported a response time)
+UPDATE chat_statistics
+SET response_time_sum_ms = avg_response_time_ms::BIGINT * total_messages,
+    response_time_count = total_messages
+WHERE avg_response_time_ms IS NOT NULL
+  AND response_time_count = 0
+  AND total_messages > 0;
+
+-- ============================================================================
+-- Merge duplicate day rows created by the old race
+-- ============================================================================
+
+WITH totals AS (
+    SELECT company_id, date,
+           SUM(total_messages) AS total_messages,
+           SUM(total_sessions) AS total_sessions,
+           SUM(total_tokens) AS total_tokens,
+           SUM(response_time_sum_ms) AS response_time_sum_ms,
+           SUM(response_time_count) AS response_time_count
+    FROM chat_statistics
+    GROUP BY company_id, date
+    HAVING COUNT(*) > 1
+),
+keepers AS (
+    SELECT DISTINCT ON (company_id, date) id, company_id, date
+    FROM chat_statistics
+    ORDER BY company_id, date, created_at, id
+)
+UPDATE chat_statistics c
+SET total_messages = t.total_messages,
+    total_sessions = t.total_sessions,
+    total_tokens = t.total_tokens,
+    response_time_sum_ms = t.response_time_sum_ms,
+    response_time_count = t.response_time_count,
+    avg_response_time_ms = CASE WHEN t.response_time_count > 0
+                                THEN (t.response_time_sum_ms / t.response_time_count)::INTEGER
+                                ELSE c.avg_response_time_ms END,
+    updated_at = NOW()
+FROM totals t
+JOIN keepers k ON k.company_id = t.company_id AND k.date = t.date
+WHERE c.id = k.id;
+
+DELETE FROM chat_statistics c
+WHERE c.id NOT IN (
+    SELECT DISTINCT ON (company_id, date) id
+    FROM chat_statistics
+    ORDER BY company_id, date, created_at, id
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_statistics_company_date
+    ON chat_statistics(company_id, date);
+
+-- ============================================================================
+-- increment_chat_stats
+-- ============================================================================
+-- Adds deltas to a company's day row, creating it if needed.
+-- p_response_ms is one response time sample (NULL if none).
+
+CREATE OR REPLACE FUNCTION increment_chat_stats(
+    p_company_id UUID,
+    p_date DATE,
+    p_messages INTEGER DEFAULT 0,
+    p_sessions INTEGER DEFAULT 0,
+    p_tokens BIGINT DEFAULT 0,
+    p_response_ms BIGINT DEFAULT NULL
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO chat_statistics AS s (
+        company_id, date, total_messages, total_sessions, total_tokens,
+        response_time_sum_ms, response_time_count, avg_response_time_ms, updated_at
+    )
+    VALUES (
+        p_company_id, p_date, p_messages, p_sessions, p_tokens,
+        COALESCE(p_response_ms, 0),
+        CASE WHEN p_response_ms IS NULL THEN 0 ELSE 1 END,
+        p_response_ms,
+        NOW()
+    )
+    ON CONFLICT (company_id, date) DO UPDATE SET
+        total_messages = s.total_messages + EXCLUDED.total_messages,
+        total_sessions = s.total_sessions + EXCLUDED.total_sessions,
+        total_tokens = s.total_tokens + EXCLUDED.total_tokens,
+        response_time_sum_ms = s.response_time_sum_ms + EXCLUDED.response_time_sum_ms,
+        response_time_count = s.response_time_count + EXCLUDED.response_time_count,
+        avg_response_time_ms = CASE
+            WHEN s.response_time_count + EXCLUDED.response_time_count > 0
+            THEN ((s.response_time_sum_ms + EXCLUDED.response_time_sum_ms)
+                  / (s.response_time_count + EXCLUDED.response_time_count))::INTEGER
+            ELSE s.avg_response_time_ms
+        END,
+        updated_at = NOW();
+$$;
+
+GRANT EXECUTE ON FUNCTION increment_chat_stats(UUID, DATE, INTEGER, INTEGER, BIGINT, BIGINT) TO service_role;
@@ -0,0 +1,74 @@
+-- ============================================================================
+-- Chat Statistics: batched upserts and response time histograms
+-- ============================================================================
+-- The API aggregates statistics in memory and flushes them periodically as
+-- one batch. Response times are stored as a histogram (bucket upper bound
+-- in ms -> count) so percentiles can be estimated.
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_chat_statistics.sql.
+-- Safe to run more than once.
+-- ============================================================================
+
+ALTER TABLE chat_statistics ADD COLUMN IF NOT EXISTS response_time_histogram JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+-- Add two {bucket: count} objects key by key
+CREATE OR REPLACE FUNCTION jsonb_sum_counts(a JSONB, b JSONB)
+RETURNS JSONB
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT key, SUM(value::BIGINT) AS total
+        FROM (
+            SELECT * FROM jsonb_each_text(COALESCE(a, '{}'::jsonb))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(COALESCE(b, '{}'::jsonb))
+        ) counts
+        GROUP BY key
+    ) merged
+$$;
+
+-- ============================================================================
+-- increment_chat_stats_batch
+-- ============================================================================
+-- p_rows: [{company_id, date, messages, sessions, tokens,
+--           response_time_sum_ms, response_time_count, histogram}, ...]
+-- with at most one entry per (company_id, date).
+
+CREATE OR REPLACE FUNCTION increment_chat_stats_batch(p_rows JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO chat_statistics AS s (
+        company_id, date, total_messages, total_sessions, total_tokens,
+        response_time_sum_ms, response_time_count, response_time_histogram,
+        avg_response_time_ms, updated_at
+    )
+    SELECT r.company_id, r.date,
+           COALESCE(r.messages, 0), COALESCE(r.sessions, 0), COALESCE(r.tokens, 0),
+           COALESCE(r.response_time_sum_ms, 0), COALESCE(r.response_time_count, 0),
+           COALESCE(r.histogram, '{}'::jsonb),
+           CASE WHEN r.response_time_count > 0
+                THEN (r.response_time_sum_ms / r.response_time_count)::INTEGER END,
+           NOW()
+    FROM jsonb_to_recordset(p_rows) AS r(
+        company_id UUID, date DATE, messages INTEGER, sessions INTEGER, tokens BIGINT,
+        response_time_sum_ms BIGINT, response_time_count INTEGER, histogram JSONB
+    )
+    ON CONFLICT (company_id, date) DO UPDATE SET
+        total_messages = s.total_messages + EXCLUDED.total_messages,
+        total_sessions = s.total_sessions + EXCLUDED.total_sessions,
+        total_tokens = s.total_tokens + EXCLUDED.total_tokens,
+        response_time_sum_ms = s.response_time_sum_ms + EXCLUDED.response_time_sum_ms,
+        response_time_count = s.response_time_count + EXCLUDED.response_time_count,
+        response_time_histogram = jsonb_sum_counts(s.response_time_histogram, EXCLUDED.response_time_histogram),
+        avg_response_time_ms = CASE
+            WHEN s.response_time_count + EXCLUDED.response_time_count > 0
+            THEN ((s.response_time_sum_ms + EXCLUDED.response_time_sum_ms)
+                  / (s.response_time_count + EXCLUDED.response_time_count))::INTEGER
+            ELSE s.avg_response_time_ms
+        END,
+        updated_at = NOW();
+$$;
+
+GRANT EXECUTE ON FUNCTION increment_chat_stats_batch(JSONB) TO service_role;
@@ -0,0 +1,81 @@
+-- ============================================================================
+-- Chat Statistics: per-company summary in one grouped query
+-- ============================================================================
+-- Replaces one chat_statistics query per company in the admin overview.
+-- Aggregation, sorting and pagination all happen in the database.
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_chat_statistics.sql.
+-- Safe to run more than once.
+-- ============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_chat_statistics_date ON chat_statistics(date);
+
+-- p_sort: 'messages' | 'sessions' | 'tokens' | 'response_time' | 'name'
+-- total_count is the number of companies before pagination.
+CREATE OR REPLACE FUNCTION get_chat_stats_summary(
+    p_start_date DATE,
+    p_sort TEXT DEFAULT 'messages',
+    p_desc BOOLEAN DEFAULT TRUE,
+    p_limit INTEGER DEFAULT 50,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE (
+    company_id UUID,
+    company_name TEXT,
+    total_messages BIGINT,
+    total_sessions BIGINT,
+    total_tokens BIGINT,
+    avg_response_time_ms INTEGER,
+    total_count BIGINT
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH totals AS (
+        SELECT s.company_id AS cid,
+               SUM(s.total_messages) AS messages,
+               SUM(s.total_sessions) AS sessions,
+               SUM(s.total_tokens) AS tokens,
+               SUM(s.response_time_sum_ms) AS rt_sum,
+               SUM(s.response_time_count) AS rt_count
+        FROM chat_statistics s
+        WHERE s.date >= p_start_date
+        GROUP BY s.company_id
+    ),
+    summary AS (
+        SELECT c.id AS cid,
+               c.name::TEXT AS cname,
+               COALESCE(t.messages, 0)::BIGINT AS messages,
+               COALESCE(t.sessions, 0)::BIGINT AS sessions,
+               COALESCE(t.tokens, 0)::BIGINT AS tokens,
+               CASE WHEN t.rt_count > 0 THEN (t.rt_sum / t.rt_count)::INTEGER END AS avg_ms
+        FROM companies c
+        LEFT JOIN totals t ON t.cid = c.id
+    )
+    SELECT cid, cname, messages, sessions, tokens, avg_ms, COUNT(*) OVER ()
+    FROM summary
+    ORDER BY
+        CASE WHEN p_desc THEN
+            CASE p_sort
+                WHEN 'sessions' THEN sessions
+                WHEN 'tokens' THEN tokens
+                WHEN 'response_time' THEN avg_ms
+                WHEN 'name' THEN NULL
+                ELSE messages
+            END
+        END DESC NULLS LAST,
+        CASE WHEN NOT p_desc THEN
+            CASE p_sort
+                WHEN 'sessions' THEN sessions
+                WHEN 'tokens' THEN tokens
+                WHEN 'response_time' THEN avg_ms
+                WHEN 'name' THEN NULL
+                ELSE messages
+            END
+        END ASC NULLS LAST,
+        CASE WHEN p_sort = 'name' AND p_desc THEN cname END DESC,
+        cname ASC,
+        cid
+    LIMIT p_limit OFFSET p_offset;
+$$;
+
+GRANT EXECUTE ON FUNCTION get_chat_stats_summary(DATE, TEXT, BOOLEAN, INTEGER, INTEGER) TO service_role;
@@ -0,0 +1,63 @@
+-- ============================================================================
+-- Chat Statistics: throttled chat turns
+-- ============================================================================
+-- /api/chat/message and /api/chat/stream reject turns over the per-IP,
+-- per-session and per-company limits with 429 (chat_throttle.py). Rejections
+-- of a known company are counted per day in chat_statistics.
+--
+-- Re-creates increment_chat_stats_batch with a `throttled` field. Until this
+-- runs, the API keeps working and the counts are dropped.
+--
+-- Run this in Supabase SQL Editor AFTER
+-- database_migration_chat_statistics_batch.sql. Safe to run more than once.
+-- ============================================================================
+
+ALTER TABLE chat_statistics ADD COLUMN IF NOT EXISTS throttled_requests INTEGER NOT NULL DEFAULT 0;
+
+-- ============================================================================
+-- increment_chat_stats_batch
+-- ============================================================================
+-- p_rows: [{company_id, date, messages, sessions, tokens,
+--           response_time_sum_ms, response_time_count, histogram, throttled}, ...]
+-- with at most one entry per (company_id, date).
+
+CREATE OR REPLACE FUNCTION increment_chat_stats_batch(p_rows JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO chat_statistics AS s (
+        company_id, date, total_messages, total_sessions, total_tokens,
+        response_time_sum_ms, response_time_count, response_time_histogram,
+        avg_response_time_ms, throttled_requests, updated_at
+    )
+    SELECT r.company_id, r.date,
+           COALESCE(r.messages, 0), COALESCE(r.sessions, 0), COALESCE(r.tokens, 0),
+           COALESCE(r.response_time_sum_ms, 0), COALESCE(r.response_time_count, 0),
+           COALESCE(r.histogram, '{}'::jsonb),
+           CASE WHEN r.response_time_count > 0
+                THEN (r.response_time_sum_ms / r.response_time_count)::INTEGER END,
+           COALESCE(r.throttled, 0),
+           NOW()
+    FROM jsonb_to_recordset(p_rows) AS r(
+        company_id UUID, date DATE, messages INTEGER, sessions INTEGER, tokens BIGINT,
+        response_time_sum_ms BIGINT, response_time_count INTEGER, histogram JSONB,
+        throttled INTEGER
+    )
+    ON CONFLICT (company_id, date) DO UPDATE SET
+        total_messages = s.total_messages + EXCLUDED.total_messages,
+        total_sessions = s.total_sessions + EXCLUDED.total_sessions,
+        total_tokens = s.total_tokens + EXCLUDED.total_tokens,
+        response_time_sum_ms = s.response_time_sum_ms + EXCLUDED.response_time_sum_ms,
+        response_time_count = s.response_time_count + EXCLUDED.response_time_count,
+        response_time_histogram = jsonb_sum_counts(s.response_time_histogram, EXCLUDED.response_time_histogram),
+        avg_response_time_ms = CASE
+            WHEN s.response_time_count + EXCLUDED.response_time_count > 0
+            THEN ((s.response_time_sum_ms + EXCLUDED.response_time_sum_ms)
+                  / (s.response_time_count + EXCLUDED.response_time_count))::INTEGER
+            ELSE s.avg_response_time_ms
+        END,
+        throttled_requests = s.throttled_requests + EXCLUDED.throttled_requests,
+        updated_at = NOW();
+$$;
+
+GRANT EXECUTE ON FUNCTION increment_chat_stats_batch(JSONB) TO service_role;
@@ -0,0 +1,175 @@
+-- ============================================================================
+-- Full-text search for company knowledge and seminar Q&A
+-- ============================================================================
+-- Adds generated tsvector columns (German stemming + 'simple' for names,
+-- product terms and English words) with GIN indexes, ranked search RPCs used
+-- by the admin knowledge API and the chat bot, and knowledge_stats.
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_knowledge.sql,
+-- enhance_knowledge_schema.sql and database_migration_seminar_qa.sql.
+-- Safe to run more than once. Requires PostgreSQL 12+ (generated columns).
+-- ============================================================================
+
+-- array_to_string is only STABLE; generated columns need an IMMUTABLE expression
+CREATE OR REPLACE FUNCTION immutable_array_to_string(arr TEXT[], sep TEXT)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$ SELECT array_to_string(arr, sep) $$;
+
+-- ============================================================================
+-- company_knowledge_base
+-- ============================================================================
+
+ALTER TABLE company_knowledge_base ADD COLUMN IF NOT EXISTS fts_de tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('german', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('german', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('german', coalesce(content, '')), 'C')
+    ) STORED;
+
+ALTER TABLE company_knowledge_base ADD COLUMN IF NOT EXISTS fts_simple tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(content, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_fts_de ON company_knowledge_base USING GIN(fts_de);
+CREATE INDEX IF NOT EXISTS idx_knowledge_fts_simple ON company_knowledge_base USING GIN(fts_simple);
+
+-- ============================================================================
+-- seminar_qa
+-- ============================================================================
+
+ALTER TABLE seminar_qa ADD COLUMN IF NOT EXISTS fts_de tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('german', coalesce(seminar_name, '')), 'A') ||
+        setweight(to_tsvector('german', immutable_array_to_string(keywords, ' ')), 'A') ||
+        setweight(to_tsvector('german', coalesce(question, '')), 'B') ||
+        setweight(to_tsvector('german', coalesce(answer, '')), 'C')
+    ) STORED;
+
+ALTER TABLE seminar_qa ADD COLUMN IF NOT EXISTS fts_simple tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(seminar_name, '')), 'A') ||
+        setweight(to_tsvector('simple', immutable_array_to_string(keywords, ' ')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(question, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_seminar_qa_fts_de ON seminar_qa USING GIN(fts_de);
+CREATE INDEX IF NOT EXISTS idx_seminar_qa_fts_simple ON seminar_qa USING GIN(fts_simple);
+
+-- ============================================================================
+-- any_words_tsquery: natural-language question -> OR query
+-- ============================================================================
+-- plainto_tsquery ANDs all words, which a chat question ("Welche Seminare
+-- bieten Sie zum Thema Führung an?") almost never satisfies. Ranking sorts
+-- out documents matching more words.
+
+CREATE OR REPLACE FUNCTION any_words_tsquery(p_config REGCONFIG, p_query TEXT)
+RETURNS tsquery
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT NULLIF(replace(plainto_tsquery(p_config, coalesce(p_query, ''))::text, ' & ', ' | '), '')::tsquery
+$$;
+
+-- ============================================================================
+-- search_knowledge
+-- ============================================================================
+-- Ranked active entries of one company. `content` is the full entry text
+-- (what the chat bot injects); `snippet` is a plain-text excerpt around the
+-- matching words for the admin knowledge list.
+
+-- The result columns changed (content added); CREATE OR REPLACE cannot do that
+DROP FUNCTION IF EXISTS search_knowledge(UUID, TEXT, INT);
+
+CREATE OR REPLACE FUNCTION search_knowledge(
+    p_company_id UUID,
+    p_query TEXT,
+    p_limit INT DEFAULT 5
+)
+RETURNS TABLE (id UUID, title TEXT, category TEXT, content TEXT, snippet TEXT, rank REAL)
+LANGUAGE plpgsql STABLE
+AS $$
+#variable_conflict use_column
+DECLARE
+    q_de tsquery := any_words_tsquery('german', p_query);
+    q_simple tsquery := any_words_tsquery('simple', p_query);
+BEGIN
+    IF q_de IS NULL AND q_simple IS NULL THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH ranked AS (
+        SELECT k.id, k.title, k.category, k.content,
+               (coalesce(ts_rank_cd(k.fts_de, q_de), 0)
+                + 0.5 * coalesce(ts_rank_cd(k.fts_simple, q_simple), 0))::REAL AS rank
+        FROM company_knowledge_base k
+        WHERE k.company_id = p_company_id
+          AND k.is_active
+          AND (k.fts_de @@ q_de OR k.fts_simple @@ q_simple)
+        ORDER BY rank DESC
+        LIMIT p_limit
+    )
+    -- Snippets only for the returned rows (ts_headline re-parses the text)
+    SELECT r.id, r.title, r.category, r.content,
+           ts_headline('german', coalesce(r.content, ''), coalesce(q_de, q_simple),
+                       'StartSel="", StopSel="", MaxWords=60, MinWords=20, MaxFragments=3, FragmentDelimiter=" ... "'),
+           r.rank
+    FROM ranked r
+    ORDER BY r.rank DESC;
+END;
+$$;
+
+-- ============================================================================
+-- knowledge_stats
+-- ============================================================================
+-- Size and change marker of a company's active knowledge, so the chat bot can
+-- decide between injecting everything and ranking without downloading it.
+
+CREATE OR REPLACE FUNCTION knowledge_stats(p_company_id UUID)
+RETURNS TABLE (entries INT, total_chars BIGINT, updated_at TIMESTAMPTZ)
+LANGUAGE sql STABLE
+AS $$
+    SELECT count(*)::INT,
+           coalesce(sum(length(coalesce(k.content, ''))), 0)::BIGINT,
+           max(k.updated_at)
+    FROM company_knowledge_base k
+    WHERE k.company_id = p_company_id
+      AND k.is_active;
+$$;
+
+-- ============================================================================
+-- search_seminar_qa
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION search_seminar_qa(
+    p_query TEXT,
+    p_limit INT DEFAULT 3
+)
+RETURNS TABLE (id UUID, seminar_name TEXT, question TEXT, answer TEXT, rank REAL)
+LANGUAGE plpgsql STABLE
+AS $$
+#variable_conflict use_column
+DECLARE
+    q_de tsquery := any_words_tsquery('german', p_query);
+    q_simple tsquery := any_words_tsquery('simple', p_query);
+BEGIN
+    IF q_de IS NULL AND q_simple IS NULL THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT s.id, s.seminar_name, s.question, s.answer,
+           (coalesce(ts_rank_cd(s.fts_de, q_de), 0)
+            + 0.5 * coalesce(ts_rank_cd(s.fts_simple, q_simple), 0))::REAL AS rank
+    FROM seminar_qa s
+    WHERE s.fts_de @@ q_de OR s.fts_simple @@ q_simple
+    ORDER BY rank DESC
+    LIMIT p_limit;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION search_knowledge(UUID, TEXT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION search_seminar_qa(TEXT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION knowledge_stats(UUID) TO service_role;
@@ -0,0 +1,25 @@
+-- ============================================================================
+-- Seminar Q&A: keep updated_at current
+-- ============================================================================
+-- The API's seminar matcher detects table changes from the row count and the
+-- newest updated_at, so updates must bump updated_at.
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_seminar_qa.sql.
+-- Safe to run more than once.
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_seminar_qa_updated_at ON seminar_qa;
+CREATE TRIGGER update_seminar_qa_updated_at
+    BEFORE UPDATE ON seminar_qa
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_seminar_qa_updated_at ON seminar_qa(updated_at DESC);
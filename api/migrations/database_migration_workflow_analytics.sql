@@ -0,0 +1,143 @@
+-- ============================================================================
+-- Workflow Analytics: server-side execution aggregates
+-- ============================================================================
+-- The analytics helpers used to load up to 10k workflow_executions rows and
+-- filter/count them in Python, silently truncating everything beyond that.
+-- These RPCs apply the date range and scope in the query and return only
+-- aggregates.
+--
+-- Scope: p_company_id filters on workflow_activations.company_id; otherwise
+-- p_user_id filters on workflow_activations.user_id; both NULL = all.
+-- "failed" counts status 'error' (and legacy 'failed').
+--
+-- Run this in Supabase SQL Editor AFTER database_migration_workflows.sql and
+-- database_migration_companies.sql. Safe to run more than once.
+-- ============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_workflow_executions_started_at
+    ON workflow_executions(started_at);
+CREATE INDEX IF NOT EXISTS idx_workflow_executions_activation_started
+    ON workflow_executions(workflow_activation_id, started_at);
+
+-- ============================================================================
+-- get_execution_stats
+-- ============================================================================
+-- Totals for one scope; p_workflow_id narrows to a single workflow.
+
+CREATE OR REPLACE FUNCTION get_execution_stats(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_company_id UUID DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_workflow_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    total BIGINT,
+    successful BIGINT,
+    failed BIGINT,
+    avg_duration_ms NUMERIC,
+    min_duration_ms INTEGER,
+    max_duration_ms INTEGER,
+    last_started_at TIMESTAMPTZ
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT COUNT(*),
+           COUNT(*) FILTER (WHERE e.status = 'success'),
+           COUNT(*) FILTER (WHERE e.status IN ('error', 'failed')),
+           ROUND(AVG(e.duration_ms) FILTER (WHERE e.duration_ms > 0)),
+           MIN(e.duration_ms) FILTER (WHERE e.duration_ms > 0),
+           MAX(e.duration_ms) FILTER (WHERE e.duration_ms > 0),
+           MAX(e.started_at)
+    FROM workflow_executions e
+    JOIN workflow_activations a ON a.id = e.workflow_activation_id
+    WHERE e.started_at >= p_start
+      AND e.started_at <= p_end
+      AND (p_workflow_id IS NULL OR a.workflow_id = p_workflow_id)
+      AND CASE
+            WHEN p_company_id IS NOT NULL THEN a.company_id = p_company_id
+            WHEN p_user_id IS NOT NULL THEN a.user_id = p_user_id
+            ELSE TRUE
+          END;
+$$;
+
+-- ============================================================================
+-- get_execution_timeline
+-- ============================================================================
+-- One row per UTC day in [p_start, p_end], days without executions included.
+
+CREATE OR REPLACE FUNCTION get_execution_timeline(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_company_id UUID DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL
+)
+RETURNS TABLE (day DATE, success BIGINT, failed BIGINT, total BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    WITH counts AS (
+        SELECT date_trunc('day', e.started_at AT TIME ZONE 'UTC')::DATE AS day,
+               COUNT(*) FILTER (WHERE e.status = 'success') AS success,
+               COUNT(*) FILTER (WHERE e.status IN ('error', 'failed')) AS failed,
+               COUNT(*) AS total
+        FROM workflow_executions e
+        JOIN workflow_activations a ON a.id = e.workflow_activation_id
+        WHERE e.started_at >= p_start
+          AND e.started_at <= p_end
+          AND CASE
+                WHEN p_company_id IS NOT NULL THEN a.company_id = p_company_id
+                WHEN p_user_id IS NOT NULL THEN a.user_id = p_user_id
+                ELSE TRUE
+              END
+        GROUP BY 1
+    )
+    SELECT d::DATE,
+           COALESCE(c.success, 0),
+           COALESCE(c.failed, 0),
+           COALESCE(c.total, 0)
+    FROM generate_series(
+        (p_start AT TIME ZONE 'UTC')::DATE,
+        (p_end AT TIME ZONE 'UTC')::DATE,
+        INTERVAL '1 day'
+    ) AS d
+    LEFT JOIN counts c ON c.day = d::DATE
+    ORDER BY 1;
+$$;
+
+-- ============================================================================
+-- get_top_workflows
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION get_top_workflows(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_company_id UUID DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE (workflow_id UUID, workflow_name TEXT, total BIGINT, success BIGINT, failed BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT w.id,
+           w.name::TEXT,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE e.status = 'success'),
+           COUNT(*) FILTER (WHERE e.status IN ('error', 'failed'))
+    FROM workflow_executions e
+    JOIN workflow_activations a ON a.id = e.workflow_activation_id
+    JOIN workflows w ON w.id = a.workflow_id
+    WHERE e.started_at >= p_start
+      AND e.started_at <= p_end
+      AND CASE
+            WHEN p_company_id IS NOT NULL THEN a.company_id = p_company_id
+            WHEN p_user_id IS NOT NULL THEN a.user_id = p_user_id
+            ELSE TRUE
+          END
+    GROUP BY w.id, w.name
+    ORDER BY 3 DESC, w.name
+    LIMIT p_limit;
+$$;
+
+GRANT EXECUTE ON FUNCTION get_execution_stats(TIMESTAMPTZ, TIMESTAMPTZ, UUID, UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION get_execution_timeline(TIMESTAMPTZ, TIMESTAMPTZ, UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION get_top_workflows(TIMESTAMPTZ, TIMESTAMPTZ, UUID, UUID, INTEGER) TO service_role;
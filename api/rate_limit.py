@@ -0,0 +1,480 @@
+"""
+Rate Limiting - sliding-window counters and GCRA token buckets
+
+Every limit keeps O(1) state per key in a pluggable store:
+
+    memory   per-process LRU; idle keys expire, and the least recently used
+             keys are evicted beyond RATE_LIMIT_MAX_KEYS
+    sqlite   a SQLite file shared by the processes of one machine
+    redis    any server speaking the Redis protocol (Redis, Valkey, KeyDB, a
+             local stand-in); the only backend shared across serverless instances
+
+Two algorithms are offered:
+
+    hit()/count()  sliding-window counter: the current and previous fixed
+                   windows, the previous one weighted by how much of it still
+                   overlaps the sliding window (used for auth attempt limits)
+    acquire()      GCRA token bucket: `burst` requests at once, refilled at
+                   `rate` per second; stores one timestamp per key
+
+If the shared store is unreachable, the limiter falls back to a per-process
+memory store for that call instead of failing requests.
+
+Environment:
+    RATE_LIMIT_STORAGE   memory (default) | sqlite:///relative.db | sqlite:////abs/path.db |
+                         redis://[:password@]host:6379/0
+    RATE_LIMIT_MAX_KEYS  keys kept by the memory store (default 10000)
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Tuple, List, Any
+from urllib.parse import urlparse, unquote
+
+RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000'))
+
+
+def _gcra(tat: Optional[float], now: float, emission: float, burst: int,
+          cost: int) -> Tuple[bool, float, float]:
+    """
+    One GCRA step.
+
+    Returns:
+        (allowed, retry_after seconds, new theoretical arrival time)
+    """
+    tat = max(tat or now, now)
+    new_tat = tat + emission * cost
+    allow_at = new_tat - emission * burst
+    if allow_at > now:
+        return False, allow_at - now, tat
+    return True, 0.0, new_tat
+
+
+# ============================================
+# STORES
+# ============================================
+
+class MemoryStore:
+    """Per-process store: LRU over keys with per-key expiry"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data: OrderedDict = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _get(self, key: str, now: float) -> Optional[float]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def _put(self, key: str, value: float, expires_at: float):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        now = time.time()
+        with self._lock:
+            value = (self._get(key, now) or 0) + amount
+            self._put(key, value, now + ttl)
+            return value
+
+    def get(self, key: str) -> Optional[float]:
+        with self._lock:
+            return self._get(key, time.time())
+
+    def set(self, key: str, value: float, ttl: float):
+        with self._lock:
+            self._put(key, value, time.time() + ttl)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def gcra(self, key: str, now: float, emission: float, burst: int, cost: int) -> Tuple[bool, float]:
+        with self._lock:
+            allowed, retry_after, tat = _gcra(self._get(key, now), now, emission, burst, cost)
+            if allowed:
+                self._put(key, tat, tat)
+            return allowed, retry_after
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Store in a SQLite file (one connection per thread, WAL mode)"""
+
+    PURGE_EVERY = 1000  # writes between deletions of expired rows
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._transaction() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limits ('
+                'key TEXT PRIMARY KEY, value REAL NOT NULL, expires_at REAL NOT NULL)'
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front so read-modify-write is atomic
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _get(self, conn, key: str, now: float) -> Optional[float]:
+        row = conn.execute('SELECT value, expires_at FROM rate_limits WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row[0]
+
+    def _put(self, conn, key: str, value: float, expires_at: float):
+        conn.execute('INSERT OR REPLACE INTO rate_limits (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, value, expires_at))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (time.time(),))
+
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        now = time.time()
+        with self._transaction() as conn:
+            value = (self._get(conn, key, now) or 0) + amount
+            self._put(conn, key, value, now + ttl)
+            return value
+
+    def get(self, key: str) -> Optional[float]:
+        return self._get(self._conn(), key, time.time())
+
+    def set(self, key: str, value: float, ttl: float):
+        with self._transaction() as conn:
+            self._put(conn, key, value, time.time() + ttl)
+
+    def delete(self, *keys: str):
+        with self._transaction() as conn:
+            conn.executemany('DELETE FROM rate_limits WHERE key = ?', [(k,) for k in keys])
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM rate_limits')
+
+    def gcra(self, key: str, now: float, emission: float, burst: int, cost: int) -> Tuple[bool, float]:
+        with self._transaction() as conn:
+            allowed, retry_after, tat = _gcra(self._get(conn, key, now), now, emission, burst, cost)
+            if allowed:
+                self._put(conn, key, tat, tat)
+            return allowed, retry_after
+
+
+class RedisError(Exception):
+    """Error reply or protocol failure from the Redis server"""
+
+
+class RedisStore:
+    """Store on a Redis-protocol server, spoken directly over RESP (no client library)"""
+
+    PREFIX = 'ratelimit:'
+
+    # KEYS[1]; ARGV: now, emission, burst, cost. Returns {allowed, retry_after}
+    GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local emission = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + emission * cost
+local allow_at = new_tat - emission * burst
+if allow_at > now then
+    return {0, tostring(allow_at - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.max(1, math.ceil((new_tat - now) * 1000)))
+return {1, '0'}
+"""
+
+    def __init__(self, url: str, timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    # --- protocol ---
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._buffer = b''
+        if self.password:
+            args = ['AUTH', self.username, self.password] if self.username else ['AUTH', self.password]
+            self._send(args)
+            self._read()
+        if self.db:
+            self._send(['SELECT', self.db])
+            self._read()
+
+    def _send(self, *commands: List[Any]):
+        out = []
+        for args in commands:
+            out.append(b'*%d\r\n' % len(args))
+            for arg in args:
+                data = arg if isinstance(arg, bytes) else str(arg).encode()
+                out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._sock.sendall(b''.join(out))
+
+    def _readline(self) -> bytes:
+        while b'\r\n' not in self._buffer:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Connection closed by server')
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\r\n', 1)
+        return line
+
+    def _readexact(self, n: int) -> bytes:
+        while len(self._buffer) < n + 2:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Connection closed by server')
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:n], self._buffer[n + 2:]
+        return data
+
+    def _read(self) -> Any:
+        line = self._readline()
+        kind, rest = line[:1], line[1:]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            return None if length < 0 else self._readexact(length).decode()
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RedisError(f'Unexpected reply: {line[:50]!r}')
+
+    def execute(self, *commands: List[Any]) -> List[Any]:
+        """Send commands in one pipeline and return their replies"""
+        with self._lock:
+            try:
+                return self._execute(commands)
+            except ConnectionError:
+                # Stale connection (server restart, idle timeout): reconnect once
+                self._close()
+                try:
+                    return self._execute(commands)
+                except Exception:
+                    self._close()
+                    raise
+            except Exception:
+                # Timeouts and protocol errors leave the connection out of sync
+                self._close()
+                raise
+
+    def _execute(self, commands) -> List[Any]:
+        if self._sock is None:
+            self._connect()
+        self._send(*commands)
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(self._read())
+            except RedisError as e:
+                # An error reply; keep reading the pipeline's other replies
+                error = error or e
+        if error:
+            raise error
+        return replies
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+    # --- store interface ---
+
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        key = self.PREFIX + key
+        value, _ = self.execute(['INCRBYFLOAT', key, amount], ['PEXPIRE', key, int(ttl * 1000)])
+        return float(value)
+
+    def get(self, key: str) -> Optional[float]:
+        value, = self.execute(['GET', self.PREFIX + key])
+        return float(value) if value is not None else None
+
+    def set(self, key: str, value: float, ttl: float):
+        self.execute(['SET', self.PREFIX + key, value, 'PX', max(1, int(ttl * 1000))])
+
+    def delete(self, *keys: str):
+        if keys:
+            self.execute(['DEL'] + [self.PREFIX + k for k in keys])
+
+    def clear(self):
+        cursor = '0'
+        while True:
+            (cursor, keys), = self.execute(['SCAN', cursor, 'MATCH', self.PREFIX + '*', 'COUNT', 500])
+            if keys:
+                self.execute(['DEL'] + keys)
+            if cursor == '0':
+                return
+
+    def gcra(self, key: str, now: float, emission: float, burst: int, cost: int) -> Tuple[bool, float]:
+        (allowed, retry_after), = self.execute(
+            ['EVAL', self.GCRA_SCRIPT, 1, self.PREFIX + key, repr(now), repr(emission), burst, cost]
+        )
+        return bool(allowed), float(retry_after)
+
+
+def create_store(url: str = RATE_LIMIT_STORAGE, max_keys: int = RATE_LIMIT_MAX_KEYS):
+    """Build a store from a RATE_LIMIT_STORAGE value"""
+    if not url or url == 'memory':
+        return MemoryStore(max_keys)
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        if url.startswith('rediss://'):
+            print("Warning: TLS is not supported by the rate limit store, use redis://")
+        return RedisStore(url)
+    print(f"Warning: unknown RATE_LIMIT_STORAGE '{url}', using memory")
+    return MemoryStore(max_keys)
+
+
+# ============================================
+# LIMITER
+# ============================================
+
+class RateLimiter:
+    """Rate limits over a store, falling back to process memory when the store fails"""
+
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self._fallback = self.store if isinstance(self.store, MemoryStore) else MemoryStore()
+
+    def _call(self, method: str, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            if self.store is self._fallback:
+                raise
+            print(f"Rate limit store error ({method}), using process memory: {e}")
+            return getattr(self._fallback, method)(*args)
+
+    @staticmethod
+    def _window_keys(key: str, window: float, now: float) -> Tuple[str, str, float]:
+        index = int(now // window)
+        elapsed = (now % window) / window
+        return f"{key}:w{int(window)}:{index}", f"{key}:w{int(window)}:{index - 1}", elapsed
+
+    def hit(self, key: str, window: float, amount: float = 1) -> float:
+        """Record `amount` events; returns the sliding-window count including them"""
+        current, previous, elapsed = self._window_keys(key, window, time.time())
+        count = self._call('incr', current, amount, window * 2)
+        return count + (self._call('get', previous) or 0) * (1 - elapsed)
+
+    def count(self, key: str, window: float) -> float:
+        """Sliding-window count of events in the last `window` seconds"""
+        current, previous, elapsed = self._window_keys(key, window, time.time())
+        return (self._call('get', current) or 0) + (self._call('get', previous) or 0) * (1 - elapsed)
+
+    def acquire(self, key: str, rate: float, burst: int, cost: int = 1) -> Tuple[bool, float]:
+        """
+        Take `cost` tokens from a GCRA bucket of `burst` tokens refilled at
+        `rate` tokens per second.
+
+        Returns:
+            (allowed, retry_after seconds)
+        """
+        if rate <= 0 or burst <= 0:
+            return False, 0.0
+        return self._call('gcra', f"{key}:gcra", time.time(), 1.0 / rate, int(burst), int(cost))
+
+    def lock(self, key: str, seconds: float):
+        """Block `key` for `seconds` (see locked_for)"""
+        self._call('set', f"{key}:lock", time.time() + seconds, seconds)
+
+    def locked_for(self, key: str) -> float:
+        """Seconds until a lock on `key` ends (0 if not locked)"""
+        until = self._call('get', f"{key}:lock")
+        return max(0.0, until - time.time()) if until else 0.0
+
+    def reset(self, key: str = None, window: float = None):
+        """Forget a key's lock, bucket and (given its window) counters; everything if no key"""
+        if key is None:
+            self._call('clear')
+            if self._fallback is not self.store:
+                self._fallback.clear()
+            return
+        keys = [f"{key}:lock", f"{key}:gcra"]
+        if window:
+            current, previous, _ = self._window_keys(key, window, time.time())
+            keys += [current, previous]
+        self._call('delete', *keys)
+
+
+# Global instances by name
+_limiters = {}
+_limiter_lock = threading.Lock()
+
+
+def get_limiter(name: str = 'default', max_keys: int = RATE_LIMIT_MAX_KEYS) -> RateLimiter:
+    """
+    Get a process-wide limiter on RATE_LIMIT_STORAGE.
+
+    Each name has its own store, so with the memory backend a flood of keys
+    under one name (e.g. spoofed chat clients) cannot evict another's (login
+    lockouts). max_keys sizes the memory store when it is first created.
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiter_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                try:
+                    store = create_store(RATE_LIMIT_STORAGE, max_keys)
+                except Exception as e:
+                    print(f"Error opening rate limit store '{RATE_LIMIT_STORAGE}', using memory: {e}")
+                    store = MemoryStore(max_keys)
+                limiter = _limiters[name] = RateLimiter(store)
+    return limiter
@@ -0,0 +1,91 @@
+"""
+Request Cache - identity map for rows loaded during one request
+
+Repeated lookups of the same user, company or workflow within a single
+request (auth decorators, route handler, helpers) are served from memory
+instead of going back to Supabase. The map lives on `flask.g`, so it is
+discarded at the end of every request and never serves data across
+requests. Outside a request context every lookup goes to the loader.
+
+Writes through db.py call invalidate() so a refresh after an update in the
+same request sees the new row.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from flask import g, has_request_context
+
+_MISSING = object()
+
+
+def _identity_map() -> Optional[Dict[tuple, Any]]:
+    if not has_request_context():
+        return None
+    identity_map = g.get('_identity_map')
+    if identity_map is None:
+        identity_map = g._identity_map = {}
+    return identity_map
+
+
+def get_or_load(kind: str, key: Any, loader: Callable[[], Any]) -> Any:
+    """
+    Return the cached row for (kind, key), loading it once per request.
+
+    Args:
+        kind: Row type, e.g. 'users'
+        key: Primary key
+        loader: Called on a miss; its result (including None) is remembered
+    """
+    identity_map = _identity_map()
+    if identity_map is None or key is None:
+        return loader()
+    value = identity_map.get((kind, key), _MISSING)
+    if value is _MISSING:
+        value = loader()
+        identity_map[(kind, key)] = value
+    return value
+
+
+def get_many(kind: str, keys: Iterable[Any], bulk_loader: Callable[[List[Any]], Dict[Any, Any]]) -> Dict[Any, Any]:
+    """
+    Return {key: row} for keys, loading only the ones not seen in this request.
+
+    Args:
+        kind: Row type, e.g. 'workflows'
+        keys: Primary keys (duplicates and None are ignored)
+        bulk_loader: Called with the missing keys, returns {key: row}
+    """
+    wanted = list(dict.fromkeys(k for k in keys if k is not None))
+    identity_map = _identity_map()
+    if identity_map is None:
+        return bulk_loader(wanted) if wanted else {}
+
+    found = {}
+    missing = []
+    for key in wanted:
+        value = identity_map.get((kind, key), _MISSING)
+        if value is _MISSING:
+            missing.append(key)
+        elif value is not None:
+            found[key] = value
+
+    if missing:
+        loaded = bulk_loader(missing)
+        for key in missing:
+            value = loaded.get(key)
+            identity_map[(kind, key)] = value
+            if value is not None:
+                found[key] = value
+    return found
+
+
+def invalidate(kind: str, key: Any = None):
+    """Forget one row, or every row of a kind when key is None"""
+    identity_map = _identity_map()
+    if not identity_map:
+        return
+    if key is not None:
+        identity_map.pop((kind, key), None)
+        return
+    for cached_key in [k for k in identity_map if k[0] == kind]:
+        del identity_map[cached_key]
@@ -0,0 +1,140 @@
+"""
+Analytics Rollups - incremental refresh of the hourly/daily rollup tables
+
+Workflow execution and chat activity analytics are served from rollup
+tables (see migrations/database_migration_analytics_rollups.sql). The
+refresh_analytics_rollups RPC recomputes only the hours that received rows
+since the persisted watermark; this module runs it periodically with
+APScheduler in long-running processes. Readers fall back to raw rows after
+the watermark, so a missed or disabled refresh makes analytics slower, never
+wrong.
+
+Serverless:
+    The scheduler is off by default on Vercel (instances are frozen between
+    requests). There the Vercel cron in vercel.json calls
+    GET /api/cron/rollups every 5 minutes (authorized by CRON_SECRET, which
+    Vercel sends as a bearer token). Without it the watermark never moves
+    and readers scan ever more raw rows. Any other scheduler can call the
+    same route or run `python maintenance/backfill_rollups.py --refresh`.
+
+Environment:
+    ROLLUP_SCHEDULER         1/0 to force the scheduler on/off (default: on outside Vercel)
+    ROLLUP_REFRESH_INTERVAL  seconds between refreshes (default 300)
+    ROLLUP_SETTLE_SECONDS    rows younger than this wait for the next refresh (default 120)
+    CRON_SECRET              bearer token accepted by /api/cron/rollups besides an admin session
+"""
+
+import os
+import hmac
+import time
+import atexit
+import threading
+from typing import Optional, Dict, Any
+import db
+
+ROLLUP_SCHEDULER = os.getenv('ROLLUP_SCHEDULER', '0' if os.getenv('VERCEL') else '1').lower() in ('1', 'true', 'yes')
+ROLLUP_REFRESH_INTERVAL = int(os.getenv('ROLLUP_REFRESH_INTERVAL', '300'))  # seconds
+ROLLUP_SETTLE_SECONDS = int(os.getenv('ROLLUP_SETTLE_SECONDS', '120'))  # seconds
+CRON_SECRET = os.getenv('CRON_SECRET', '')
+
+_scheduler = None
+_interval: Optional[int] = None
+_scheduler_lock = threading.Lock()
+_status: Dict[str, Any] = {
+    'runs': 0,
+    'failures': 0,
+    'last_run_at': None,
+    'last_duration_ms': None,
+    'last_result': None,
+    'last_error': None
+}
+
+
+def cron_authorized(authorization: Optional[str]) -> bool:
+    """True if the Authorization header carries CRON_SECRET"""
+    if not CRON_SECRET or not authorization:
+        return False
+    return hmac.compare_digest(authorization, f'Bearer {CRON_SECRET}')
+
+
+def refresh_rollups(settle_seconds: int = ROLLUP_SETTLE_SECONDS) -> Optional[Dict[str, Any]]:
+    """
+    Run one incremental refresh.
+
+    Returns:
+        RPC result ({hours, processed_from, processed_until} or {skipped}),
+        None on error
+    """
+    start = time.time()
+    _status['last_run_at'] = start
+    _status['runs'] += 1
+    try:
+        db_client = db.get_db()
+        if not db_client:
+            raise RuntimeError('Database not available')
+        result = db_client.rpc('refresh_analytics_rollups', {'p_settle_seconds': settle_seconds}).execute()
+        _status['last_result'] = result.data
+        _status['last_error'] = None
+        return result.data
+    except Exception as e:
+        _status['failures'] += 1
+        _status['last_error'] = str(e)
+        print(f"Error refreshing analytics rollups: {e}")
+        return None
+    finally:
+        _status['last_duration_ms'] = int((time.time() - start) * 1000)
+
+
+def start_scheduler(interval: int = ROLLUP_REFRESH_INTERVAL) -> bool:
+    """
+    Start the periodic refresh job (once per process).
+
+    Returns:
+        True if a scheduler is running
+    """
+    global _scheduler, _interval
+    with _scheduler_lock:
+        if _scheduler is not None:
+            return True
+        try:
+            from apscheduler.schedulers.background import BackgroundScheduler
+        except ImportError:
+            print("APScheduler not installed - analytics rollups are not refreshed")
+            return False
+
+        scheduler = BackgroundScheduler(daemon=True)
+        # Several processes may run this job; the RPC takes an advisory lock
+        scheduler.add_job(refresh_rollups, 'interval', seconds=interval,
+                          id='refresh_analytics_rollups', max_instances=1,
+                          coalesce=True)
+        scheduler.start()
+        atexit.register(stop_scheduler)
+        _scheduler = scheduler
+        _interval = interval
+        print(f"Analytics rollup refresh scheduled every {interval}s")
+        return True
+
+
+def stop_scheduler():
+    """Shut the scheduler down without waiting for a running refresh"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.shutdown(wait=False)
+            _scheduler = None
+
+
+def init_scheduler() -> bool:
+    """Start the scheduler if ROLLUP_SCHEDULER allows it"""
+    if not ROLLUP_SCHEDULER or not db.is_db_configured():
+        return False
+    return start_scheduler()
+
+
+def get_rollup_status() -> Dict[str, Any]:
+    """Scheduler state and outcome of the last refresh in this process"""
+    return {
+        'scheduler': _scheduler is not None,
+        'interval_seconds': _interval,
+        **_status
+    }
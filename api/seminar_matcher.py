@@ -0,0 +1,197 @@
+"""
+Seminar Matcher - compiled keyword automaton for seminar Q&A lookups
+
+All seminar names and keywords from `seminar_qa` are compiled into one
+Aho-Corasick automaton, so matching a chat message is a single pass over the
+message instead of a substring check per row and keyword. Scoring is the same
+as before: +10 if the seminar name occurs in the message, +5 per keyword.
+
+The automaton is rebuilt only when the table changes. A cheap signature query
+(row count + newest updated_at) runs at most every SEMINAR_QA_CHECK_INTERVAL
+seconds; SEMINAR_QA_MAX_AGE forces a periodic rebuild as a safety net.
+
+Environment:
+    SEMINAR_QA_CHECK_INTERVAL  seconds between change checks (default 30)
+    SEMINAR_QA_MAX_AGE         seconds before an unconditional rebuild (default 3600)
+"""
+
+import os
+import re
+import time
+import threading
+from collections import deque, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+SEMINAR_QA_CHECK_INTERVAL = float(os.getenv('SEMINAR_QA_CHECK_INTERVAL', '30'))
+SEMINAR_QA_MAX_AGE = float(os.getenv('SEMINAR_QA_MAX_AGE', '3600'))
+
+NAME_WEIGHT = 10
+KEYWORD_WEIGHT = 5
+PAGE_SIZE = 1000  # PostgREST returns at most 1000 rows per request by default
+
+_CLEAN_RE = re.compile(r'[^\w\s]')
+
+
+def clean_text(text: str) -> str:
+    """Normalize a message or pattern the way queries are matched"""
+    return _CLEAN_RE.sub('', text or '').lower()
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton mapping patterns to (row, weight) postings"""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[int, ...]] = [()]
+        self.patterns: List[str] = []
+        self.postings: List[List[Tuple[int, int]]] = []
+        self._pattern_ids: Dict[str, int] = {}
+
+    def add(self, pattern: str, row: int, weight: int) -> None:
+        """Register a pattern occurrence for a row (call build() afterwards)"""
+        pattern_id = self._pattern_ids.get(pattern)
+        if pattern_id is None:
+            pattern_id = len(self.patterns)
+            self._pattern_ids[pattern] = pattern_id
+            self.patterns.append(pattern)
+            self.postings.append([])
+            node = 0
+            for char in pattern:
+                nxt = self.goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                node = nxt
+            self.output[node] = self.output[node] + (pattern_id,)
+        self.postings[pattern_id].append((row, weight))
+
+    def build(self) -> None:
+        """Compute failure links breadth-first and merge outputs along them"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self.goto[node].items():
+                queue.append(nxt)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                if self.output[self.fail[nxt]]:
+                    self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find(self, text: str) -> set:
+        """Ids of all patterns occurring in text (one pass)"""
+        found = set()
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class SeminarMatcher:
+    """Scores seminar Q&A rows against a message"""
+
+    def __init__(self, rows: List[Dict]):
+        self.rows = rows
+        self.automaton = KeywordAutomaton()
+        for index, row in enumerate(rows):
+            name = clean_text(row.get('seminar_name'))
+            if name.strip():
+                self.automaton.add(name, index, NAME_WEIGHT)
+            for keyword in row.get('keywords') or []:
+                keyword = clean_text(keyword)
+                if keyword.strip():
+                    self.automaton.add(keyword, index, KEYWORD_WEIGHT)
+        self.automaton.build()
+
+    def match(self, query_text: str, limit: int = 3) -> List[Tuple[int, Dict]]:
+        """Return up to limit (score, row) pairs, best first (ties keep table order)"""
+        scores: Dict[int, int] = defaultdict(int)
+        for pattern_id in self.automaton.find(clean_text(query_text)):
+            for row, weight in self.automaton.postings[pattern_id]:
+                scores[row] += weight
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(score, self.rows[row]) for row, score in best]
+
+
+# Global matcher state
+_matcher: Optional[SeminarMatcher] = None
+_signature = None
+_built_at = 0.0
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _table_signature(db_client) -> Tuple:
+    """Row count and newest updated_at of seminar_qa"""
+    result = db_client.table('seminar_qa')\
+        .select('updated_at', count='exact')\
+        .order('updated_at', desc=True)\
+        .limit(1)\
+        .execute()
+    newest = result.data[0].get('updated_at') if result.data else None
+    return (result.count, newest)
+
+
+def _load_rows(db_client) -> List[Dict]:
+    """Load all Q&A rows, page by page"""
+    rows = []
+    start = 0
+    while True:
+        result = db_client.table('seminar_qa')\
+            .select('id, seminar_name, question, answer, keywords')\
+            .order('created_at')\
+            .order('id')\
+            .range(start, start + PAGE_SIZE - 1)\
+            .execute()
+        page = result.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def get_seminar_matcher(db_client) -> Optional[SeminarMatcher]:
+    """
+    Get the compiled matcher, rebuilding it if seminar_qa changed.
+
+    Returns:
+        The matcher, or None if it was never built and the table can't be read
+    """
+    global _matcher, _signature, _built_at, _checked_at
+
+    now = time.monotonic()
+    if _matcher is not None and now - _checked_at < SEMINAR_QA_CHECK_INTERVAL:
+        return _matcher
+
+    with _lock:
+        if _matcher is not None and now - _checked_at < SEMINAR_QA_CHECK_INTERVAL:
+            return _matcher
+        try:
+            signature = _table_signature(db_client)
+            if _matcher is None or signature != _signature or now - _built_at >= SEMINAR_QA_MAX_AGE:
+                _matcher = SeminarMatcher(_load_rows(db_client))
+                _signature = signature
+                _built_at = now
+        except Exception as e:
+            print(f"Error building seminar matcher: {e}")
+        _checked_at = now
+        return _matcher
+
+
+def invalidate_seminar_matcher() -> None:
+    """Force a rebuild on the next lookup (e.g. after editing Q&A rows)"""
+    global _checked_at, _signature
+    with _lock:
+        _checked_at = 0.0
+        _signature = None
@@ -0,0 +1,90 @@
+"""
+Supabase JWT - local verification of Supabase access tokens
+
+Supabase signs access tokens with the project's JWT secret (HS256). With
+SUPABASE_JWT_SECRET set, tokens are checked here (signature, exp/nbf, aud)
+instead of with a GoTrue round trip per request. Tokens signed with
+asymmetric keys, or any token when no secret is configured, still have to
+be verified by GoTrue (db.verify_supabase_token).
+
+Environment:
+    SUPABASE_JWT_SECRET    project JWT secret (Settings -> API); enables local verification
+    SUPABASE_JWT_AUDIENCE  expected aud claim (default 'authenticated')
+    JWT_LEEWAY_SECONDS     allowed clock skew for exp/nbf (default 30)
+"""
+
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+from typing import Dict, Optional, Tuple
+
+SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET', '')
+SUPABASE_JWT_AUDIENCE = os.getenv('SUPABASE_JWT_AUDIENCE', 'authenticated')
+JWT_LEEWAY_SECONDS = int(os.getenv('JWT_LEEWAY_SECONDS', '30'))
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def decode_unverified(token: str) -> Optional[Tuple[Dict, Dict]]:
+    """
+    Split a JWT into its header and claims without verifying it.
+
+    Returns:
+        (header, claims), or None if the token is not a JWT (e.g. an API key)
+    """
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        header = json.loads(_b64decode(parts[0]))
+        claims = json.loads(_b64decode(parts[1]))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        return None
+    return header, claims
+
+
+def can_verify_locally(header: Dict) -> bool:
+    """True if the token's algorithm can be checked with the configured secret"""
+    return bool(SUPABASE_JWT_SECRET) and header.get('alg') == 'HS256'
+
+
+def verify(token: str, claims: Dict) -> bool:
+    """Check an HS256 token's signature, expiry and audience"""
+    signing_input, _, signature = token.rpartition('.')
+    expected = hmac.new(SUPABASE_JWT_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return False
+    except (ValueError, TypeError):
+        return False
+
+    now = time.time()
+    try:
+        if 'exp' not in claims or float(claims['exp']) + JWT_LEEWAY_SECONDS < now:
+            return False
+        if 'nbf' in claims and float(claims['nbf']) - JWT_LEEWAY_SECONDS > now:
+            return False
+    except (ValueError, TypeError):
+        return False
+
+    if SUPABASE_JWT_AUDIENCE:
+        aud = claims.get('aud')
+        audiences = aud if isinstance(aud, list) else [aud]
+        if SUPABASE_JWT_AUDIENCE not in audiences:
+            return False
+    return True
+
+
+def seconds_until_expiry(claims: Dict) -> float:
+    """Remaining lifetime of a token (0 if it has no usable exp claim)"""
+    try:
+        return max(0.0, float(claims['exp']) - time.time())
+    except (KeyError, ValueError, TypeError):
+        return 0.0
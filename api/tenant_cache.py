@@ -0,0 +1,85 @@
+"""
+Tenant Context Cache - per-company configuration for the chat hot path
+
+Resolves the `companies` row once and derives everything a chat message
+needs from it (company context, widget config, bot config and the compiled
+system prompt). Bundles are kept in a TTL'd LRU keyed by company_id and are
+invalidated whenever company or widget settings are written.
+"""
+
+import os
+from typing import Optional, Dict, Any
+from cache import TTLCache
+
+TENANT_CACHE_TTL = int(os.getenv('TENANT_CACHE_TTL', '60'))  # seconds
+TENANT_CACHE_SIZE = int(os.getenv('TENANT_CACHE_SIZE', '512'))
+
+_tenant_cache = TTLCache(maxsize=TENANT_CACHE_SIZE, ttl=TENANT_CACHE_TTL)
+
+
+def build_tenant_context(company: Dict) -> Dict[str, Any]:
+    """
+    Build the context bundle for a company row.
+
+    Args:
+        company: Full `companies` row (including widget_settings)
+
+    Returns:
+        Dict with company, widget_config, bot_config and system_prompt
+    """
+    from chat_service import get_chat_service
+    from bot.engine import CompanyBot
+
+    widget_config = get_chat_service().build_widget_config(company)
+    bot_config = CompanyBot.build_config(company)
+
+    return {
+        'company': {
+            'id': company.get('id'),
+            'name': company.get('name'),
+            'slug': company.get('slug'),
+            'settings': company.get('settings', {})
+        },
+        'widget_settings': company.get('widget_settings') or {},
+        'widget_config': widget_config,
+        'bot_config': bot_config,
+        'system_prompt': widget_config.get('system_prompt') or bot_config.get('system_prompt')
+    }
+
+
+def get_tenant_context(db_module, company_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the cached context bundle for a company.
+
+    Args:
+        db_module: Database module
+        company_id: Company UUID
+
+    Returns:
+        Context bundle, or None if the company does not exist
+    """
+    if not company_id:
+        return None
+
+    bundle = _tenant_cache.get(company_id)
+    if bundle is not None:
+        return bundle
+
+    company = db_module.get_company_by_id(company_id)
+    if not company:
+        return None
+
+    bundle = build_tenant_context(company)
+    _tenant_cache.set(company_id, bundle)
+    return bundle
+
+
+def invalidate_tenant(company_id: str) -> None:
+    """Drop the cached bundle for a company after its settings changed"""
+    if company_id:
+        _tenant_cache.pop(company_id)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Get tenant cache size and hit/miss counters"""
+    return _tenant_cache.stats()
@@ -0,0 +1,181 @@
+"""
+Request Timing - per-stage latency of chat requests
+
+A StageTimer lives on `flask.g` for the duration of a chat request. Code on
+the request path (app routes, chat service, bot engine) wraps its work in
+`with timing.stage('name'):`; outside a request, or when the route did not
+start a timer, stages are not measured. Stages may nest; each stage reports
+its own time only (a nested stage is subtracted from its parent), so the
+stages of a request add up to at most its total.
+
+Finished requests are emitted as a `Server-Timing` header and recorded in
+a rolling per-stage window shown on the admin system page.
+
+Environment:
+    STAGE_TIMING_WINDOW  samples kept per stage (default 1000)
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any
+
+from flask import g, has_request_context
+
+STAGE_TIMING_WINDOW = int(os.getenv('STAGE_TIMING_WINDOW', '1000'))
+
+# Order of the chat stages in headers and on the admin page
+CHAT_STAGES = ('tenant', 'session', 'user_save', 'widget_config', 'history',
+               'answer_cache', 'knowledge', 'llm', 'tools', 'assistant_save',
+               'analytics')
+
+
+class StageTimer:
+    """Monotonic per-stage timer for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}  # stage -> ms (exclusive)
+        self._stack: List[List[Any]] = []      # [name, start, child ms]
+
+    @contextmanager
+    def stage(self, name: str):
+        entry = [name, time.perf_counter(), 0.0]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = (time.perf_counter() - entry[1]) * 1000
+            self.add(name, elapsed - entry[2])
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def add(self, name: str, ms: float):
+        """Add time to a stage (repeated stages such as two LLM calls accumulate)"""
+        self.durations[name] = self.durations.get(name, 0.0) + ms
+
+    def get(self, name: str) -> Optional[float]:
+        return self.durations.get(name)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. 'tenant;dur=0.4, llm;dur=812.3, total;dur=845.0'"""
+        names = [n for n in CHAT_STAGES if n in self.durations]
+        names += [n for n in self.durations if n not in CHAT_STAGES]
+        parts = [f"{name};dur={self.durations[name]:.1f}" for name in names]
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        return ', '.join(parts)
+
+
+class StageStats:
+    """Rolling window of the last N durations per stage"""
+
+    def __init__(self, window: int = STAGE_TIMING_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, durations: Dict[str, float]):
+        with self._lock:
+            for name, ms in durations.items():
+                samples = self._samples.get(name)
+                if samples is None:
+                    samples = self._samples[name] = deque(maxlen=self.window)
+                samples.append(ms)
+                self._counts[name] = self._counts.get(name, 0) + 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per stage: total count, and avg / p50 / p95 / p99 / max over the window (ms)"""
+        from chat_analytics import LATENCY_BUCKETS_MS, latency_bucket
+
+        with self._lock:
+            snapshot = {name: sorted(samples) for name, samples in self._samples.items()}
+            counts = dict(self._counts)
+
+        bucket_keys = [str(b) for b in LATENCY_BUCKETS_MS] + ['inf']
+        order = list(CHAT_STAGES) + sorted(n for n in snapshot if n not in CHAT_STAGES)
+        stats = {}
+        for name in order:
+            values = snapshot.get(name)
+            if not values:
+                continue
+            histogram = {}
+            for ms in values:
+                bucket = latency_bucket(ms)
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+            stats[name] = {
+                'count': counts[name],
+                'window': len(values),
+                'avg_ms': round(sum(values) / len(values), 1),
+                'p50_ms': round(_quantile(values, 0.5), 1),
+                'p95_ms': round(_quantile(values, 0.95), 1),
+                'p99_ms': round(_quantile(values, 0.99), 1),
+                'max_ms': round(values[-1], 1),
+                'histogram': {key: histogram[key] for key in bucket_keys if key in histogram}
+            }
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+_stage_stats = StageStats()
+
+
+def get_stage_stats() -> StageStats:
+    """Get the process-wide per-stage statistics"""
+    return _stage_stats
+
+
+def start_request_timer() -> Optional[StageTimer]:
+    """Start timing the current request (no-op outside a request context)"""
+    if not has_request_context():
+        return None
+    timer = g._stage_timer = StageTimer()
+    return timer
+
+
+def current_timer() -> Optional[StageTimer]:
+    if not has_request_context():
+        return None
+    return g.get('_stage_timer')
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as stage `name` of the current request, if it is being timed"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def add(name: str, ms: float):
+    """Add time measured elsewhere to a stage of the current request"""
+    timer = current_timer()
+    if timer is not None:
+        timer.add(name, ms)
+
+
+def finish_request_timer(timer: Optional[StageTimer]):
+    """Record a finished request's stages in the rolling statistics"""
+    if timer is None:
+        return
+    durations = dict(timer.durations)
+    durations['total'] = timer.total_ms()
+    _stage_stats.record(durations)
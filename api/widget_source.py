@@ -62,6 +62,7 @@ WIDGET_JS = r"""/**
         primaryColor: '#3D7A77',
         headerTitle: 'Kian',
         showBranding: true,
+        streaming: true,  // Render replies token by token via /api/chat/stream
         privacyPolicyUrl: 'https://vallit.net/datenschutz'  // Privacy policy link
     };
 
@@ -635,6 +636,11 @@ WIDGET_JS = r"""/**
             this.isLoading = true;
             this.showTypingIndicator();
 
+            // Prefer token streaming; fall back to the JSON endpoint if unavailable
+            if (this.supportsStreaming() && await this.streamMessage(message)) {
+                return;
+            }
+
             try {
                 const response = await fetch(`${this.config.apiUrl}/api/chat/message`, {
                     method: 'POST',
@@ -650,6 +656,11 @@ WIDGET_JS = r"""/**
 
                 const data = await response.json();
 
+                if (response.status === 429) {
+                    this.showThrottled(response, data);
+                    return;
+                }
+
                 if (data.status === 'success') {
                     this.removeTypingIndicator();
                     console.log('Received response from API:', data); // DEBUG
@@ -670,6 +681,174 @@ WIDGET_JS = r"""/**
             }
         }
 
+        // Throttled (429): tell the visitor how long to wait instead of a generic error
+        showThrottled(response, data) {
+            const wait = data.retry_after || parseInt(response.headers.get('Retry-After'), 10) || 5;
+            this.removeTypingIndicator();
+            this.addMessage('assistant', `You're sending messages too quickly. Please wait ${wait} seconds and try again.`, false);
+            this.isLoading = false;
+        }
+
+        supportsStreaming() {
+            return this.config.streaming !== false &&
+                typeof window.ReadableStream !== 'undefined' &&
+                typeof window.TextDecoder !== 'undefined';
+        }
+
+        // Stream the reply over SSE from /api/chat/stream.
+        // Returns false if the caller should fall back to /api/chat/message.
+        async streamMessage(message) {
+            let response;
+            try {
+                response = await fetch(`${this.config.apiUrl}/api/chat/stream`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+                    body: JSON.stringify({
+                        widget_id: this.config.widgetId,
+                        company_id: this.config.companyId,
+                        session_id: this.sessionId,
+                        message: message
+                    })
+                });
+            } catch (e) {
+                console.warn('Streaming unavailable, falling back:', e);
+                return false;
+            }
+
+            // Older API without the stream endpoint
+            if (response.status === 404 || response.status === 405) {
+                return false;
+            }
+
+            const stream = { text: '', committed: 0, bubble: null, last: null, action: null };
+
+            try {
+                const contentType = response.headers.get('Content-Type') || '';
+                if (!response.ok || !response.body || !contentType.includes('text/event-stream')) {
+                    const data = await response.json().catch(() => ({}));
+                    if (response.status === 429) {
+                        this.showThrottled(response, data);
+                        return true;
+                    }
+                    throw new Error(data.error || `Stream failed (${response.status})`);
+                }
+
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let finished = false;
+
+                while (!finished) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\n\n');
+                    buffer = events.pop();
+
+                    for (const raw of events) {
+                        const payload = raw.split('\n')
+                            .filter(line => line.startsWith('data:'))
+                            .map(line => line.slice(5).trim())
+                            .join('');
+                        if (!payload) continue;
+
+                        const event = JSON.parse(payload);
+                        if (event.type === 'delta') {
+                            this.appendStreamDelta(stream, event.content || '');
+                        } else if (event.type === 'action') {
+                            stream.action = event.action;
+                        } else if (event.type === 'done') {
+                            stream.action = event.action || stream.action;
+                            finished = true;
+                        } else if (event.type === 'error') {
+                            throw new Error(event.error || 'Stream error');
+                        }
+                    }
+                }
+
+                this.finishStream(stream);
+            } catch (error) {
+                console.error('Stream error:', error);
+                if (stream.text.trim()) {
+                    this.finishStream(stream);
+                } else {
+                    this.removeTypingIndicator();
+                    this.addMessage('assistant', 'Sorry, I encountered an error. Please try again.', false);
+                }
+            }
+
+            this.isLoading = false;
+            return true;
+        }
+
+        appendStreamDelta(stream, delta) {
+            stream.text += delta;
+            const parts = stream.text.split('|||');
+
+            // Every part before the last '|||' is complete: finalize its bubble
+            while (stream.committed < parts.length - 1) {
+                this.updateStreamBubble(stream, parts[stream.committed]);
+                this.commitStreamBubble(stream);
+                stream.committed++;
+                this.showTypingIndicator();
+            }
+
+            this.updateStreamBubble(stream, parts[parts.length - 1]);
+        }
+
+        updateStreamBubble(stream, text) {
+            // Hide a delimiter that is still arriving ('|' or '||')
+            const content = text.replace(/\|{1,2}$/, '').trim();
+            if (!content) return;
+
+            if (!stream.bubble) {
+                this.removeTypingIndicator();
+                const message = {
+                    id: Date.now() + Math.random(),
+                    role: 'assistant',
+                    content: content,
+                    timestamp: new Date().toISOString(),
+                    action: null
+                };
+                stream.bubble = { message, el: this.renderMessage(message, true) };
+            } else {
+                stream.bubble.message.content = content;
+                stream.bubble.el.querySelector('.syntra-message-content').innerHTML = parseMarkdown(content);
+                this.scrollToBottom();
+            }
+        }
+
+        commitStreamBubble(stream) {
+            if (!stream.bubble) return;
+            this.messages.push(stream.bubble.message);
+            this.saveHistory();
+            stream.last = stream.bubble;
+            stream.bubble = null;
+        }
+
+        finishStream(stream) {
+            this.removeTypingIndicator();
+
+            if (!stream.text.trim()) {
+                this.addMessage('assistant', "I'm sorry, I couldn't generate a response.", true, stream.action);
+                return;
+            }
+
+            const parts = stream.text.split('|||');
+            this.updateStreamBubble(stream, parts[parts.length - 1]);
+            this.commitStreamBubble(stream);
+
+            // Attach a tool-triggered action (e.g. date picker) to the final bubble
+            if (stream.action && stream.last) {
+                stream.last.message.action = stream.action;
+                if (stream.action === 'request_date') {
+                    this.renderDatePicker(stream.last.el.querySelector('.syntra-message-group'));
+                }
+                this.saveHistory();
+            }
+        }
+
         async pollForResponse() {
             let attempts = 0;
             const maxAttempts = 30; // 30 seconds
@@ -815,6 +994,7 @@ WIDGET_JS = r"""/**
 
             this.messagesContainer.appendChild(messageEl);
             this.scrollToBottom();
+            return messageEl;
         }
 
         showTypingIndicator() {
@@ -637,6 +637,15 @@
 
                 const data = await response.json();
 
+                if (response.status === 429) {
+                    // Throttled: tell the visitor how long to wait instead of a generic error
+                    const wait = data.retry_after || parseInt(response.headers.get('Retry-After'), 10) || 5;
+                    this.removeTypingIndicator();
+                    this.addMessage('assistant', `You're sending messages too quickly. Please wait ${wait} seconds and try again.`, false);
+                    this.isLoading = false;
+                    return;
+                }
+
                 if (data.status === 'success') {
                     this.removeTypingIndicator();
                     this.addMessage('assistant', data.response);